@@ -97,7 +97,9 @@ case second `m'.  Any other spelling is incorrect.""",
         'enum34',
         'falcon',
         'flufl.bounce',
-        'flufl.i18n',
+        # mailman.core.i18n replaces the private language stack of the
+        # flufl.i18n application.
+        'flufl.i18n>=1.1,<2',
         'flufl.lock',
         'httplib2',
         'lazr.config',
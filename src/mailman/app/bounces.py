@@ -21,6 +21,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'BounceScanner',
     'ProbeVERP',
     'StandardVERP',
     'bounce_message',
@@ -32,10 +33,12 @@ __all__ = [
 import re
 import uuid
 import logging
+import email.message
 
 from email.mime.message import MIMEMessage
 from email.mime.text import MIMEText
 from email.utils import parseaddr
+from flufl.bounce.interfaces import IBounceDetector
 from string import Template
 from zope.component import getUtility
 from zope.interface import implementer
@@ -49,6 +52,7 @@ from mailman.interfaces.pending import IPendable, IPendings
 from mailman.interfaces.subscriptions import ISubscriptionService
 from mailman.utilities.email import split_email
 from mailman.utilities.i18n import make
+from mailman.utilities.modules import find_components
 from mailman.utilities.string import oneline
 
 log = logging.getLogger('mailman.config')
@@ -57,6 +61,30 @@ blog = logging.getLogger('mailman.bounce')
 
 DOT = '.'
 
+# The bounce detectors are tried in this order, the most common bounce formats
+# first.  Any other detectors are tried last.
+DETECTOR_ORDER = (
+    'DSN',
+    'Qmail',
+    'Postfix',
+    'Yahoo',
+    'Caiwireless',
+    'Exchange',
+    'Exim',
+    'Netscape',
+    'Microsoft',
+    'GroupWise',
+    'SMTP32',
+    'AOL',
+    'Sina',
+    'SimpleMatch',
+    'SimpleWarning',
+    'Yale',
+    'LLNL',
+    )
+
+RECEIVED_FROM = re.compile(r'^\s*from\s+(\S+)', re.IGNORECASE)
+
 
 
 def bounce_message(mlist, msg, error=None):
@@ -108,43 +136,54 @@ class _BaseVERPParser:
         self._pattern = pattern
         self._cre = re.compile(pattern, re.IGNORECASE)
 
-    def get_verp(self, mlist, msg):
+    def get_verp(self, mlist, msg, recipient=None):
         """Extract a set of VERP bounce addresses.
 
         :param mlist: The mailing list being checked.
         :type mlist: `IMailingList`
         :param msg: The message being parsed.
         :type msg: `email.message.Message`
+        :param recipient: The envelope recipient of the message, if known.
+            When this is a VERP address, the headers aren't checked.
+        :type recipient: string
         :return: The set of addresses extracted from the VERP headers.
         :rtype: set of strings
         """
         blocal, bdomain = split_email(mlist.bounces_address)
-        values = set()
-        verp_matches = set()
-        for header in ('to', 'delivered-to', 'envelope-to', 'apparently-to'):
-            values.update(msg.get_all(header, []))
-        for field in values:
-            address = parseaddr(field)[1]
-            if not address:
-                # This header was empty.
-                continue
-            mo = self._cre.search(address)
-            if not mo:
-                # This did not match the VERP regexp.
-                continue
-            try:
-                if blocal != mo.group('bounces'):
-                    # This was not a bounce to our mailing list.
+        try:
+            if recipient:
+                original_address = self._match(blocal, recipient)
+                if original_address is not None:
+                    return set([original_address])
+            values = set()
+            verp_matches = set()
+            for header in ('to', 'delivered-to', 'envelope-to',
+                           'apparently-to'):
+                values.update(msg.get_all(header, []))
+            for field in values:
+                address = parseaddr(field)[1]
+                if not address:
+                    # This header was empty.
                     continue
-                original_address = self._get_address(mo)
-            except IndexError:
-                elog.error('Bad VERP pattern: {0}'.format(self._pattern))
-                return set()
-            else:
+                original_address = self._match(blocal, address)
                 if original_address is not None:
                     verp_matches.add(original_address)
+        except IndexError:
+            elog.error('Bad VERP pattern: {0}'.format(self._pattern))
+            return set()
         return verp_matches
 
+    def _match(self, blocal, address):
+        """Return the original address encoded in a VERP address, or None."""
+        mo = self._cre.search(address)
+        if not mo:
+            # This did not match the VERP regexp.
+            return None
+        if blocal != mo.group('bounces'):
+            # This was not a bounce to our mailing list.
+            return None
+        return self._get_address(mo)
+
 
 
 class StandardVERP(_BaseVERPParser):
@@ -175,6 +214,94 @@ class ProbeVERP(_BaseVERPParser):
         return member.address.email
 
 
+
+def _detector_rank(detector):
+    try:
+        return DETECTOR_ORDER.index(detector.__name__)
+    except ValueError:
+        return len(DETECTOR_ORDER)
+
+
+def _fingerprint(msg):
+    """Identify the MTA which sent a bounce, if possible.
+
+    This is the Reporting-MTA of a DSN, or else the host the bounce was
+    received from.
+    """
+    if msg.get_content_type() == 'multipart/report':
+        for part in msg.walk():
+            if part.get_content_type() != 'message/delivery-status':
+                continue
+            blocks = part.get_payload()
+            if not isinstance(blocks, list):
+                continue
+            for block in blocks:
+                mta = email.message.Message.get(block, 'reporting-mta')
+                if mta:
+                    return 'reporting-mta:' + mta.strip().lower()
+    received = email.message.Message.get(msg, 'received')
+    if received:
+        mo = RECEIVED_FROM.match(received)
+        if mo:
+            return 'received:' + mo.group(1).lower()
+    return None
+
+
+class BounceScanner:
+    """Find the bouncing addresses in a bounce message.
+
+    Unlike `flufl.bounce.all_failures()`, which runs every bounce detector
+    on every bounce, the detectors are tried one at a time until one of them
+    finds permanent failures.  An MTA always bounces in the same format, so
+    the detector which found the permanent failures in the last bounce from
+    an MTA is tried first for its next one.
+    """
+
+    def __init__(self, max_fingerprints=1000):
+        """Create the scanner.
+
+        :param max_fingerprints: The maximum number of MTAs for which to
+            remember the detector.
+        :type max_fingerprints: int
+        """
+        self._detectors = sorted(
+            find_components('flufl.bounce._detectors', IBounceDetector),
+            key=_detector_rank)
+        self._max_fingerprints = max_fingerprints
+        self._preferred = {}
+
+    def scan(self, msg):
+        """Detect the bouncing addresses.
+
+        :param msg: The bounce message.
+        :type msg: `email.message.Message`
+        :return: The temporarily failing addresses found by the detectors
+            which were run, and the permanently failing addresses found by
+            the first detector to find any.  If no detector finds permanent
+            failures, these are the temporary failures found by all the
+            detectors, and the empty set.
+        :rtype: 2-tuple of (set of strings, set of strings)
+        """
+        fingerprint = _fingerprint(msg)
+        preferred = self._preferred.get(fingerprint)
+        detectors = self._detectors
+        if preferred is not None:
+            detectors = [preferred] + [detector for detector in detectors
+                                       if detector is not preferred]
+        temporary_failures = set()
+        for detector in detectors:
+            temporary, permanent = detector().process(msg)
+            temporary_failures.update(temporary)
+            if len(permanent) == 0:
+                continue
+            if fingerprint is not None and detector is not preferred:
+                if len(self._preferred) >= self._max_fingerprints:
+                    self._preferred.clear()
+                self._preferred[fingerprint] = detector
+            return temporary_failures, set(permanent)
+        return temporary_failures, set()
+
+
 
 @implementer(IPendable)
 class _ProbePendable(dict):
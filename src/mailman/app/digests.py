@@ -0,0 +1,127 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Digest functions."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'bump_digest_number_and_volume',
+    'digest_store',
+    'send_digest',
+    ]
+
+
+import os
+
+from mailman.config import config
+from mailman.email.message import Message
+from mailman.interfaces.digests import DigestFrequency
+from mailman.utilities.datetime import now as right_now
+from mailman.utilities.digeststore import DigestStore
+
+
+
+def digest_store(mlist):
+    """The store of the messages collected for the mailing list's digest.
+
+    Any messages which an older version of Mailman collected in the mailing
+    list's digest.mmdf mailbox are moved into the store.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :return: The mailing list's digest store.
+    :rtype: `DigestStore`
+    """
+    store = DigestStore(os.path.join(mlist.data_path, 'digest'))
+    mailbox_path = os.path.join(mlist.data_path, 'digest.mmdf')
+    if os.path.exists(mailbox_path):
+        store.add_mailbox(mailbox_path)
+    return store
+
+
+def send_digest(mlist, threshold=None):
+    """Send the mailing list's digest.
+
+    The messages collected for the digest are moved aside and a marker message
+    is placed in the digest queue, as a trigger for the digest runner to build
+    and send the digest.  The digest number (and maybe the volume) is bumped.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :param threshold: If given, only send the digest if the messages collected
+        for it are at least this many bytes.
+    :type threshold: int
+    :return: True if the digest is sent, False if there was nothing to send.
+    :rtype: bool
+    """
+    volume = mlist.volume
+    digest_number = mlist.next_digest_number
+    path = os.path.join(
+        mlist.data_path, 'digest.{0}.{1}'.format(volume, digest_number))
+    digest = digest_store(mlist).cut(path, threshold)
+    if digest is None:
+        return False
+    bump_digest_number_and_volume(mlist)
+    config.switchboards['digest'].enqueue(
+        Message(),
+        listname=mlist.fqdn_listname,
+        digest_path=digest.path,
+        volume=volume,
+        digest_number=digest_number)
+    return True
+
+
+def bump_digest_number_and_volume(mlist):
+    """Bump the digest number and volume."""
+    now = right_now()
+    if mlist.digest_last_sent_at is None:
+        # There has been no previous digest.
+        bump = False
+    elif mlist.digest_volume_frequency == DigestFrequency.yearly:
+        bump = (now.year > mlist.digest_last_sent_at.year)
+    elif mlist.digest_volume_frequency == DigestFrequency.monthly:
+        # Monthly.
+        this_month = now.year * 100 + now.month
+        digest_month = (mlist.digest_last_sent_at.year * 100 +
+                        mlist.digest_last_sent_at.month)
+        bump = (this_month > digest_month)
+    elif mlist.digest_volume_frequency == DigestFrequency.quarterly:
+        # Quarterly.
+        this_quarter = now.year * 100 + (now.month - 1) // 4
+        digest_quarter = (mlist.digest_last_sent_at.year * 100 +
+                          (mlist.digest_last_sent_at.month - 1) // 4)
+        bump = (this_quarter > digest_quarter)
+    elif mlist.digest_volume_frequency == DigestFrequency.weekly:
+        this_week = now.year * 100 + now.isocalendar()[1]
+        digest_week = (mlist.digest_last_sent_at.year * 100 +
+                       mlist.digest_last_sent_at.isocalendar()[1])
+        bump = (this_week > digest_week)
+    elif mlist.digest_volume_frequency == DigestFrequency.daily:
+        bump = (now.toordinal() > mlist.digest_last_sent_at.toordinal())
+    else:
+        raise AssertionError(
+            'Bad DigestFrequency: {0}'.format(
+                mlist.digest_volume_frequency))
+    if bump:
+        mlist.volume += 1
+        mlist.next_digest_number = 1
+    else:
+        # Just bump the digest number.
+        mlist.next_digest_number += 1
+    mlist.digest_last_sent_at = now
@@ -31,6 +31,7 @@ from mailman.app import (
     domain, membership, moderator, registrar, subscriptions)
 from mailman.core import i18n, switchboard
 from mailman.languages import manager as language_manager
+from mailman.model import listmanager
 from mailman.styles import manager as style_manager
 from mailman.utilities import passwords
 
@@ -42,6 +43,7 @@ def initialize():
         domain.handle_DomainDeletingEvent,
         i18n.handle_ConfigurationUpdatedEvent,
         language_manager.handle_ConfigurationUpdatedEvent,
+        listmanager.handle_ListEvent,
         membership.handle_SubscriptionEvent,
         moderator.handle_ListDeletingEvent,
         passwords.handle_ConfigurationUpdatedEvent,
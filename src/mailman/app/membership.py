@@ -145,7 +145,9 @@ def delete_member(mlist, email, admin_notif=None, userack=None):
     # ...and to the administrator.
     if admin_notif:
         user = getUtility(IUserManager).get_user(email)
-        display_name = user.display_name
+        # The member may have subscribed with an address not linked to any
+        # user.
+        display_name = ('' if user is None else user.display_name)
         subject = _('$mlist.display_name unsubscription notification')
         text = make('adminunsubscribeack.txt',
                     mailing_list=mlist,
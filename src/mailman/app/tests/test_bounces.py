@@ -22,6 +22,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestBounceMessage',
+    'TestBounceScanner',
     'TestMaybeForward',
     'TestProbe',
     'TestSendProbe',
@@ -39,7 +40,8 @@ import unittest
 from zope.component import getUtility
 
 from mailman.app.bounces import (
-    ProbeVERP, StandardVERP, bounce_message, maybe_forward, send_probe)
+    BounceScanner, ProbeVERP, StandardVERP, bounce_message, maybe_forward,
+    send_probe)
 from mailman.app.lifecycle import create_list
 from mailman.app.membership import add_member
 from mailman.config import config
@@ -189,6 +191,147 @@ Apparently-To: test-bounces+bart=example.org@example.com
         self.assertEqual(self._verper.get_verp(self._mlist, msg),
                          set(['anne@example.org', 'bart@example.org']))
 
+    def test_verp_in_envelope_recipient(self):
+        # A VERP'd envelope recipient is used instead of the headers.
+        msg = mfs("""\
+From: postmaster@example.com
+To: test-bounces+bart=example.org@example.com
+
+""")
+        self.assertEqual(
+            self._verper.get_verp(
+                self._mlist, msg, 'test-bounces+anne=example.org@example.com'),
+            set(['anne@example.org']))
+
+    def test_envelope_recipient_not_verp(self):
+        # The headers are checked when the envelope recipient isn't VERP'd.
+        msg = mfs("""\
+From: postmaster@example.com
+To: test-bounces+bart=example.org@example.com
+
+""")
+        self.assertEqual(
+            self._verper.get_verp(
+                self._mlist, msg, 'test-bounces@example.com'),
+            set(['bart@example.org']))
+
+
+
+class TestBounceScanner(unittest.TestCase):
+    """Test the bounce scanner."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._scanner = BounceScanner()
+
+    def _dsn(self, action, recipient):
+        return mfs("""\
+From: mail-daemon@example.com
+To: test-bounces@example.com
+Received: from mx.example.org by mail.example.com
+Content-Type: multipart/report; report-type=delivery-status; boundary=AAA
+MIME-Version: 1.0
+
+--AAA
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; MX.example.org
+
+Action: {0}
+Original-Recipient: rfc822; {1}
+
+--AAA--
+""".format(action, recipient))
+
+    def test_permanent_failure(self):
+        temporary, permanent = self._scanner.scan(
+            self._dsn('fail', 'anne@example.org'))
+        self.assertEqual(temporary, set())
+        self.assertEqual(permanent, set(['anne@example.org']))
+
+    def test_temporary_failure(self):
+        temporary, permanent = self._scanner.scan(
+            self._dsn('delayed', 'anne@example.org'))
+        self.assertEqual(temporary, set(['anne@example.org']))
+        self.assertEqual(permanent, set())
+
+    def test_unrecognized(self):
+        msg = mfs("""\
+From: mail-daemon@example.com
+To: test-bounces@example.com
+
+Nothing to see here.
+""")
+        self.assertEqual(self._scanner.scan(msg), (set(), set()))
+
+    def test_detector_remembered(self):
+        # The detector which recognized the bounce is tried first for the next
+        # bounce from the same MTA.
+        self._scanner.scan(self._dsn('fail', 'anne@example.org'))
+        fingerprint = 'reporting-mta:dns; mx.example.org'
+        preferred = self._scanner._preferred[fingerprint]
+        self.assertEqual(preferred.__name__, 'DSN')
+        # A bounce in the same format from the same MTA is still recognized.
+        temporary, permanent = self._scanner.scan(
+            self._dsn('fail', 'bart@example.org'))
+        self.assertEqual(permanent, set(['bart@example.org']))
+
+    def test_temporary_failures_dont_stop_the_scan(self):
+        # The scan goes on until a detector finds permanent failures, and
+        # only that detector is remembered.
+        class Temporary:
+            def process(self, msg):
+                return set(['anne@example.org']), set()
+        class Permanent:
+            def process(self, msg):
+                return set(), set(['bart@example.org'])
+        self._scanner._detectors = [Temporary, Permanent]
+        temporary, permanent = self._scanner.scan(
+            self._dsn('fail', 'cris@example.org'))
+        self.assertEqual(temporary, set(['anne@example.org']))
+        self.assertEqual(permanent, set(['bart@example.org']))
+        self.assertEqual(self._scanner._preferred.values(), [Permanent])
+
+    def test_no_permanent_failures(self):
+        # Without permanent failures, the temporary failures found by all the
+        # detectors are returned, and no detector is remembered.
+        class Anne:
+            def process(self, msg):
+                return set(['anne@example.org']), set()
+        class Bart:
+            def process(self, msg):
+                return set(['bart@example.org']), set()
+        self._scanner._detectors = [Anne, Bart]
+        temporary, permanent = self._scanner.scan(
+            self._dsn('fail', 'cris@example.org'))
+        self.assertEqual(temporary,
+                         set(['anne@example.org', 'bart@example.org']))
+        self.assertEqual(permanent, set())
+        self.assertEqual(self._scanner._preferred, {})
+
+    def test_remembered_detectors_are_bounded(self):
+        scanner = BounceScanner(max_fingerprints=1)
+        scanner.scan(self._dsn('fail', 'anne@example.org'))
+        msg = mfs("""\
+From: mail-daemon@example.com
+To: test-bounces@example.com
+Received: from mx.example.net by mail.example.com
+Content-Type: multipart/report; report-type=delivery-status; boundary=AAA
+MIME-Version: 1.0
+
+--AAA
+Content-Type: message/delivery-status
+
+Action: fail
+Original-Recipient: rfc822; bart@example.net
+
+--AAA--
+""")
+        scanner.scan(msg)
+        self.assertEqual(list(scanner._preferred),
+                         ['received:mx.example.net'])
+
 
 
 class TestSendProbe(unittest.TestCase):
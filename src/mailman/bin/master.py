@@ -28,6 +28,7 @@ __all__ = [
 
 import os
 import sys
+import time
 import errno
 import signal
 import socket
@@ -39,6 +40,7 @@ from flufl.lock import Lock, NotLockedError, TimeOutError
 from lazr.config import as_boolean
 
 from mailman.config import config
+from mailman.core import metrics
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
 from mailman.options import Options
@@ -48,6 +50,9 @@ DOT = '.'
 LOCK_LIFETIME = timedelta(days=1, hours=6)
 SECONDS_IN_A_DAY = 86400
 SUBPROC_START_WAIT = timedelta(seconds=20)
+# How often, in seconds, the master checks the depth of the queues whose
+# runners it scales.
+SCALE_INTERVAL = 5
 
 
 
@@ -69,13 +74,14 @@ and SIGUSR1 all cause a runner to exit cleanly.  The master will restart
 runners that have exited due to a SIGUSR1 or some kind of other exit condition
 (say because of an uncaught exception).  SIGHUP causes the master and the
 runners to close their log files, and reopen then upon the next printed
-message.
+message.  SIGUSR2 starts profiling a runner, and stops it again, leaving the
+profile statistics in the log directory.
 
-The master also responds to SIGINT, SIGTERM, SIGUSR1 and SIGHUP, which it
-simply passes on to the runners.  Note that the master will close and reopen
-its own log files on receipt of a SIGHUP.  The master also leaves its own
-process id in the file `data/master.pid` but you normally don't need to use
-this pid directly.""")
+The master also responds to SIGINT, SIGTERM, SIGUSR1, SIGUSR2 and SIGHUP,
+which it simply passes on to the runners.  Note that the master will close
+and reopen its own log files on receipt of a SIGHUP.  The master also leaves
+its own process id in the file `data/master.pid` but you normally don't need
+to use this pid directly.""")
 
     def add_options(self):
         """See `Options`."""
@@ -273,6 +279,18 @@ class PIDWatcher:
         """
         return self._pids.pop(pid)
 
+    def get(self, pid):
+        """Return existing process information.
+
+        :param pid: The process id.
+        :type pid: int
+        :return: The process information, or None if the process id is not
+            being tracked.
+        :rtype: 4-tuple consisting of
+            (runner-name, slice-number, slice-count, restart-count)
+        """
+        return self._pids.get(pid)
+
     def drop(self, pid):
         """Remove and return existing process information.
 
@@ -298,6 +316,14 @@ class Loop:
         self._restartable = restartable
         self._config_file = config_file
         self._kids = PIDWatcher()
+        # Runners which claim their queue files are started and stopped
+        # according to the depth of their queue.  This maps their names to
+        # the minimum and maximum number of instances, and the number of
+        # waiting files per instance.
+        self._scalable = {}
+        # The process ids of the runners which have been asked to stop
+        # because their queue has drained.
+        self._retiring = set()
 
     def install_signal_handlers(self):
         """Install various signals handlers for control from the master."""
@@ -323,15 +349,24 @@ class Loop:
                 os.kill(pid, signal.SIGUSR1)
             log.info('Master watcher caught SIGUSR1.  Exiting.')
         signal.signal(signal.SIGUSR1, sigusr1_handler)
+        # SIGUSR2 toggles profiling the runners.
+        def sigusr2_handler(signum, frame):
+            for pid in self._kids:
+                os.kill(pid, signal.SIGUSR2)
+            log.info('Master watcher caught SIGUSR2.  Toggling profiling.')
+        signal.signal(signal.SIGUSR2, sigusr2_handler)
         # SIGTERM is what init will kill this process with when changing run
         # levels.  It's also the signal 'bin/mailman stop' uses.
         def sigterm_handler(signum, frame):
+            # Don't start any more runners while the others are stopping.
+            self._scalable.clear()
             for pid in self._kids:
                 os.kill(pid, signal.SIGTERM)
             log.info('Master watcher caught SIGTERM.  Exiting.')
         signal.signal(signal.SIGTERM, sigterm_handler)
         # SIGINT is what control-C gives.
         def sigint_handler(signum, frame):
+            self._scalable.clear()
             for pid in self._kids:
                 os.kill(pid, signal.SIGINT)
             log.info('Master watcher caught SIGINT.  Restarting.')
@@ -405,18 +440,99 @@ class Loop:
             if not as_boolean(runner_config.start):
                 continue
             # Find out how many runners to instantiate.  This must be a power
-            # of 2.
+            # of 2, unless the runners claim their files.
             count = int(runner_config.instances)
-            assert (count & (count - 1)) == 0, (
-                'Runner "{0}", not a power of 2: {1}'.format(name, count))
+            if (as_boolean(runner_config.claim_files) and
+                    name in config.switchboards):
+                maximum = int(runner_config.max_instances)
+                if maximum > count:
+                    self._scalable[name] = (
+                        count, maximum,
+                        int(runner_config.files_per_instance))
+            else:
+                assert (count & (count - 1)) == 0, (
+                    'Runner "{0}", not a power of 2: {1}'.format(name, count))
             for slice_number in range(count):
-                # runner name, slice #, # of slices, restart count
-                info = (name, slice_number, count, 0)
-                spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
-                pid = self._start_runner(spec)
-                log = logging.getLogger('mailman.runner')
-                log.debug('[{0:d}] {1}'.format(pid, spec))
-                self._kids.add(pid, info)
+                self._start_instance(name, slice_number, count)
+
+    def _start_instance(self, name, slice_number, count, restarts=0):
+        """Start one instance of a runner, and keep track of it."""
+        # runner name, slice #, # of slices, restart count
+        info = (name, slice_number, count, restarts)
+        spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
+        pid = self._start_runner(spec)
+        log = logging.getLogger('mailman.runner')
+        log.debug('[{0:d}] {1}'.format(pid, spec))
+        self._kids.add(pid, info)
+
+    def _instances(self, name):
+        """Return the slice numbers and process ids of a runner's instances.
+
+        Instances which are stopping are not included.
+        """
+        instances = {}
+        for pid in self._kids:
+            info = self._kids.get(pid)
+            if (info is not None and info[0] == name and
+                    pid not in self._retiring):
+                instances[info[1]] = pid
+        return instances
+
+    def scale_runners(self):
+        """Start or stop runners according to the depth of their queues.
+
+        For every runner which claims its queue files and may run more
+        instances than configured, enough instances are started to handle the
+        files waiting in its queue.  When the queue drains, the extra
+        instances are stopped again, one at a time.
+        """
+        log = logging.getLogger('mailman.runner')
+        for name, (minimum, maximum, per_instance) in self._scalable.items():
+            switchboard = config.switchboards[name]
+            # Files claimed by instances which died are waiting too.
+            switchboard.recover_claims()
+            depth = len(switchboard.files)
+            wanted = (depth + per_instance - 1) // per_instance
+            wanted = max(minimum, min(maximum, wanted))
+            instances = self._instances(name)
+            if len(instances) < wanted:
+                log.info('Starting {0:d} more {1} runners for {2:d} '
+                         'files'.format(wanted - len(instances), name, depth))
+                slice_number = 0
+                while len(instances) < wanted:
+                    if slice_number not in instances:
+                        self._start_instance(name, slice_number, maximum)
+                        instances[slice_number] = None
+                    slice_number += 1
+            elif len(instances) > wanted:
+                slice_number = max(instances)
+                pid = instances[slice_number]
+                log.info('Stopping {0} runner {1:d} for {2:d} files'.format(
+                    name, slice_number, depth))
+                self._retiring.add(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError as error:
+                    if error.errno != errno.ESRCH:
+                        raise
+
+    def _wait(self):
+        """Wait for a runner to exit.
+
+        While waiting, the runners sharing their queues are scaled
+        periodically.
+
+        :return: The process id and exit status of the runner.
+        :rtype: 2-tuple of (int, int)
+        """
+        if len(self._scalable) == 0:
+            return os.wait()
+        while True:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid != 0:
+                return pid, status
+            self.scale_runners()
+            time.sleep(SCALE_INTERVAL)
 
     def _pause(self):
         """Sleep until a signal is received."""
@@ -433,10 +549,11 @@ class Loop:
         """
         log = logging.getLogger('mailman.runner')
         log.info('Master started')
-        self._pause()
+        if len(self._scalable) == 0:
+            self._pause()
         while True:
             try:
-                pid, status = os.wait()
+                pid, status = self._wait()
             except OSError as error:
                 # No children?  We're done.
                 if error.errno == errno.ECHILD:
@@ -459,13 +576,24 @@ class Loop:
             # command line switch was not given.  This lets us better handle
             # runaway restarts (e.g.  if the subprocess had a syntax error!)
             rname, slice_number, count, restarts = self._kids.pop(pid)
+            # A runner which didn't exit cleanly leaves its metrics behind.
+            metrics.forget(rname, pid)
             config_name = 'runner.' + rname
+            runner_config = getattr(config, config_name)
+            if (as_boolean(runner_config.claim_files) and
+                    rname in config.switchboards):
+                # Put the files the runner had claimed back into the queue.
+                config.switchboards[rname].recover_claims()
             restart = False
             if why == signal.SIGUSR1 and self._restartable:
                 restart = True
+            if pid in self._retiring:
+                # The runner was stopped because its queue drained.
+                self._retiring.discard(pid)
+                restart = False
             # Have we hit the maximum number of restarts?
             restarts += 1
-            max_restarts = int(getattr(config, config_name).max_restarts)
+            max_restarts = int(runner_config.max_restarts)
             if restarts > max_restarts:
                 restart = False
             # Are we permanently non-restartable?
@@ -482,10 +610,7 @@ Runner {0} reached maximum restart limit of {1:d}, not restarting.""",
             # Now perhaps restart the process unless it exited with a
             # SIGTERM or we aren't restarting.
             if restart:
-                spec = '{0}:{1:d}:{2:d}'.format(rname, slice_number, count)
-                new_pid = self._start_runner(spec)
-                new_info = (rname, slice_number, count, restarts)
-                self._kids.add(new_pid, new_info)
+                self._start_instance(rname, slice_number, count, restarts)
         log.info('Master stopped')
 
     def cleanup(self):
@@ -22,16 +22,24 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestMasterLock',
+    'TestScaling',
     ]
 
 
 import os
 import errno
+import signal
 import tempfile
 import unittest
 
 from flufl.lock import Lock
+from mock import patch
+
 from mailman.bin import master
+from mailman.config import config
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
 
 
 
@@ -71,3 +79,74 @@ class TestMasterLock(unittest.TestCase):
             my_lock.unlock()
         self.assertEqual(state, master.WatcherState.conflict)
         # XXX test stale_lock and host_mismatch states.
+
+
+
+class TestScaling(unittest.TestCase):
+    """Test scaling the runners which claim their queue files."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._loop = master.Loop()
+        self._specs = {}
+        pids = iter(range(1000, 2000))
+        def start_runner(spec):
+            pid = next(pids)
+            self._specs[pid] = spec
+            return pid
+        self._loop._start_runner = start_runner
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+
+A test message.
+""")
+
+    def tearDown(self):
+        switchboard = config.switchboards['virgin']
+        for filebase in switchboard.files:
+            switchboard.dequeue(filebase)
+            switchboard.finish(filebase)
+
+    def _running(self):
+        return sorted(self._specs[pid]
+                      for pid in self._loop._instances('virgin').values())
+
+    @configuration('runner.virgin', claim_files='yes', instances=3)
+    def test_not_power_of_2(self):
+        # Any number of runners can claim files from the same queue.
+        self._loop.start_runners(['virgin'])
+        self.assertEqual(self._running(),
+                         ['virgin:0:3', 'virgin:1:3', 'virgin:2:3'])
+
+    @configuration('runner.virgin', claim_files='yes', instances=1,
+                   max_instances=3, files_per_instance=2)
+    def test_scale_up_and_down(self):
+        self._loop.start_runners(['virgin'])
+        self.assertEqual(self._running(), ['virgin:0:1'])
+        # Runners are added as the queue backs up.
+        switchboard = config.switchboards['virgin']
+        filebases = [switchboard.enqueue(self._msg) for i in range(5)]
+        self._loop.scale_runners()
+        self.assertEqual(self._running(),
+                         ['virgin:0:1', 'virgin:1:3', 'virgin:2:3'])
+        # As the queue drains, the extra runners are stopped one at a time.
+        for filebase in filebases[:4]:
+            switchboard.dequeue(filebase)
+            switchboard.finish(filebase)
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.scale_runners()
+            stopping = kill.call_args[0]
+        self.assertEqual(kill.call_count, 1)
+        self.assertEqual(self._specs[stopping[0]], 'virgin:2:3')
+        self.assertEqual(stopping[1], signal.SIGTERM)
+        self.assertEqual(self._running(), ['virgin:0:1', 'virgin:1:3'])
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.scale_runners()
+        self.assertEqual(self._running(), ['virgin:0:1'])
+        # The configured number of runners always keeps running.
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.scale_runners()
+        self.assertEqual(kill.call_count, 0)
+        self.assertEqual(self._running(), ['virgin:0:1'])
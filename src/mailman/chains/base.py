@@ -66,6 +66,10 @@ class TerminalChainBase:
 
     The method is called '_process()' and must be provided by the subclass.
     """
+
+    # The links are created the first time they are needed.
+    _links = None
+
     def _process(self, mlist, msg, msgdata):
         """Process the message for the given mailing list.
 
@@ -83,11 +87,17 @@ class TerminalChainBase:
 
     def __iter__(self):
         """See `IChainIterator`."""
-        truth = config.rules['truth']
-        # First, yield a link that always runs the process method.
-        yield Link(truth, LinkAction.run, function=self._process)
-        # Now yield a rule that stops all processing.
-        yield Link(truth, LinkAction.stop)
+        # The links are the same every time, so only create them once.
+        links = self._links
+        if links is None:
+            truth = config.rules['truth']
+            links = self._links = (
+                # First, a link that always runs the process method.
+                Link(truth, LinkAction.run, function=self._process),
+                # Then a link that stops all processing.
+                Link(truth, LinkAction.stop),
+                )
+        return iter(links)
 
 
 
@@ -27,6 +27,7 @@ __all__ = [
 
 import re
 import logging
+import threading
 
 from zope.interface import implementer
 
@@ -70,6 +71,7 @@ class HeaderMatchRule:
     def __init__(self, header, pattern):
         self.header = header
         self.pattern = pattern
+        self.regex = re.compile(pattern, re.IGNORECASE)
         self.name = 'header-match-{0:02}'.format(HeaderMatchRule._count)
         HeaderMatchRule._count += 1
         self.description = '{0}: {1}'.format(header, pattern)
@@ -89,11 +91,97 @@ class HeaderMatchRule:
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
         for value in msg.get_all(self.header, []):
-            if re.search(self.pattern, value, re.IGNORECASE):
+            if self.regex.search(value):
                 return True
         return False
 
 
+@implementer(IRule)
+class MissedHeaderMatchRule:
+    """Stand in for a header matching rule which is known not to match."""
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.name = rule.name
+        self.description = rule.description
+        self.record = rule.record
+        self.header = rule.header
+        self.pattern = rule.pattern
+
+    def check(self, mlist, msg, msgdata):
+        """See `IRule`."""
+        return False
+
+
+
+class HeaderMatcher:
+    """All the patterns checking one header, merged into one expression.
+
+    Most messages match none of the header checks.  Searching each header
+    value once for all of its patterns tells when none of them can match,
+    without checking each of the rules separately.
+    """
+
+    def __init__(self, rules):
+        """Merge the patterns of some rules.
+
+        :param rules: The rules, all checking the same header.
+        :type rules: sequence of `HeaderMatchRule`
+        """
+        self.header = rules[0].header
+        self.regex = re.compile(
+            '|'.join('(?:{0})'.format(rule.pattern) for rule in rules),
+            re.IGNORECASE)
+
+    @staticmethod
+    def can_merge(rule):
+        """Can the pattern of this rule be merged with other patterns?
+
+        Patterns with groups could contain backreferences, and inline flags
+        would apply to all the merged patterns, so those are left alone.
+        """
+        return rule.regex.groups == 0 and rule.regex.flags == re.IGNORECASE
+
+    def search(self, msg):
+        """Does any pattern match any value of the header?"""
+        for value in msg.get_all(self.header, []):
+            if self.regex.search(value):
+                return True
+        return False
+
+
+class HeaderMatchPlan:
+    """The compiled header checks for a mailing list.
+
+    :ivar links: Triples of each header check's link, the `HeaderMatcher`
+        checking its header or None when the check is done on its own, and
+        the link to use when the matcher does not match.
+    :ivar owned: The rules which were created for this plan alone.
+    """
+
+    def __init__(self, links, owned, last_link):
+        self.owned = owned
+        self.last_link = last_link
+        by_header = {}
+        for link in links:
+            if HeaderMatcher.can_merge(link.rule):
+                by_header.setdefault(
+                    link.rule.header.lower(), []).append(link.rule)
+        matchers = {}
+        for header, rules in by_header.items():
+            # There's nothing to gain from merging a single pattern.
+            if len(rules) > 1:
+                matcher = HeaderMatcher(rules)
+                for rule in rules:
+                    matchers[rule.name] = matcher
+        self.links = []
+        for link in links:
+            matcher = matchers.get(link.rule.name)
+            missed = (None if matcher is None
+                      else Link(MissedHeaderMatchRule(link.rule), link.action))
+            self.links.append((link, matcher, missed))
+
+
 
 class HeaderMatchChain(Chain):
     """Default header matching chain.
@@ -108,6 +196,12 @@ class HeaderMatchChain(Chain):
         # configuration file, the database, and any explicitly added header
         # checks (via the .extend() method).
         self._extended_links = []
+        # The links are compiled into a plan for each mailing list, which is
+        # reused until the header checks change.  The links for the
+        # configuration file are shared by all the plans.
+        self._lock = threading.Lock()
+        self._plans = {}
+        self._site_links = (None, [])
 
     def extend(self, header, pattern):
         """Extend the existing header matches.
@@ -117,6 +211,7 @@ class HeaderMatchChain(Chain):
             match is not anchored and is done case-insensitively.
         """
         self._extended_links.append(make_link(header, pattern))
+        self._plans.clear()
 
     def flush(self):
         """See `IMutableChain`."""
@@ -126,11 +221,19 @@ class HeaderMatchChain(Chain):
             if rule_name.startswith('header-match-'):
                 del config.rules[rule_name]
         self._extended_links = []
+        self._plans.clear()
+        self._site_links = (None, [])
 
-    def get_links(self, mlist, msg, msgdata):
-        """See `IChain`."""
-        # First return all the configuration file links.
-        for line in config.antispam.header_checks.splitlines():
+    def _get_site_links(self):
+        # Return the links for the configuration file's header checks.
+        header_checks = config.antispam.header_checks
+        saved_checks, links = self._site_links
+        if header_checks == saved_checks:
+            return links
+        for link in links:
+            config.rules.pop(link.rule.name, None)
+        links = []
+        for line in header_checks.splitlines():
             if len(line.strip()) == 0:
                 continue
             parts = line.split(':', 1)
@@ -138,15 +241,54 @@ class HeaderMatchChain(Chain):
                 log.error('Configuration error: [antispam]header_checks '
                           'contains bogus line: {0}'.format(line))
                 continue
-            yield make_link(parts[0], parts[1].lstrip())
-        # Then return all the list-specific header matches.
-        # Python 3.3: Use 'yield from'
-        for entry in mlist.header_matches:
-            yield make_link(*entry)
-        # Then return all the explicitly added links.
-        for link in self._extended_links:
+            links.append(make_link(parts[0], parts[1].lstrip()))
+        self._site_links = (header_checks, links)
+        return links
+
+    def _get_plan(self, mlist):
+        # Return the compiled plan for the mailing list, compiling it again
+        # if any of its header checks have changed.
+        key = (config.antispam.header_checks,
+               config.antispam.jump_chain,
+               tuple(tuple(entry) for entry in mlist.header_matches or ()))
+        saved_key, plan = self._plans.get(mlist.list_id, (None, None))
+        if key == saved_key:
+            return plan
+        with self._lock:
+            # Another thread may have compiled the plan in the meantime.
+            saved_key, plan = self._plans.get(mlist.list_id, (None, None))
+            if key == saved_key:
+                return plan
+            # First all the configuration file links, then all the
+            # list-specific header matches, then all the explicitly added
+            # links.
+            site_links = self._get_site_links()
+            list_links = [make_link(*entry) for entry in key[2]]
+            # Finally, if any of the above rules matched, jump to the chain
+            # defined in the configuration file.
+            last_link = Link(config.rules['any'], LinkAction.jump,
+                             config.chains[config.antispam.jump_chain])
+            new_plan = HeaderMatchPlan(
+                site_links + list_links + self._extended_links,
+                [link.rule for link in list_links], last_link)
+            if plan is not None:
+                for rule in plan.owned:
+                    config.rules.pop(rule.name, None)
+            self._plans[mlist.list_id] = (key, new_plan)
+        return new_plan
+
+    def get_links(self, mlist, msg, msgdata):
+        """See `IChain`."""
+        plan = self._get_plan(mlist)
+        # Search each merged header at most once per message.
+        searched = {}
+        for link, matcher, missed in plan.links:
+            if matcher is not None:
+                matched = searched.get(matcher)
+                if matched is None:
+                    matched = searched[matcher] = matcher.search(msg)
+                if not matched:
+                    yield missed
+                    continue
             yield link
-        # Finally, if any of the above rules matched, jump to the chain
-        # defined in the configuration file.
-        yield Link(config.rules['any'], LinkAction.jump,
-                   config.chains[config.antispam.jump_chain])
+        yield plan.last_link
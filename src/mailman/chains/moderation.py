@@ -62,6 +62,10 @@ class ModerationChain:
     name = 'moderation'
     description = _('Moderation chain')
 
+    def __init__(self):
+        # The link jumping to each terminal chain, created when first needed.
+        self._cached_links = {}
+
     def get_links(self, mlist, msg, msgdata):
         """See `IChain`."""
         # Get the moderation action from the message metadata.  It can only be
@@ -80,8 +84,10 @@ class ModerationChain:
             '{0}: Invalid moderation action: {1} for sender: {2}'.format(
                 mlist.fqdn_listname, action,
                 msgdata.get('moderation_sender', '(unknown)')))
-        truth = config.rules['truth']
-        chain = config.chains[jump_chain]
-        return iter([
-            Link(truth, LinkAction.jump, chain),
-            ])
+        link = self._cached_links.get(jump_chain)
+        if link is None:
+            truth = config.rules['truth']
+            chain = config.chains[jump_chain]
+            link = self._cached_links[jump_chain] = Link(
+                truth, LinkAction.jump, chain)
+        return iter([link])
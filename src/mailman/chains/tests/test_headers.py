@@ -30,10 +30,12 @@ import unittest
 from mailman.app.lifecycle import create_list
 from mailman.chains.headers import HeaderMatchRule
 from mailman.config import config
+from mailman.core.chains import process
 from mailman.email.message import Message
 from mailman.interfaces.chain import LinkAction
 from mailman.testing.layers import ConfigLayer
-from mailman.testing.helpers import LogFileMark, configuration
+from mailman.testing.helpers import (
+    LogFileMark, configuration, specialized_message_from_string as mfs)
 
 
 
@@ -122,3 +124,61 @@ class TestHeaderChain(unittest.TestCase):
                               HeaderMatchRule, 'x-spam-score', '.*')
         finally:
             config.rules = saved_rules
+
+    def _rule_names(self):
+        return set(name for name in config.rules
+                   if name.startswith('header-match-'))
+
+    def test_links_are_cached(self):
+        # The links of a mailing list are only created once, until its header
+        # checks change.
+        self._mlist.header_matches = [('x-spam-score', '[+]{3,}')]
+        chain = config.chains['header-match']
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        rule_names = self._rule_names()
+        self.assertEqual(len(rule_names), 1)
+        self.assertEqual(list(chain.get_links(self._mlist, Message(), {})),
+                         links)
+        self.assertEqual(self._rule_names(), rule_names)
+        # Changing the header checks replaces the rules.
+        self._mlist.header_matches = [('x-spam-score', '[*]{3,}')]
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        self.assertEqual(links[0].rule.pattern, '[*]{3,}')
+        new_rule_names = self._rule_names()
+        self.assertEqual(len(new_rule_names), 1)
+        self.assertNotEqual(new_rule_names, rule_names)
+
+    @configuration('antispam', header_checks="""
+    X-Spam: foo
+    X-Spam: ba+r
+    X-Other: foo
+    X-Spam: (b)a\\1
+    """)
+    def test_merged_patterns(self):
+        # The patterns checking the same header are searched for together,
+        # but hits and misses are still recorded for each rule.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+X-Spam: BAAAR
+X-Other: foo
+Message-ID: <ant>
+
+""")
+        msgdata = {}
+        with configuration('antispam', jump_chain='accept'):
+            process(self._mlist, msg, msgdata, 'header-match')
+        def patterns(rule_names):
+            return [config.rules[name].pattern for name in rule_names]
+        self.assertEqual(patterns(msgdata['rule_hits']), ['ba+r', 'foo'])
+        self.assertEqual(patterns(msgdata['rule_misses']),
+                         ['foo', '(b)a\\1'])
+        # When none of the patterns match, they are all recorded as misses.
+        del msg['x-spam']
+        msg['X-Spam'] = 'baa'
+        del msg['x-other']
+        msgdata = {}
+        process(self._mlist, msg, msgdata, 'header-match')
+        self.assertEqual(msgdata['rule_hits'], [])
+        self.assertEqual(patterns(msgdata['rule_misses']),
+                         ['foo', 'ba+r', 'foo', '(b)a\\1'])
@@ -0,0 +1,93 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The 'digests' command."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Digests',
+    ]
+
+
+import sys
+
+from zope.component import getUtility
+from zope.interface import implementer
+
+from mailman.app.digests import send_digest
+from mailman.core.i18n import _
+from mailman.database.transaction import transactional
+from mailman.interfaces.command import ICLISubCommand
+from mailman.interfaces.listmanager import IListManager
+
+
+
+@implementer(ICLISubCommand)
+class Digests:
+    """Operate on digests."""
+
+    name = 'digests'
+
+    def add(self, parser, command_parser):
+        """See `ICLISubCommand`."""
+        self.parser = parser
+        command_parser.add_argument(
+            '-l', '--list',
+            default=[], dest='lists', metavar='list', action='append',
+            help=_("""\
+            Operate on this mailing list, given by its list-id or fully
+            qualified list name.  Multiple --list options can be given.
+            Without this option, operate on the digests of all mailing
+            lists."""))
+        command_parser.add_argument(
+            '-s', '--send',
+            default=False, action='store_true',
+            help=_("""\
+            Send any collected digests right now, even if the size threshold
+            has not yet been reached."""))
+        command_parser.add_argument(
+            '-b', '--bump',
+            default=False, action='store_true',
+            help=_("""\
+            Increment the digest volume number and reset the digest number to
+            one.  If given with --send, the volume number is incremented
+            before any collected digests are sent."""))
+
+    @transactional
+    def process(self, args):
+        """See `ICLISubCommand`."""
+        list_manager = getUtility(IListManager)
+        if len(args.lists) == 0:
+            mailing_lists = list(list_manager.mailing_lists)
+        else:
+            mailing_lists = []
+            for spec in args.lists:
+                mlist = list_manager.get_by_list_id(spec)
+                if mlist is None:
+                    mlist = list_manager.get(spec)
+                if mlist is None:
+                    print(_('No such list: $spec'), file=sys.stderr)
+                else:
+                    mailing_lists.append(mlist)
+        for mlist in mailing_lists:
+            if args.bump:
+                mlist.volume += 1
+                mlist.next_digest_number = 1
+            if args.send:
+                send_digest(mlist)
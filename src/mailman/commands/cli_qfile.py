@@ -32,6 +32,7 @@ from zope.interface import implementer
 
 from mailman.core.i18n import _
 from mailman.interfaces.command import ICLISubCommand
+from mailman.utilities import queuefile
 from mailman.utilities.interact import interact
 
 
@@ -72,11 +73,17 @@ class QFile:
         printer = PrettyPrinter(indent=4)
         assert len(args.qfile) == 1, 'Wrong number of positional arguments'
         with open(args.qfile[0]) as fp:
-            while True:
-                try:
-                    m.append(cPickle.load(fp))
-                except EOFError:
-                    break
+            if fp.read(len(queuefile.MAGIC)) == queuefile.MAGIC:
+                # A compact queue file contains the message text and the
+                # metadata.
+                m.extend(queuefile.load(fp))
+            else:
+                fp.seek(0)
+                while True:
+                    try:
+                        m.append(cPickle.load(fp))
+                    except EOFError:
+                        break
         if args.doprint:
             print(_('[----- start pickle -----]'))
             for i, obj in enumerate(m):
@@ -31,6 +31,7 @@ from zope.interface import implementer
 
 from mailman.bin.master import WatcherState, master_state
 from mailman.core.i18n import _
+from mailman.core.metrics import STAGES, collect
 from mailman.interfaces.command import ICLISubCommand
 
 
@@ -64,4 +65,34 @@ class Status:
             message = _('GNU Mailman is in an unexpected state '
                         '($hostname != $fqdn_name)')
         print(message)
+        if status is WatcherState.conflict:
+            self._summarize()
         return status.value
+
+    def _summarize(self):
+        """Print a summary of the queue and runner metrics."""
+        metrics = collect()
+        print(_('Queues:'))
+        for name, queue in sorted(metrics['queues'].items()):
+            depth = queue['depth']
+            age = int(queue['oldest_age'])
+            print(_('    $name: $depth files, oldest waiting $age seconds'))
+        print(_('Runners:'))
+        for name, runner in sorted(metrics['runners'].items()):
+            processes = runner['processes']
+            rate = '{0:.1f}'.format(runner['rate'])
+            processed = runner['outcomes']['processed']
+            shunted = runner['outcomes']['shunted']
+            preserved = runner['outcomes']['preserved']
+            print(_('    $name: $processes processes, $rate files/second, '
+                    '$processed processed, $shunted shunted, '
+                    '$preserved preserved'))
+            timings = []
+            for stage in STAGES:
+                histogram = runner['timings'][stage]
+                if histogram['count'] > 0:
+                    mean = '{0:.1f}'.format(
+                        1000 * histogram['sum'] / histogram['count'])
+                    timings.append(_('$stage $mean ms'))
+            if len(timings) > 0:
+                print('        ' + ', '.join(timings))
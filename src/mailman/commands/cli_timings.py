@@ -0,0 +1,79 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The 'timings' command."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Timings',
+    ]
+
+
+from zope.interface import implementer
+
+from mailman.core.i18n import _
+from mailman.core.metrics import processing_metrics
+from mailman.interfaces.command import ICLISubCommand
+
+
+
+def _milliseconds(seconds):
+    return '{0:.3f}'.format(1000 * seconds)
+
+
+
+@implementer(ICLISubCommand)
+class Timings:
+    """Show the processing timings."""
+
+    name = 'timings'
+
+    def add(self, parser, command_parser):
+        """See `ICLISubCommand`."""
+        self.parser = parser
+        command_parser.add_argument(
+            '-l', '--list',
+            default=None, dest='list',
+            help=_("""\
+            Only show the timings for this mailing list, given by its list-id
+            or fully qualified list name."""))
+
+    def process(self, args):
+        """See `ICLISubCommand`."""
+        timings = processing_metrics()
+        if args.list is not None:
+            list_id = args.list.replace('@', '.')
+            timings = dict((key, value) for key, value in timings.items()
+                           if key == list_id)
+        if len(timings) == 0:
+            print(_('No processing timings have been collected.  Set '
+                    '[mailman]processing_timings to collect them.'))
+            return
+        for list_id in sorted(timings):
+            print(_('$list_id:'))
+            for kind in sorted(timings[list_id]):
+                for name, summary in sorted(timings[list_id][kind].items()):
+                    count = summary['count']
+                    mean = _milliseconds(summary['mean'])
+                    p50 = _milliseconds(summary['p50'])
+                    p90 = _milliseconds(summary['p90'])
+                    p99 = _milliseconds(summary['p99'])
+                    # Translated strings are dedented, so indent afterward.
+                    print('   ', _('$kind $name: $count calls, mean $mean ms, '
+                                   'p50 $p50 ms, p90 $p90 ms, p99 $p99 ms'))
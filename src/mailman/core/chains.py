@@ -30,6 +30,7 @@ from zope.interface.verify import verifyObject
 
 from mailman.chains.base import Chain, TerminalChainBase
 from mailman.config import config
+from mailman.core.metrics import processing
 from mailman.interfaces.chain import LinkAction, IChain
 from mailman.utilities.modules import find_components
 
@@ -50,6 +51,7 @@ def process(mlist, msg, msgdata, start_chain='default-posting-chain'):
     # Find the starting chain and begin iterating through its links.
     chain = config.chains[start_chain]
     chain_iter = chain.get_links(mlist, msg, msgdata)
+    timings = processing.start(mlist)
     # Loop until we've reached the end of all processing chains.
     while chain:
         # Iterate over all links in the chain.  Do this outside a for-loop so
@@ -65,7 +67,12 @@ def process(mlist, msg, msgdata, start_chain='default-posting-chain'):
                 return
             chain, chain_iter = chain_stack.pop()
             continue
-        if link.rule.check(mlist, msg, msgdata):
+        if timings is None:
+            matched = link.rule.check(mlist, msg, msgdata)
+        else:
+            with timings.time('rule', link.rule.name):
+                matched = link.rule.check(mlist, msg, msgdata)
+        if matched:
             if link.rule.record:
                 hits.append(link.rule.name)
             # The rule matched so run its action.
@@ -87,7 +94,13 @@ def process(mlist, msg, msgdata, start_chain='default-posting-chain'):
                 # Just process the next link in the chain.
                 pass
             elif link.action is LinkAction.run:
-                link.function(mlist, msg, msgdata)
+                if timings is None:
+                    link.function(mlist, msg, msgdata)
+                else:
+                    # Links are named after their chain and rule.
+                    name = '{0}:{1}'.format(chain.name, link.rule.name)
+                    with timings.time('link', name):
+                        link.function(mlist, msg, msgdata)
             else:
                 raise AssertionError(
                     'Bad link action: {0}'.format(link.action))
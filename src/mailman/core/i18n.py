@@ -28,6 +28,8 @@ __all__ = [
 
 
 import time
+import threading
+
 from flufl.i18n import PackageStrategy, registry
 
 import mailman.messages
@@ -36,6 +38,30 @@ from mailman.interfaces.configuration import ConfigurationUpdatedEvent
 _ = None
 
 
+
+class _LanguageStack(threading.local):
+    """The stack of languages in use, kept separately by every thread.
+
+    flufl.i18n keeps one stack per application, which would otherwise be
+    shared by threads processing messages in different languages.
+    """
+
+    def __init__(self):
+        self._languages = []
+
+    def append(self, language):
+        self._languages.append(language)
+
+    def pop(self):
+        return self._languages.pop()
+
+    def __len__(self):
+        return len(self._languages)
+
+    def __getitem__(self, index):
+        return self._languages[index]
+
+
 
 def initialize(application=None):
     """Initialize the i18n subsystem.
@@ -49,6 +75,9 @@ def initialize(application=None):
     if application is None:
         strategy = PackageStrategy('mailman', mailman.messages)
         application = registry.register(strategy)
+    # This replaces a private attribute, so setup.py pins the versions of
+    # flufl.i18n known to keep their language stack there.
+    application._stack = _LanguageStack()
     _ = application._
 
 
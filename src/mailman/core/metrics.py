@@ -0,0 +1,559 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Queue and runner metrics.
+
+Every queue runner process counts the queue files it handles, and times the
+stages of handling them: dequeuing the file, disposing of the message,
+committing the database transaction and finishing the file.  Runners save
+their metrics periodically to a file of their own in the metrics directory
+under $DATA_DIR, so that any process can collect them.  The depth of each
+queue, and the age of its oldest file, are measured at collection time.
+
+When enabled, the runners also time every pipeline handler, rule and chain
+link that processes a message, for each mailing list.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Histogram',
+    'ProcessingTimings',
+    'RunnerMetrics',
+    'collect',
+    'forget',
+    'processing',
+    'processing_metrics',
+    'prometheus_text',
+    'queue_metrics',
+    'runner_metrics',
+    ]
+
+
+import os
+import json
+import time
+import errno
+import bisect
+import threading
+
+from contextlib import contextmanager
+from lazr.config import as_boolean
+
+from mailman.config import config
+from mailman.utilities.filesystem import makedirs
+
+
+# The stages of handling a queue file which are timed.
+STAGES = ('dequeue', 'dispose', 'commit', 'finish')
+# What can become of a queue file: it is either processed, shunted after an
+# error, or preserved in the bad queue because it couldn't be handled at all.
+OUTCOMES = ('processed', 'shunted', 'preserved')
+# The upper bounds of the timing histogram buckets, in seconds.  The last
+# bucket, for everything slower, is implied.  Most handlers and rules take
+# well under a millisecond.
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+           0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+# The percentiles of the processing timings which are reported.
+PERCENTILES = (50, 90, 99)
+# The directory under $DATA_DIR holding the runners' metrics files.
+METRICS_DIRECTORY = 'metrics'
+# Runners save their metrics at most this often, in seconds.
+SAVE_INTERVAL = 5
+
+
+
+def _path(name, pid):
+    return os.path.join(config.DATA_DIR, METRICS_DIRECTORY,
+                        '{0}-{1:d}.json'.format(name, pid))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+    return True
+
+
+
+class Histogram:
+    """A distribution of timings."""
+
+    def __init__(self, counts=None, total=0.0):
+        """Create a histogram.
+
+        :param counts: The number of timings in each bucket, including the
+            last one for timings slower than all the `BUCKETS`.
+        :type counts: list of int
+        :param total: The sum of all the timings, in seconds.
+        :type total: float
+        """
+        if counts is None:
+            counts = [0] * (len(BUCKETS) + 1)
+        self.counts = list(counts)
+        self.total = total
+
+    @property
+    def count(self):
+        """The number of timings."""
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        """Add a timing.
+
+        :param seconds: The timing.
+        :type seconds: float
+        """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def percentile(self, percent):
+        """Estimate a percentile of the timings.
+
+        The estimate interpolates linearly within the bucket the percentile
+        falls in.  Timings slower than all the buckets are estimated as the
+        largest bucket bound.
+
+        :param percent: The percentile, e.g. 50 for the median.
+        :type percent: int
+        :return: The estimated timing in seconds, or None if there are no
+            timings.
+        :rtype: float
+        """
+        count = self.count
+        if count == 0:
+            return None
+        rank = count * percent / 100.0
+        cumulative = 0
+        lower = 0.0
+        for upper, number in zip(BUCKETS, self.counts):
+            if number > 0 and cumulative + number >= rank:
+                return lower + (upper - lower) * (rank - cumulative) / number
+            cumulative += number
+            lower = upper
+        return lower
+
+    def merge(self, other):
+        """Add all the timings of another histogram to this one."""
+        self.counts = [mine + theirs
+                       for mine, theirs in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def as_dict(self):
+        """Return the histogram as a JSON compatible dictionary."""
+        return dict(counts=self.counts, sum=self.total, count=self.count)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a histogram from the result of `as_dict()`."""
+        return cls(data['counts'], data['sum'])
+
+
+
+class RunnerMetrics:
+    """The metrics of one runner process.
+
+    Runners with worker threads share their metrics between the threads.
+    """
+
+    def __init__(self, name):
+        """Start counting.
+
+        :param name: The name of the runner.
+        :type name: str
+        """
+        self.name = name
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.timings = dict((stage, Histogram()) for stage in STAGES)
+        self._lock = threading.Lock()
+        self._saved = None
+
+    def count(self, outcome):
+        """Count a queue file.
+
+        :param outcome: What became of the queue file, one of `OUTCOMES`.
+        :type outcome: str
+        """
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    @contextmanager
+    def time(self, stage):
+        """Time a stage of handling a queue file.
+
+        The stage is timed even if it raises an exception.
+
+        :param stage: The stage, one of `STAGES`.
+        :type stage: str
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.timings[stage].observe(elapsed)
+
+    def as_dict(self):
+        """Return the metrics as a JSON compatible dictionary."""
+        with self._lock:
+            return dict(
+                name=self.name,
+                pid=self.pid,
+                started=self.started,
+                outcomes=dict(self.outcomes),
+                timings=dict((stage, histogram.as_dict())
+                             for stage, histogram in self.timings.items()),
+                processing=processing.as_dict(),
+                )
+
+    def save(self, force=False):
+        """Save the metrics, unless they were saved very recently.
+
+        :param force: Save the metrics even if they were saved less than
+            `SAVE_INTERVAL` seconds ago.
+        :type force: bool
+        """
+        now = time.time()
+        if (not force and self._saved is not None and
+                now - self._saved < SAVE_INTERVAL):
+            return
+        data = self.as_dict()
+        data['updated'] = now
+        path = _path(self.name, self.pid)
+        # Readers must never see a partially written file.
+        tmpfile = path + '.tmp'
+        try:
+            fp = open(tmpfile, 'w')
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            makedirs(os.path.dirname(path))
+            fp = open(tmpfile, 'w')
+        with fp:
+            json.dump(data, fp)
+        os.rename(tmpfile, path)
+        self._saved = now
+
+    def remove(self):
+        """Remove the saved metrics, when the runner exits."""
+        forget(self.name, self.pid)
+
+
+
+class _ListTimings:
+    """Time the processing of messages for one mailing list."""
+
+    def __init__(self, timings, list_id):
+        self._timings = timings
+        self._list_id = list_id
+
+    @contextmanager
+    def time(self, kind, name):
+        """Time a handler, rule or chain link.
+
+        :param kind: What is timed, i.e. `handler`, `rule` or `link`.
+        :type kind: str
+        :param name: The name of the handler, rule or link.
+        :type name: str
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._timings.observe(
+                self._list_id, kind, name, time.time() - start)
+
+
+class ProcessingTimings:
+    """The timings of the handlers, rules and chain links in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def start(self, mlist):
+        """Start timing the processing of a message, if enabled.
+
+        Checking whether timing is enabled once per message keeps the cost of
+        the instrumentation negligible when it isn't.
+
+        :param mlist: The mailing list the message is processed for.
+        :type mlist: `IMailingList`
+        :return: An object whose `time(kind, name)` method is a context
+            manager timing its block, or None when timing is disabled.
+        """
+        if not as_boolean(config.mailman.processing_timings):
+            return None
+        return _ListTimings(self, mlist.list_id)
+
+    def observe(self, list_id, kind, name, seconds):
+        """Add a timing.
+
+        :param list_id: The list id of the mailing list.
+        :type list_id: str
+        :param kind: What was timed, i.e. `handler`, `rule` or `link`.
+        :type kind: str
+        :param name: The name of the handler, rule or link.
+        :type name: str
+        :param seconds: The timing.
+        :type seconds: float
+        """
+        key = (list_id, kind, name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def as_dict(self):
+        """Return the timings as a JSON compatible dictionary.
+
+        The histograms are keyed by list id, then kind, then name.
+        """
+        timings = {}
+        with self._lock:
+            for (list_id, kind, name), histogram in self._histograms.items():
+                timings.setdefault(list_id, {}).setdefault(kind, {})[name] = (
+                    histogram.as_dict())
+        return timings
+
+    def reset(self):
+        """Forget all the timings."""
+        with self._lock:
+            self._histograms.clear()
+
+
+processing = ProcessingTimings()
+
+
+
+def forget(name, pid):
+    """Remove the saved metrics of a runner process.
+
+    :param name: The name of the runner.
+    :type name: str
+    :param pid: The process id of the runner.
+    :type pid: int
+    """
+    try:
+        os.remove(_path(name, pid))
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def queue_metrics():
+    """Measure the depth and age of every queue.
+
+    :return: A dictionary mapping the name of each queue to a dictionary with
+        the number of files waiting in the queue, `depth`, and the number of
+        seconds the oldest of them has been waiting, `oldest_age`.
+    :rtype: dict
+    """
+    now = time.time()
+    queues = {}
+    for name, switchboard in config.switchboards.items():
+        files = switchboard.files
+        if len(files) == 0:
+            oldest_age = 0.0
+        else:
+            # The file base names start with the time the file was received.
+            received = float(files[0].split('+', 1)[0])
+            oldest_age = max(0.0, now - received)
+        queues[name] = dict(depth=len(files), oldest_age=oldest_age)
+    return queues
+
+
+def _saved():
+    # Return the saved metrics of the running runner processes.
+    directory = os.path.join(config.DATA_DIR, METRICS_DIRECTORY)
+    try:
+        filenames = os.listdir(directory)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return
+    for filename in sorted(filenames):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            # The runner exited in the meantime.
+            continue
+        if _alive(data['pid']):
+            yield data
+
+
+def runner_metrics():
+    """Collect the saved metrics of the running runner processes.
+
+    The metrics of all the processes of each runner are added up.  Metrics
+    left behind by processes which no longer exist are ignored.
+
+    :return: A dictionary mapping the name of each runner to a dictionary with
+        the number of running `processes`, the count of each of the
+        `outcomes`, the `timings` of each stage, and the average number of
+        queue files handled per second, `rate`.
+    :rtype: dict
+    """
+    runners = {}
+    for data in _saved():
+        runner = runners.get(data['name'])
+        if runner is None:
+            runner = runners[data['name']] = dict(
+                processes=0,
+                rate=0.0,
+                outcomes=dict.fromkeys(OUTCOMES, 0),
+                timings=dict((stage, Histogram()) for stage in STAGES),
+                )
+        runner['processes'] += 1
+        handled = 0
+        for outcome in OUTCOMES:
+            runner['outcomes'][outcome] += data['outcomes'][outcome]
+            handled += data['outcomes'][outcome]
+        elapsed = data['updated'] - data['started']
+        if elapsed > 0:
+            runner['rate'] += handled / elapsed
+        for stage in STAGES:
+            runner['timings'][stage].merge(
+                Histogram.from_dict(data['timings'][stage]))
+    for runner in runners.values():
+        runner['timings'] = dict(
+            (stage, histogram.as_dict())
+            for stage, histogram in runner['timings'].items())
+    return runners
+
+
+def processing_metrics():
+    """Collect the processing timings of the running runner processes.
+
+    :return: A dictionary mapping the list id of each mailing list to a
+        dictionary mapping what was timed, i.e. `handler`, `rule` or `link`,
+        to a dictionary mapping the name of each handler, rule or link to a
+        summary of its timings: the `count`, the `mean` and the estimated
+        `p50`, `p90` and `p99` percentiles, in seconds.
+    :rtype: dict
+    """
+    histograms = {}
+    for data in _saved():
+        for list_id, kinds in data.get('processing', {}).items():
+            for kind, names in kinds.items():
+                for name, saved in names.items():
+                    key = (list_id, kind, name)
+                    histogram = histograms.get(key)
+                    if histogram is None:
+                        histograms[key] = Histogram.from_dict(saved)
+                    else:
+                        histogram.merge(Histogram.from_dict(saved))
+    timings = {}
+    for (list_id, kind, name), histogram in histograms.items():
+        summary = dict(count=histogram.count,
+                       mean=histogram.total / histogram.count)
+        for percent in PERCENTILES:
+            summary['p{0:d}'.format(percent)] = histogram.percentile(percent)
+        timings.setdefault(list_id, {}).setdefault(kind, {})[name] = summary
+    return timings
+
+
+def collect():
+    """Collect all the metrics.
+
+    :return: A dictionary with the `queue_metrics()` under `queues` and the
+        `runner_metrics()` under `runners`.
+    :rtype: dict
+    """
+    return dict(queues=queue_metrics(), runners=runner_metrics())
+
+
+
+def _labels(**labels):
+    # Format Prometheus labels, escaping their values.
+    return '{' + ','.join(
+        '{0}="{1}"'.format(
+            key, value.replace('\\', r'\\').replace('"', r'\"').replace(
+                '\n', r'\n'))
+        for key, value in sorted(labels.items())) + '}'
+
+
+def _bound(number):
+    # Prometheus expects floating point bucket bounds.
+    return repr(float(number))
+
+
+def prometheus_text(metrics):
+    """Format metrics in the Prometheus text exposition format.
+
+    :param metrics: The metrics, as returned by `collect()`.
+    :type metrics: dict
+    :return: The text to expose.
+    :rtype: str
+    """
+    lines = []
+    def family(name, kind, description):
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+    queues = sorted(metrics['queues'].items())
+    runners = sorted(metrics['runners'].items())
+    family('mailman_queue_depth', 'gauge',
+           'The number of files waiting in the queue.')
+    for name, queue in queues:
+        lines.append('mailman_queue_depth{0} {1:d}'.format(
+            _labels(queue=name), queue['depth']))
+    family('mailman_queue_oldest_age_seconds', 'gauge',
+           'How long the oldest file in the queue has been waiting.')
+    for name, queue in queues:
+        lines.append('mailman_queue_oldest_age_seconds{0} {1!r}'.format(
+            _labels(queue=name), queue['oldest_age']))
+    family('mailman_runner_processes', 'gauge',
+           'The number of running runner processes.')
+    for name, runner in runners:
+        lines.append('mailman_runner_processes{0} {1:d}'.format(
+            _labels(runner=name), runner['processes']))
+    family('mailman_runner_files_total', 'counter',
+           'The number of queue files handled, by outcome.')
+    for name, runner in runners:
+        for outcome in OUTCOMES:
+            lines.append('mailman_runner_files_total{0} {1:d}'.format(
+                _labels(runner=name, outcome=outcome),
+                runner['outcomes'][outcome]))
+    family('mailman_runner_stage_seconds', 'histogram',
+           'How long each stage of handling a queue file took.')
+    for name, runner in runners:
+        for stage in STAGES:
+            timings = runner['timings'][stage]
+            cumulative = 0
+            bounds = [_bound(bound) for bound in BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, timings['counts']):
+                cumulative += count
+                lines.append(
+                    'mailman_runner_stage_seconds_bucket{0} {1:d}'.format(
+                        _labels(runner=name, stage=stage, le=bound),
+                        cumulative))
+            labels = _labels(runner=name, stage=stage)
+            lines.append('mailman_runner_stage_seconds_sum{0} {1!r}'.format(
+                labels, timings['sum']))
+            lines.append('mailman_runner_stage_seconds_count{0} {1:d}'.format(
+                labels, timings['count']))
+    return '\n'.join(lines) + '\n'
@@ -39,6 +39,7 @@ from mailman.app.bounces import bounce_message
 from mailman.config import config
 from mailman.core import errors
 from mailman.core.i18n import _
+from mailman.core.metrics import processing
 from mailman.interfaces.handler import IHandler
 from mailman.interfaces.pipeline import IPipeline
 from mailman.utilities.modules import find_components
@@ -59,11 +60,16 @@ def process(mlist, msg, msgdata, pipeline_name='built-in'):
     """
     message_id = msg.get('message-id', 'n/a')
     pipeline = config.pipelines[pipeline_name]
+    timings = processing.start(mlist)
     for handler in pipeline:
-        dlog.debug('{0} pipeline {1} processing: {2}'.format(
-            message_id, pipeline_name, handler.name))
+        dlog.debug('%s pipeline %s processing: %s',
+                   message_id, pipeline_name, handler.name)
         try:
-            handler.process(mlist, msg, msgdata)
+            if timings is None:
+                handler.process(mlist, msg, msgdata)
+            else:
+                with timings.time('handler', handler.name):
+                    handler.process(mlist, msg, msgdata)
         except errors.DiscardMessage as error:
             vlog.info(
                 '{0} discarded by "{1}" pipeline handler "{2}": {3}'.format(
@@ -25,11 +25,16 @@ __all__ = [
     ]
 
 
+import os
 import time
+import Queue
 import signal
+import cProfile
 import logging
+import threading
 import traceback
 
+from contextlib import contextmanager
 from cStringIO import StringIO
 from lazr.config import as_boolean, as_timedelta
 from zope.component import getUtility
@@ -39,10 +44,14 @@ from zope.interface import implementer
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
-from mailman.core.switchboard import Switchboard
+from mailman.core.metrics import RunnerMetrics
+from mailman.core.switchboard import group_commit
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.runner import IRunner, RunnerCrashEvent
+from mailman.interfaces.switchboard import QueueFileClaimedError
+from mailman.utilities.inotify import DirectoryWatcher
+from mailman.utilities.modules import find_name
 from mailman.utilities.string import expand
 
 
@@ -70,12 +79,20 @@ class Runner:
         substitutions = config.paths
         substitutions['name'] = name
         numslices = int(section.instances)
+        # Runners which claim their queue files share the whole queue instead
+        # of splitting it into slices.
+        self.claim_files = as_boolean(section.claim_files)
+        if self.claim_files:
+            slice = None
+            numslices = 1
         # Check whether the runner is queue runner or not; non-queue runner
         # should not have queue_directory or switchboard instance.
         if self.is_queue_runner:
             self.queue_directory = expand(section.path, substitutions)
-            self.switchboard = Switchboard(
-                name, self.queue_directory, slice, numslices, True)
+            switchboard_class = find_name(section.switchboard)
+            self.switchboard = switchboard_class(
+                name, self.queue_directory, slice, numslices, True,
+                claim=self.claim_files)
         else:
             self.queue_directory = None
             self.switchboard= None
@@ -84,8 +101,37 @@ class Runner:
         self.sleep_float = (86400 * self.sleep_time.days +
                             self.sleep_time.seconds +
                             self.sleep_time.microseconds / 1.0e6)
+        # With inotify, idle runners are woken up as soon as a file arrives,
+        # and otherwise only every idle_sleep_time.
+        self.use_inotify = as_boolean(section.use_inotify)
+        self.idle_sleep_float = as_timedelta(
+            section.idle_sleep_time).total_seconds()
+        self._watcher = None
         self.max_restarts = int(section.max_restarts)
+        # Queue files can be processed in batches, one database transaction
+        # per batch, but only if each message can get its own savepoint.
+        self.batch_size = int(section.batch_size)
+        self.batch_float = as_timedelta(section.batch_time).total_seconds()
+        if self.batch_size > 1 and not config.db.supports_savepoints:
+            rlog.warning('%s runner: the database does not support '
+                         'savepoints, committing every message', name)
+            self.batch_size = 1
+        # In batch mode, the queue files processed in the current batch are
+        # only finished once the batch is committed.
+        self._unfinished = []
+        # With more than one thread, this thread dequeues the queue files and
+        # hands them to a pool of worker threads, which process and finish
+        # them.  Each worker thread commits every message it processes.
+        self.threads = int(section.threads)
+        if self.threads > 1 and self.batch_size > 1:
+            rlog.warning('%s runner: batches are not supported with '
+                         'threads, committing every message', name)
+            self.batch_size = 1
+        self._workers = []
+        self._work_queue = None
         self.start = as_boolean(section.start)
+        self.metrics = RunnerMetrics(name)
+        self._profile = None
         self._stop = False
         self.status = 0
 
@@ -105,6 +151,8 @@ class Runner:
         elif signum == signal.SIGHUP:
             reopen()
             rlog.info('%s runner caught SIGHUP.  Reopening logs.', self.name)
+        elif signum == signal.SIGUSR2:
+            self.toggle_profile()
 
     def set_signals(self):
         """See `IRunner`."""
@@ -112,6 +160,31 @@ class Runner:
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
         signal.signal(signal.SIGUSR1, self.signal_handler)
+        signal.signal(signal.SIGUSR2, self.signal_handler)
+
+    def toggle_profile(self):
+        """Start or stop profiling this runner with cProfile.
+
+        When profiling stops, the statistics are dumped to a file in the log
+        directory named after the runner and its process id, which can be
+        read with the `pstats` module.  Only the runner's main thread is
+        profiled.
+
+        :return: The path of the statistics file when profiling stops,
+            otherwise None.
+        """
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            rlog.info('%s runner started profiling', self.name)
+            return None
+        profile, self._profile = self._profile, None
+        profile.disable()
+        path = os.path.join(config.LOG_DIR, '{0}-{1:d}.prof'.format(
+            self.name, os.getpid()))
+        profile.dump_stats(path)
+        rlog.info('%s runner stopped profiling: %s', self.name, path)
+        return path
 
     def stop(self):
         """See `IRunner`."""
@@ -137,21 +210,92 @@ class Runner:
         except KeyboardInterrupt:
             pass
         finally:
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+            self._stop_workers()
             self._clean_up()
+            self.metrics.remove()
+            if self._profile is not None:
+                self.toggle_profile()
+
+    def _start_workers(self):
+        # The dispatcher stays at most one file ahead of each worker.
+        self._work_queue = Queue.Queue(self.threads)
+        for i in range(self.threads):
+            worker = threading.Thread(
+                target=self._work,
+                name='{0}-worker-{1}'.format(self.name, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _stop_workers(self):
+        for worker in self._workers:
+            self._work_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        del self._workers[:]
+
+    def _work(self):
+        # The main loop of each worker thread, which has its own database
+        # session.
+        try:
+            while True:
+                work = self._work_queue.get()
+                try:
+                    if work is None:
+                        break
+                    self._process_file(*work)
+                    with self.metrics.time('commit'):
+                        config.db.commit()
+                except Exception as error:
+                    self._log(error)
+                    config.db.abort()
+                finally:
+                    self._work_queue.task_done()
+        finally:
+            config.db.store.remove()
+
+    @contextmanager
+    def _message_transaction(self):
+        # In batch mode, the database changes for each message are made in a
+        # savepoint, so that an error only rolls back that message.
+        # Otherwise, an error aborts the whole transaction.
+        if self.batch_size > 1:
+            with config.db.savepoint():
+                yield
+        else:
+            try:
+                yield
+            except:
+                config.db.abort()
+                raise
 
     def _one_iteration(self):
         """See `IRunner`."""
         me = self.__class__.__name__
         dlog.debug('[%s] starting oneloop', me)
+        if self.threads > 1 and len(self._workers) == 0:
+            self._start_workers()
         # List all the files in our queue directory.  The switchboard is
         # guaranteed to hand us the files in FIFO order.
         files = self.switchboard.files
+        batch_count = 0
+        batch_deadline = None
         for filebase in files:
+            if batch_deadline is None:
+                batch_deadline = time.time() + self.batch_float
             dlog.debug('[%s] processing filebase: %s', me, filebase)
             try:
                 # Ask the switchboard for the message and metadata objects
                 # associated with this queue file.
-                msg, msgdata = self.switchboard.dequeue(filebase)
+                with self.metrics.time('dequeue'):
+                    msg, msgdata = self.switchboard.dequeue(filebase)
+            except QueueFileClaimedError:
+                # Another runner sharing this queue got to it first.
+                dlog.debug('[%s] already claimed: %s', me, filebase)
+                continue
             except Exception as error:
                 # This used to just catch email.Errors.MessageParseError, but
                 # other problems can occur in message parsing, e.g.
@@ -162,53 +306,106 @@ class Runner:
                 elog.error('Skipping and preserving unparseable message: %s',
                            filebase)
                 self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
+                self.metrics.count('preserved')
+                if self.batch_size == 1:
+                    config.db.abort()
                 continue
-            try:
-                dlog.debug('[%s] processing onefile', me)
-                self._process_one_file(msg, msgdata)
-                dlog.debug('[%s] finishing filebase: %s', me, filebase)
-                self.switchboard.finish(filebase)
-            except Exception as error:
-                # All runners that implement _dispose() must guarantee that
-                # exceptions are caught and dealt with properly.  Still, there
-                # may be a bug in the infrastructure, and we do not want those
-                # to cause messages to be lost.  Any uncaught exceptions will
-                # cause the message to be stored in the shunt queue for human
-                # intervention.
-                self._log(error)
-                # Put a marker in the metadata for unshunting.
-                msgdata['whichq'] = self.switchboard.name
-                # It is possible that shunting can throw an exception, e.g. a
-                # permissions problem or a MemoryError due to a really large
-                # message.  Try to be graceful.
-                try:
-                    shunt = config.switchboards['shunt']
-                    new_filebase = shunt.enqueue(msg, msgdata)
-                    elog.error('SHUNTING: %s', new_filebase)
-                    self.switchboard.finish(filebase)
-                except Exception as error:
-                    # The message wasn't successfully shunted.  Log the
-                    # exception and try to preserve the original queue entry
-                    # for possible analysis.
-                    self._log(error)
-                    elog.error(
-                        'SHUNTING FAILED, preserving original entry: %s',
-                        filebase)
-                    self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
+            if len(self._workers) > 0:
+                dlog.debug('[%s] dispatching filebase: %s', me, filebase)
+                self._work_queue.put((filebase, msg, msgdata))
+            else:
+                self._process_file(filebase, msg, msgdata)
             # Other work we want to do each time through the loop.
             dlog.debug('[%s] doing periodic', me)
             self._do_periodic()
-            dlog.debug('[%s] committing transaction', me)
-            config.db.commit()
+            batch_count += 1
+            if (batch_count >= self.batch_size or
+                    time.time() >= batch_deadline):
+                self._commit_batch()
+                batch_count = 0
+                batch_deadline = None
+            self.metrics.save()
             dlog.debug('[%s] checking short circuit', me)
             if self._short_circuit():
                 dlog.debug('[%s] short circuiting', me)
                 break
+        if len(self._workers) > 0:
+            # Wait for the workers to finish all the files dispatched in this
+            # pass.
+            self._work_queue.join()
+        if batch_count > 0:
+            self._commit_batch()
+        self.metrics.save()
         dlog.debug('[%s] ending oneloop: %s', me, len(files))
         return len(files)
 
+    def _commit_batch(self):
+        # Commit the database transaction, then finish the queue files
+        # processed in it.
+        me = self.__class__.__name__
+        dlog.debug('[%s] committing transaction', me)
+        unfinished = self._unfinished
+        self._unfinished = []
+        # Should the commit fail, the files are left as backup files, so that
+        # they are processed again when the runner restarts.
+        with self.metrics.time('commit'):
+            config.db.commit()
+        for filebase in unfinished:
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            with self.metrics.time('finish'):
+                self.switchboard.finish(filebase)
+
+    def _process_file(self, filebase, msg, msgdata):
+        # Process a dequeued file, and finish it or shunt it.
+        me = self.__class__.__name__
+        try:
+            dlog.debug('[%s] processing onefile', me)
+            with self._message_transaction():
+                # The queue files written while processing this message are
+                # committed together, before the message is finished.
+                with group_commit.batch():
+                    with self.metrics.time('dispose'):
+                        self._process_one_file(msg, msgdata)
+                if self.batch_size > 1:
+                    # Finishing the file removes it from the queue, so it
+                    # must wait until the batch's database changes are
+                    # committed.
+                    self._unfinished.append(filebase)
+                else:
+                    dlog.debug('[%s] finishing filebase: %s', me, filebase)
+                    with self.metrics.time('finish'):
+                        self.switchboard.finish(filebase)
+            self.metrics.count('processed')
+        except Exception as error:
+            # All runners that implement _dispose() must guarantee that
+            # exceptions are caught and dealt with properly.  Still, there may
+            # be a bug in the infrastructure, and we do not want those to
+            # cause messages to be lost.  Any uncaught exceptions will cause
+            # the message to be stored in the shunt queue for human
+            # intervention.
+            self._log(error)
+            # Put a marker in the metadata for unshunting.
+            msgdata['whichq'] = self.switchboard.name
+            # It is possible that shunting can throw an exception, e.g. a
+            # permissions problem or a MemoryError due to a really large
+            # message.  Try to be graceful.
+            try:
+                shunt = config.switchboards['shunt']
+                new_filebase = shunt.enqueue(msg, msgdata)
+                elog.error('SHUNTING: %s', new_filebase)
+                self.switchboard.finish(filebase)
+                self.metrics.count('shunted')
+            except Exception as error:
+                # The message wasn't successfully shunted.  Log the exception
+                # and try to preserve the original queue entry for possible
+                # analysis.
+                self._log(error)
+                elog.error(
+                    'SHUNTING FAILED, preserving original entry: %s',
+                    filebase)
+                self.switchboard.finish(filebase, preserve=True)
+                self.metrics.count('preserved')
+
     def _process_one_file(self, msg, msgdata):
         """See `IRunner`."""
         # Do some common sanity checking on the message metadata.  It's got to
@@ -279,6 +476,16 @@ class Runner:
         """See `IRunner`."""
         if filecnt or self.sleep_float <= 0:
             return
+        if self.use_inotify and self.switchboard is not None:
+            if self._watcher is None:
+                # Files may have arrived since the queue directory was last
+                # listed, so look again before waiting for the first time.
+                self._watcher = DirectoryWatcher(
+                    self.queue_directory, '.pck')
+                return
+            if self._watcher.active:
+                self._watcher.wait(self.idle_sleep_float)
+                return
         time.sleep(self.sleep_float)
 
     def _short_circuit(self):
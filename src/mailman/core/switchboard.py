@@ -22,32 +22,49 @@ subclass).  Metadata is represented as a Python dictionary.  For every
 message/metadata pair in a queue, a single file containing two pickles is
 written.  First, the message is written to the pickle, then the metadata
 dictionary is written.
+
+Alternatively, queue files can be written in the compact format described in
+`mailman.utilities.queuefile`, which contains the text of the message instead
+of a pickle.  Queue files in either format can always be read.
 """
 
 from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'GroupCommit',
+    'IndexedSwitchboard',
     'Switchboard',
+    'group_commit',
     'handle_ConfigurationUpdatedEvent',
     ]
 
 
 import os
 import time
-import email
+import errno
+import fcntl
 import pickle
 import cPickle
 import hashlib
 import logging
+import sqlite3
+import threading
 
+from cStringIO import StringIO
+from contextlib import contextmanager
+from email.generator import Generator
+from lazr.config import as_boolean, as_timedelta
 from zope.interface import implementer
 
 from mailman.config import config
-from mailman.email.message import Message
+from mailman.email.message import LazyMessage, Message
 from mailman.interfaces.configuration import ConfigurationUpdatedEvent
-from mailman.interfaces.switchboard import ISwitchboard
+from mailman.interfaces.switchboard import (
+    ISwitchboard, QueueFileClaimedError)
 from mailman.utilities.filesystem import makedirs
+from mailman.utilities import queuefile
+from mailman.utilities.modules import find_name
 from mailman.utilities.string import expand
 
 
@@ -60,9 +77,209 @@ DELTA = .0001
 # In order to prevent loops and a message flood, when the count reaches this
 # value, we move the file to the bad queue as a .psv.
 MAX_BAK_COUNT = 3
+# The name of the index file kept in the queue directory by the
+# IndexedSwitchboard.
+INDEX_FILE = '.index.db'
+# The index buckets queue files by the top 32 bits of their digest.  Since the
+# number of slices is a power of 2, no slice boundary falls inside a bucket.
+BUCKET_SHIFT = 128
+# In claim mode, a runner claims a queue file by moving it into a directory of
+# its own under this one, named after its process id.
+CLAIMS_DIRECTORY = '.claims'
+# Every claim directory contains this file, which its runner keeps locked for
+# as long as it lives.
+CLAIMS_LOCK = '.lock'
 
 elog = logging.getLogger('mailman.error')
 
+# The claim directories of this process, by queue directory.  Each value is
+# the process id, the claim directory and its lock's file descriptor.
+_claims = {}
+_claims_lock = threading.Lock()
+
+
+
+class _PendingFile:
+    """A queue file waiting to be committed."""
+
+    def __init__(self, tmpfile, filename, callback):
+        self.tmpfile = tmpfile
+        self.filename = filename
+        self.callback = callback
+        self.done = False
+        self.error = None
+
+
+def _flatten(msg):
+    # Unlike Message.as_string(), don't mangle From_ lines in the body.  Keep
+    # the message's Unix From_ line if it has one, but don't invent one.
+    fp = StringIO()
+    generator = Generator(fp, mangle_from_=False)
+    unixfrom = msg.get_unixfrom()
+    body = (msg.get_unparsed_body() if isinstance(msg, LazyMessage)
+            else None)
+    if body is None:
+        generator.flatten(msg, unixfrom=(unixfrom is not None))
+    else:
+        # The body was never looked at, so pass its text straight through.
+        if unixfrom is not None:
+            print(unixfrom, file=fp)
+        generator._write_headers(msg)
+        fp.write(body)
+    return fp.getvalue()
+
+
+def _is_compactable(msg):
+    # The compact format only stores the text of the message, so subclasses
+    # carrying extra state, and headers which only a pickle can represent
+    # faithfully, must be pickled.
+    if msg.__class__ not in (Message, LazyMessage):
+        return False
+    for value in msg.values():
+        if isinstance(value, unicode):
+            try:
+                value.encode('ascii')
+            except UnicodeError:
+                return False
+    return True
+
+
+def _load(fp):
+    # Read the message and metadata from a queue file in either format.
+    if fp.read(len(queuefile.MAGIC)) == queuefile.MAGIC:
+        return queuefile.load(fp)
+    fp.seek(0)
+    msg = cPickle.load(fp)
+    data = cPickle.load(fp)
+    return msg, data
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+
+class GroupCommit:
+    """Make queue files durable in batches.
+
+    Queue files are written to temporary files, which are only synced and
+    renamed into place by a commit.  One thread at a time commits every file
+    which is pending at that point, then syncs each queue directory involved
+    once.  Threads which add files while a commit is in progress wait for the
+    next one, which then includes all of their files.
+
+    A thread can also collect all the files it writes within a `batch()`,
+    and wait for them to be committed together at the end of the batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._pending = []
+        self._committing = False
+        self._local = threading.local()
+
+    def add(self, tmpfile, filename, callback=None):
+        """Add a written queue file to the next commit.
+
+        Unless the calling thread is in a batch, this waits until the file has
+        been committed.
+
+        :param tmpfile: The path of the temporary file containing the data.
+        :type tmpfile: str
+        :param filename: The path to rename the file to once it is synced.
+        :type filename: str
+        :param callback: Optional callable, which is called with no arguments
+            once the file has been renamed into place.
+        :type callback: callable
+        :raises EnvironmentError: if the file could not be committed.
+        """
+        pending = _PendingFile(tmpfile, filename, callback)
+        with self._lock:
+            self._pending.append(pending)
+        batch = getattr(self._local, 'batch', None)
+        if batch is None:
+            self._wait([pending])
+        else:
+            batch.append(pending)
+
+    @contextmanager
+    def batch(self):
+        """Commit all the files added by this thread together.
+
+        When the batch ends, this waits until all of its files have been
+        committed.  Nested batches are part of the outermost batch.
+
+        :raises EnvironmentError: if any of the files could not be committed.
+        """
+        if getattr(self._local, 'batch', None) is not None:
+            yield
+            return
+        self._local.batch = batch = []
+        try:
+            yield
+        finally:
+            self._local.batch = None
+            self._wait(batch)
+
+    def _wait(self, files):
+        while True:
+            with self._condition:
+                while self._committing and not all(
+                        pending.done for pending in files):
+                    self._condition.wait()
+                if all(pending.done for pending in files):
+                    break
+                self._committing = True
+            try:
+                self._commit()
+            finally:
+                with self._condition:
+                    self._committing = False
+                    self._condition.notify_all()
+        for pending in files:
+            if pending.error is not None:
+                raise pending.error
+
+    def _commit(self):
+        window = as_timedelta(config.mailman.queue_group_commit_window)
+        if window:
+            time.sleep(window.total_seconds())
+        with self._lock:
+            files, self._pending = self._pending, []
+        directories = {}
+        for pending in files:
+            try:
+                _fsync(pending.tmpfile)
+                os.rename(pending.tmpfile, pending.filename)
+            except EnvironmentError as error:
+                pending.error = error
+                continue
+            directory = os.path.dirname(pending.filename)
+            directories.setdefault(directory, []).append(pending)
+            if pending.callback is not None:
+                try:
+                    pending.callback()
+                except Exception:
+                    elog.exception('Queue file commit callback failed: %s',
+                                   pending.filename)
+        # The renames are only durable once the directories are synced.
+        for directory, renamed in directories.items():
+            try:
+                _fsync(directory)
+            except EnvironmentError as error:
+                for pending in renamed:
+                    pending.error = error
+        for pending in files:
+            pending.done = True
+
+
+group_commit = GroupCommit()
+
 
 
 @implementer(ISwitchboard)
@@ -70,7 +287,7 @@ class Switchboard:
     """See `ISwitchboard`."""
 
     def __init__(self, name, queue_directory,
-                 slice=None, numslices=1, recover=False):
+                 slice=None, numslices=1, recover=False, claim=False):
         """Create a switchboard object.
 
         :param name: The queue name.
@@ -85,11 +302,18 @@ class Switchboard:
         :type numslices: int
         :param recover: True if backup files should be recovered.
         :type recover: bool
+        :param claim: True if this switchboard shares the whole queue with
+            other processes, each claiming the files it dequeues.  The queue
+            is then not split into slices.
+        :type claim: bool
         """
         assert (numslices & (numslices - 1)) == 0, (
             'Not a power of 2: {0}'.format(numslices))
+        assert not (claim and numslices != 1), (
+            'Claimed queues are not sliced')
         self.name = name
         self.queue_directory = queue_directory
+        self.claim = claim
         # If configured to, create the directory if it doesn't yet exist.
         if config.create_paths:
             makedirs(self.queue_directory, 0770)
@@ -115,7 +339,14 @@ class Switchboard:
         listname = data.get('listname', '--nolist--')
         # Get some data for the input to the sha hash.
         now = time.time()
-        if data.get('_plaintext'):
+        compact = (config.mailman.queue_file_format == 'compact' and
+                   (data.get('_plaintext') or _is_compactable(_msg)))
+        if compact:
+            # Compact queue files contain the text of the message.
+            protocol = None
+            msgsave = (str(_msg) if data.get('_plaintext')
+                       else _flatten(_msg))
+        elif data.get('_plaintext'):
             protocol = 0
             msgsave = cPickle.dumps(str(_msg), protocol)
         else:
@@ -140,53 +371,133 @@ class Switchboard:
                 del data[k]
         # We have to tell the dequeue() method whether to parse the message
         # object or not.
-        data['_parsemsg'] = (protocol == 0)
-        # Write to the pickle file the message object and metadata.
+        data['_parsemsg'] = (protocol != pickle.HIGHEST_PROTOCOL)
+        if compact:
+            try:
+                metadata = queuefile.encode_metadata(data)
+            except TypeError as error:
+                # Fall back to pickling the message text.
+                elog.error('Cannot write compact queue file %s: %s',
+                           filebase, error)
+                compact = False
+                protocol = 0
+                msgsave = cPickle.dumps(msgsave, protocol)
+        # Write to the pickle file the message object and metadata.  With
+        # group commit, the file is synced and renamed along with the others
+        # in its batch.
+        grouped = as_boolean(config.mailman.queue_group_commit)
         with open(tmpfile, 'w') as fp:
-            fp.write(msgsave)
-            cPickle.dump(data, fp, protocol)
+            if compact:
+                fp.write(queuefile.MAGIC)
+                fp.write(metadata + b'\n')
+                fp.write(msgsave)
+            else:
+                fp.write(msgsave)
+                cPickle.dump(data, fp, protocol)
             fp.flush()
-            os.fsync(fp.fileno())
-        os.rename(tmpfile, filename)
+            if not grouped:
+                os.fsync(fp.fileno())
+        if grouped:
+            group_commit.add(
+                tmpfile, filename, lambda: self._enqueued(filebase))
+        else:
+            os.rename(tmpfile, filename)
+            self._enqueued(filebase)
         return filebase
 
+    def _enqueued(self, filebase):
+        """Called once a new queue file has been moved into place."""
+
+    def _claim_directory(self):
+        # Return the directory which holds the files claimed by this process,
+        # creating and locking it first if necessary.  The lock is released
+        # when the process exits, however it exits, which is how the files
+        # claimed by a dead runner are told apart from those of a live one.
+        pid = os.getpid()
+        with _claims_lock:
+            claims = _claims.get(self.queue_directory)
+            if (claims is not None and claims[0] == pid and
+                    not os.path.isdir(claims[1])):
+                # The claim directory has been removed from under us.
+                os.close(claims[2])
+                claims = None
+            if claims is None or claims[0] != pid:
+                directory = os.path.join(
+                    self.queue_directory, CLAIMS_DIRECTORY, str(pid))
+                makedirs(directory, 0770)
+                fd = os.open(os.path.join(directory, CLAIMS_LOCK),
+                             os.O_WRONLY | os.O_CREAT, 0660)
+                # Child processes must not inherit the lock.
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # A dead process with the same id may have left files behind.
+                self._recover_claims(directory)
+                claims = _claims[self.queue_directory] = (pid, directory, fd)
+            return claims[1]
+
+    def _backup_file(self, filebase):
+        # Return the path of the backup file for a dequeued queue file.
+        if self.claim:
+            directory = self._claim_directory()
+        else:
+            directory = self.queue_directory
+        return os.path.join(directory, filebase + '.bak')
+
     def dequeue(self, filebase):
         """See `ISwitchboard`."""
         # Calculate the filename from the given filebase.
         filename = os.path.join(self.queue_directory, filebase + '.pck')
-        backfile = os.path.join(self.queue_directory, filebase + '.bak')
-        # Read the message object and metadata.
-        with open(filename) as fp:
-            # Move the file to the backup file name for processing.  If this
-            # process crashes uncleanly the .bak file will be used to
-            # re-instate the .pck file in order to try again.
-            os.rename(filename, backfile)
-            msg = cPickle.load(fp)
-            data = cPickle.load(fp)
+        backfile = self._backup_file(filebase)
+        if self.claim:
+            # Claim the file by moving it into our claim directory.  When
+            # several processes try to claim the same file, only one rename
+            # succeeds.
+            try:
+                os.rename(filename, backfile)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+                raise QueueFileClaimedError(filebase)
+            with open(backfile) as fp:
+                msg, data = _load(fp)
+        else:
+            # Read the message object and metadata.
+            with open(filename) as fp:
+                # Move the file to the backup file name for processing.  If
+                # this process crashes uncleanly the .bak file will be used
+                # to re-instate the .pck file in order to try again.
+                os.rename(filename, backfile)
+                msg, data = _load(fp)
         if data.get('_parsemsg'):
             # Calculate the original size of the text now so that we won't
             # have to generate the message later when we do size restriction
             # checking.
             original_size = len(msg)
-            msg = email.message_from_string(msg, Message)
+            # Only the headers are parsed up front.  Runners which never look
+            # at the body don't pay for parsing it.
+            msg = LazyMessage.from_string(msg)
             msg.original_size = original_size
             data['original_size'] = original_size
         return msg, data
 
     def finish(self, filebase, preserve=False):
         """See `ISwitchboard`."""
-        bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        bakfile = self._backup_file(filebase)
         try:
             if preserve:
-                bad_dir = config.switchboards['bad'].queue_directory
-                psvfile = os.path.join(bad_dir, filebase + '.psv')
-                os.rename(bakfile, psvfile)
+                self._preserve(bakfile, filebase)
             else:
                 os.unlink(bakfile)
         except EnvironmentError:
             elog.exception(
                 'Failed to unlink/preserve backup file: %s', bakfile)
 
+    def _preserve(self, bakfile, filebase):
+        # Move a backup file to the bad queue.
+        bad_dir = config.switchboards['bad'].queue_directory
+        psvfile = os.path.join(bad_dir, filebase + '.psv')
+        os.rename(bakfile, psvfile)
+
     @property
     def files(self):
         """See `ISwitchboard`."""
@@ -219,41 +530,274 @@ class Switchboard:
         """See `ISwitchboard`."""
         # Move all .bak files in our slice to .pck.  It's impossible for both
         # to exist at the same time, so the move is enough to ensure that our
-        # normal dequeuing process will handle them.  We keep count in
-        # _bak_count in the metadata of the number of times we recover this
-        # file.  When the count reaches MAX_BAK_COUNT, we move the .bak file
-        # to a .psv file in the bad queue.
+        # normal dequeuing process will handle them.
         for filebase in self.get_files('.bak'):
-            src = os.path.join(self.queue_directory, filebase + '.bak')
-            dst = os.path.join(self.queue_directory, filebase + '.pck')
-            with open(src, 'rb+') as fp:
-                try:
+            self._recover(
+                os.path.join(self.queue_directory, filebase + '.bak'),
+                filebase)
+        self.recover_claims()
+
+    def _recover(self, src, filebase):
+        """Move a backup file back into the queue.
+
+        We keep count in _bak_count in the metadata of the number of times we
+        recover this file.  When the count reaches MAX_BAK_COUNT, we move the
+        .bak file to a .psv file in the bad queue.
+
+        :param src: The path of the backup file.
+        :type src: str
+        :param filebase: The base name of the queue file.
+        :type filebase: str
+        :return: True if the file was moved back into the queue.
+        :rtype: bool
+        """
+        dst = os.path.join(self.queue_directory, filebase + '.pck')
+        with open(src, 'rb+') as fp:
+            try:
+                compact = (fp.read(len(queuefile.MAGIC)) ==
+                           queuefile.MAGIC)
+                if compact:
+                    text, data = queuefile.load(fp)
+                else:
+                    fp.seek(0)
                     msg = cPickle.load(fp)
                     data_pos = fp.tell()
                     data = cPickle.load(fp)
-                except Exception as error:
-                    # If unpickling throws any exception, just log and
-                    # preserve this entry
-                    elog.error('Unpickling .bak exception: %s\n'
-                               'Preserving file: %s', error, filebase)
-                    self.finish(filebase, preserve=True)
+            except Exception as error:
+                # If unpickling throws any exception, just log and
+                # preserve this entry
+                elog.error('Unpickling .bak exception: %s\n'
+                           'Preserving file: %s', error, filebase)
+                self._preserve(src, filebase)
+                return False
+            data['_bak_count'] = data.get('_bak_count', 0) + 1
+            if compact:
+                fp.seek(0)
+                queuefile.dump(fp, text, data)
+            else:
+                fp.seek(data_pos)
+                if data.get('_parsemsg'):
+                    protocol = 0
                 else:
-                    data['_bak_count'] = data.get('_bak_count', 0) + 1
-                    fp.seek(data_pos)
-                    if data.get('_parsemsg'):
-                        protocol = 0
-                    else:
-                        protocol = 1
-                    cPickle.dump(data, fp, protocol)
-                    fp.truncate()
-                    fp.flush()
-                    os.fsync(fp.fileno())
-                    if data['_bak_count'] >= MAX_BAK_COUNT:
-                        elog.error('.bak file max count, preserving file: %s',
-                                   filebase)
-                        self.finish(filebase, preserve=True)
-                    else:
-                        os.rename(src, dst)
+                    protocol = 1
+                cPickle.dump(data, fp, protocol)
+            fp.truncate()
+            fp.flush()
+            os.fsync(fp.fileno())
+            if data['_bak_count'] >= MAX_BAK_COUNT:
+                elog.error('.bak file max count, preserving file: %s',
+                           filebase)
+                self._preserve(src, filebase)
+                return False
+            os.rename(src, dst)
+            return True
+
+    def _recover_claims(self, directory):
+        # Return the files claimed in a dead process's claim directory to the
+        # queue.  The caller must hold the directory's lock.
+        try:
+            filenames = os.listdir(directory)
+        except OSError as error:
+            # Another process already recovered the directory.
+            if error.errno != errno.ENOENT:
+                raise
+            return
+        for filename in filenames:
+            filebase, extension = os.path.splitext(filename)
+            if extension != '.bak':
+                continue
+            if self._recover(os.path.join(directory, filename), filebase):
+                self._enqueued(filebase)
+
+    def recover_claims(self):
+        """See `ISwitchboard`."""
+        claims = os.path.join(self.queue_directory, CLAIMS_DIRECTORY)
+        try:
+            owners = os.listdir(claims)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return
+        for owner in owners:
+            directory = os.path.join(claims, owner)
+            if owner == str(os.getpid()):
+                # These are our own claims.
+                continue
+            lock_file = os.path.join(directory, CLAIMS_LOCK)
+            try:
+                fd = os.open(lock_file, os.O_WRONLY)
+            except OSError as error:
+                # The owner is still setting up its claim directory, or the
+                # directory has just been recovered by another process.
+                if error.errno != errno.ENOENT:
+                    raise
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as error:
+                    if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    # The owner is still alive.
+                    continue
+                # Another process may have recovered the directory, and
+                # removed the lock file, between our opening it and locking
+                # it.  In that case we hold the lock of an orphaned file.
+                try:
+                    current = os.stat(lock_file)
+                except OSError as error:
+                    if error.errno != errno.ENOENT:
+                        raise
+                    continue
+                locked = os.fstat(fd)
+                if (current.st_dev, current.st_ino) != (
+                        locked.st_dev, locked.st_ino):
+                    continue
+                self._recover_claims(directory)
+                for remove, path in ((os.unlink, lock_file),
+                                     (os.rmdir, directory)):
+                    try:
+                        remove(path)
+                    except OSError as error:
+                        # Already recovered.
+                        if error.errno != errno.ENOENT:
+                            raise
+            finally:
+                os.close(fd)
+
+
+
+@implementer(ISwitchboard)
+class IndexedSwitchboard(Switchboard):
+    """A switchboard which keeps an index of its queue files.
+
+    The plain switchboard lists, parses and sorts the whole queue directory
+    every time its files are requested, which gets expensive when a queue
+    backs up.  This switchboard additionally records every queue file in a
+    SQLite database in the queue directory, ordered by the time the file was
+    received and bucketed by the digest used for slicing, so that the files
+    in a slice can be read in FIFO order without touching the directory.
+
+    The queue files themselves, including the .bak files used for crash
+    recovery, are exactly the same as for the plain switchboard.  The
+    directory stays authoritative; the files in this switchboard's slice are
+    reconciled with the index whenever backup files are recovered, i.e. when
+    a runner starts.
+    """
+
+    def __init__(self, *args, **kws):
+        self._local = threading.local()
+        super(IndexedSwitchboard, self).__init__(*args, **kws)
+
+    @property
+    def _index(self):
+        # SQLite connections may not be shared between threads, or across a
+        # fork.  The connection is in autocommit mode, so that each change to
+        # the index is atomic and concurrent processes only ever block each
+        # other for a single statement.
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            path = os.path.join(self.queue_directory, INDEX_FILE)
+            connection = sqlite3.connect(path, isolation_level=None)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entry (
+                    filebase TEXT PRIMARY KEY,
+                    received REAL NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    extension TEXT NOT NULL)
+                """)
+            connection.execute("""
+                CREATE INDEX IF NOT EXISTS entry_fifo
+                ON entry (extension, received)
+                """)
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def _bucket_range(self):
+        if self._lower is None:
+            return 0, shamax >> BUCKET_SHIFT
+        return self._lower >> BUCKET_SHIFT, self._upper >> BUCKET_SHIFT
+
+    def _add(self, filebase, extension):
+        when, digest = filebase.split('+', 1)
+        self._index.execute(
+            'INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?)',
+            (filebase, float(when), long(digest, 16) >> BUCKET_SHIFT,
+             extension))
+
+    def _sync(self, filebase):
+        """Make the index entry for a queue file match the directory."""
+        for extension in ('.pck', '.bak'):
+            path = os.path.join(self.queue_directory, filebase + extension)
+            if os.path.exists(path):
+                self._add(filebase, extension)
+                return
+        self._index.execute(
+            'DELETE FROM entry WHERE filebase = ?', (filebase,))
+
+    def _enqueued(self, filebase):
+        self._add(filebase, '.pck')
+
+    def dequeue(self, filebase):
+        """See `ISwitchboard`."""
+        # The file may have been moved to .bak even if it then fails to load.
+        try:
+            return super(IndexedSwitchboard, self).dequeue(filebase)
+        finally:
+            self._sync(filebase)
+
+    def finish(self, filebase, preserve=False):
+        """See `ISwitchboard`."""
+        super(IndexedSwitchboard, self).finish(filebase, preserve)
+        self._index.execute(
+            'DELETE FROM entry WHERE filebase = ?', (filebase,))
+
+    def get_files(self, extension='.pck'):
+        """See `ISwitchboard`."""
+        if extension not in ('.pck', '.bak'):
+            # Only queue and backup files are indexed.
+            return super(IndexedSwitchboard, self).get_files(extension)
+        lower, upper = self._bucket_range()
+        results = self._index.execute("""
+            SELECT filebase FROM entry
+            WHERE extension = ? AND bucket BETWEEN ? AND ?
+            ORDER BY received, filebase
+            """, (extension, lower, upper))
+        return [filebase for (filebase,) in results]
+
+    def reindex(self):
+        """Reconcile the index with the files in the queue directory.
+
+        Only the files in this switchboard's slice are reconciled, so that
+        runners for other slices of the same queue are not disturbed.
+        """
+        found = {}
+        for extension in ('.pck', '.bak'):
+            for filebase in super(IndexedSwitchboard, self).get_files(
+                    extension):
+                found[filebase] = extension
+        lower, upper = self._bucket_range()
+        indexed = self._index.execute("""
+            SELECT filebase, extension FROM entry
+            WHERE bucket BETWEEN ? AND ?
+            """, (lower, upper))
+        for filebase, extension in indexed.fetchall():
+            if found.get(filebase) == extension:
+                del found[filebase]
+            elif filebase not in found:
+                self._index.execute(
+                    'DELETE FROM entry WHERE filebase = ?', (filebase,))
+        for filebase, extension in found.items():
+            self._add(filebase, extension)
+
+    def recover_backup_files(self):
+        """See `ISwitchboard`."""
+        self.reindex()
+        backups = self.get_files('.bak')
+        super(IndexedSwitchboard, self).recover_backup_files()
+        for filebase in backups:
+            self._sync(filebase)
 
 
 
@@ -272,4 +816,5 @@ def handle_ConfigurationUpdatedEvent(event):
             substitutions = config.paths
             substitutions['name'] = name
             path = expand(conf.path, substitutions)
-            config.switchboards[name] = Switchboard(name, path)
+            switchboard_class = find_name(conf.switchboard)
+            config.switchboards[name] = switchboard_class(name, path)
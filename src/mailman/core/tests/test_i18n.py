@@ -0,0 +1,75 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test internationalization."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestLanguageStack',
+    ]
+
+
+import unittest
+import threading
+
+from mailman.core.i18n import _
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestLanguageStack(unittest.TestCase):
+    """Test the languages in use by different threads."""
+
+    layer = ConfigLayer
+
+    def test_threads(self):
+        # Two threads using different languages at the same time each see
+        # their own translations.
+        in_use = threading.Semaphore(0)
+        translated = threading.Semaphore(0)
+        translate_now = threading.Event()
+        leave_now = threading.Event()
+        results = {}
+        def translate(language):
+            with _.using(language):
+                in_use.release()
+                # Translate only while both threads use their language, and
+                # keep using it until both have translated.
+                translate_now.wait()
+                results[language] = _('Digest Footer')
+                translated.release()
+                leave_now.wait()
+        threads = [threading.Thread(target=translate, args=(language,))
+                   for language in ('fr', 'en')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            in_use.acquire()
+        translate_now.set()
+        for thread in threads:
+            translated.acquire()
+        leave_now.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {
+            'fr': 'Pied de page des remises group\xe9es',
+            'en': 'Digest Footer',
+            })
+        # The main thread's language is not affected.
+        self.assertEqual(_.code, 'en')
@@ -0,0 +1,222 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test queue and runner metrics."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestHistogram',
+    'TestMetrics',
+    'TestProcessingTimings',
+    ]
+
+
+import time
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.core.metrics import (
+    BUCKETS, Histogram, RunnerMetrics, collect, processing,
+    processing_metrics, prometheus_text, queue_metrics, runner_metrics)
+from mailman.testing.helpers import (
+    configuration, get_queue_messages,
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestHistogram(unittest.TestCase):
+    """Test timing histograms."""
+
+    def test_observe(self):
+        # Timings are counted in the first bucket they fit in.
+        histogram = Histogram()
+        histogram.observe(0.0005)
+        histogram.observe(0.001)
+        histogram.observe(0.3)
+        histogram.observe(60)
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.total, 60.3015)
+        self.assertEqual(histogram.counts[BUCKETS.index(0.0005)], 1)
+        self.assertEqual(histogram.counts[BUCKETS.index(0.001)], 1)
+        self.assertEqual(histogram.counts[BUCKETS.index(0.5)], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+
+    def test_merge(self):
+        # Histograms from different processes can be added up.
+        one = Histogram()
+        one.observe(0.002)
+        other = Histogram.from_dict(one.as_dict())
+        other.observe(0.2)
+        one.merge(other)
+        self.assertEqual(one.count, 3)
+        self.assertAlmostEqual(one.total, 0.204)
+
+    def test_percentile(self):
+        # Percentiles are interpolated within the bucket they fall in.
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for i in range(10):
+            histogram.observe(0.2)
+        # All the timings are in the (0.1, 0.25] bucket.
+        self.assertAlmostEqual(histogram.percentile(50), 0.175)
+        self.assertAlmostEqual(histogram.percentile(100), 0.25)
+        # Timings slower than all the buckets are estimated as the largest
+        # bucket bound.
+        histogram.observe(60)
+        self.assertEqual(histogram.percentile(99), BUCKETS[-1])
+
+
+
+class TestMetrics(unittest.TestCase):
+    """Test collecting metrics."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._metrics = RunnerMetrics('test')
+
+    def tearDown(self):
+        self._metrics.remove()
+        get_queue_messages('virgin')
+
+    def test_runner_metrics(self):
+        # Saved runner metrics are collected.
+        self._metrics.count('processed')
+        self._metrics.count('shunted')
+        with self._metrics.time('dispose'):
+            pass
+        self.assertNotIn('test', runner_metrics())
+        self._metrics.save()
+        runner = runner_metrics()['test']
+        self.assertEqual(runner['processes'], 1)
+        self.assertEqual(runner['outcomes'], dict(
+            processed=1, shunted=1, preserved=0))
+        self.assertEqual(runner['timings']['dispose']['count'], 1)
+        self.assertEqual(runner['timings']['commit']['count'], 0)
+        self.assertGreater(runner['rate'], 0)
+        # When the runner exits, its metrics go away.
+        self._metrics.remove()
+        self.assertNotIn('test', runner_metrics())
+
+    def test_save_interval(self):
+        # Runners don't save their metrics more often than necessary.
+        self._metrics.save()
+        self._metrics.count('processed')
+        self._metrics.save()
+        self.assertEqual(
+            runner_metrics()['test']['outcomes']['processed'], 0)
+        self._metrics.save(force=True)
+        self.assertEqual(
+            runner_metrics()['test']['outcomes']['processed'], 1)
+
+    def test_processes_are_added_up(self):
+        # The metrics of all the processes of a runner are added up.  Pretend
+        # that init is running another one.
+        other = RunnerMetrics('test')
+        other.pid = 1
+        self._metrics.count('processed')
+        other.count('processed')
+        self._metrics.save()
+        other.save()
+        try:
+            runner = runner_metrics()['test']
+        finally:
+            other.remove()
+        self.assertEqual(runner['processes'], 2)
+        self.assertEqual(runner['outcomes']['processed'], 2)
+
+    def test_dead_processes_are_ignored(self):
+        # This process id is larger than any the kernel hands out.
+        self._metrics.pid = 2 ** 31 - 1
+        self._metrics.save()
+        self.assertNotIn('test', runner_metrics())
+
+    def test_queue_metrics(self):
+        # The depth of the queue and the age of its oldest file are measured.
+        queue = queue_metrics()['virgin']
+        self.assertEqual(queue, dict(depth=0, oldest_age=0.0))
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+
+""")
+        config.switchboards['virgin'].enqueue(msg)
+        config.switchboards['virgin'].enqueue(msg)
+        time.sleep(0.01)
+        queue = queue_metrics()['virgin']
+        self.assertEqual(queue['depth'], 2)
+        self.assertGreater(queue['oldest_age'], 0)
+
+    def test_prometheus_text(self):
+        # The metrics can be exposed for Prometheus.
+        with self._metrics.time('dequeue'):
+            pass
+        self._metrics.save()
+        text = prometheus_text(collect())
+        lines = text.splitlines()
+        self.assertIn('# TYPE mailman_queue_depth gauge', lines)
+        self.assertIn('mailman_queue_depth{queue="virgin"} 0', lines)
+        self.assertIn(
+            'mailman_runner_files_total{outcome="processed",runner="test"} 0',
+            lines)
+        self.assertIn(
+            'mailman_runner_stage_seconds_bucket'
+            '{le="+Inf",runner="test",stage="dequeue"} 1', lines)
+        self.assertIn(
+            'mailman_runner_stage_seconds_count'
+            '{runner="test",stage="dequeue"} 1', lines)
+        self.assertTrue(text.endswith('\n'))
+
+
+
+class TestProcessingTimings(unittest.TestCase):
+    """Test timing the handlers, rules and chain links."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._metrics = RunnerMetrics('test')
+
+    def tearDown(self):
+        self._metrics.remove()
+        processing.reset()
+
+    def test_disabled(self):
+        # By default, nothing is timed.
+        self.assertIsNone(processing.start(self._mlist))
+
+    @configuration('mailman', processing_timings='yes')
+    def test_processing_metrics(self):
+        # Timings are saved along with the runner metrics, and summarized per
+        # mailing list.
+        timings = processing.start(self._mlist)
+        for i in range(3):
+            with timings.time('handler', 'decorate'):
+                pass
+        self.assertEqual(processing_metrics(), {})
+        self._metrics.save()
+        summary = processing_metrics()['test.example.com']['handler'][
+            'decorate']
+        self.assertEqual(summary['count'], 3)
+        self.assertLess(summary['mean'], BUCKETS[-1])
+        self.assertLessEqual(summary['p50'], summary['p90'])
+        self.assertLessEqual(summary['p90'], summary['p99'])
@@ -34,6 +34,7 @@ from zope.interface import implementer
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.core.errors import DiscardMessage, RejectMessage
+from mailman.core.metrics import processing
 from mailman.core.pipelines import process
 from mailman.interfaces.handler import IHandler
 from mailman.interfaces.member import MemberRole
@@ -41,6 +42,7 @@ from mailman.interfaces.pipeline import IPipeline
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.helpers import (
     LogFileMark,
+    configuration,
     get_queue_messages,
     reset_the_world,
     specialized_message_from_string as mfs)
@@ -139,6 +141,16 @@ testing
         self.assertEqual(len(messages), 1)
         self.assertEqual(str(messages[0].msg['subject']), 'a test')
 
+    @configuration('mailman', processing_timings='yes')
+    def test_handler_timings(self):
+        # When enabled, the time each handler takes is recorded per list.
+        self.addCleanup(processing.reset)
+        process(self._mlist, self._msg, {},
+                pipeline_name='default-posting-pipeline')
+        handlers = processing.as_dict()['test.example.com']['handler']
+        self.assertEqual(handlers['cook-headers']['count'], 1)
+        self.assertEqual(handlers['to-outgoing']['count'], 1)
+
 
 
 class TestOwnerPipeline(unittest.TestCase):
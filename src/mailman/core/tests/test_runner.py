@@ -25,14 +25,27 @@ __all__ = [
     ]
 
 
+import os
+import mock
+import time
+import pstats
 import unittest
+import threading
+
+from contextlib import contextmanager
+from zope.component import getUtility
 
 from mailman.app.lifecycle import create_list
 from mailman.config import config
+from mailman.core.i18n import _
 from mailman.core.runner import Runner
+from mailman.database.transaction import transaction
+from mailman.interfaces.domain import IDomainManager
+from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.runner import RunnerCrashEvent
+from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.helpers import (
-    configuration, event_subscribers, get_queue_messages,
+    batching_db, configuration, event_subscribers, get_queue_messages,
     make_testable_runner, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 
@@ -43,6 +56,76 @@ class CrashingRunner(Runner):
         raise RuntimeError('borked')
 
 
+
+class FanOutRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        for queue in ('archive', 'nntp', 'out'):
+            config.switchboards[queue].enqueue(msg, msgdata)
+        # Within the batch, nothing has been committed yet.
+        self.committed = [len(config.switchboards[queue].files)
+                          for queue in ('archive', 'nntp', 'out')]
+
+
+
+class SometimesCrashingRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        if msg['message-id'] == '<bee>':
+            raise RuntimeError('borked')
+
+
+
+class AddressRunner(Runner):
+    """Add an address for each message, then maybe crash."""
+
+    def _dispose(self, mlist, msg, msgdata):
+        getUtility(IUserManager).create_address(
+            '{0}@example.com'.format(msg['message-id'][1:-1]))
+        if msg['message-id'] == '<bee>':
+            raise RuntimeError('borked')
+
+
+
+class ThreadedRunner(Runner):
+    """Wait until two messages are being processed at the same time."""
+
+    def __init__(self, *args, **kws):
+        super(ThreadedRunner, self).__init__(*args, **kws)
+        self.started = []
+        self.processed = []
+
+    def _dispose(self, mlist, msg, msgdata):
+        message_id = msg['message-id']
+        if message_id == '<bee>':
+            raise RuntimeError('borked')
+        self.started.append(message_id)
+        until = time.time() + 10
+        while len(self.started) < 2 and time.time() < until:
+            time.sleep(0.01)
+        # By now, the other thread is using its own language.
+        self.processed.append(
+            (message_id, _.code, threading.current_thread().name))
+
+
+
+class FakeSavepoints:
+    """Record the savepoints used by a runner."""
+
+    def __init__(self):
+        self.released = []
+        self.rolled_back = []
+
+    @contextmanager
+    def __call__(self):
+        # Each savepoint covers the processing of one message.
+        try:
+            yield
+        except:
+            self.rolled_back.append(len(self.released))
+            raise
+        else:
+            self.released.append(len(self.rolled_back))
+
+
 
 class TestRunner(unittest.TestCase):
     """Test the Runner base class behavior."""
@@ -87,3 +170,227 @@ Message-ID: <ant>
         shunted = get_queue_messages('shunt')
         self.assertEqual(len(shunted), 1)
         self.assertEqual(shunted[0].msg['message-id'], '<ant>')
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_group_commit(self):
+        # With group commit, the queue files written while processing a
+        # message are committed together once it has been processed.
+        runner = make_testable_runner(FanOutRunner, 'in')
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['in'].enqueue(msg, listname='test@example.com')
+        runner.run()
+        self.assertEqual(runner.committed, [0, 0, 0])
+        for queue in ('archive', 'nntp', 'out'):
+            messages = get_queue_messages(queue)
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(messages[0].msg['message-id'], '<ant>')
+
+    def _enqueue(self, *message_ids):
+        for message_id in message_ids:
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: {0}
+
+""".format(message_id))
+            config.switchboards['in'].enqueue(msg, listname='test@example.com')
+
+    @configuration('runner.in', batch_size=3)
+    def test_batch_needs_savepoints(self):
+        # When the database doesn't support savepoints, every message is
+        # committed separately.
+        with mock.patch.object(config.db, 'supports_savepoints', False):
+            runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self.assertEqual(runner.batch_size, 1)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_real_batch_failure(self):
+        # The savepoints of the real database roll back only the database
+        # changes made for the failing message.
+        with batching_db():
+            getUtility(IDomainManager).add('example.com')
+            create_list('test@example.com')
+            config.db.commit()
+            runner = make_testable_runner(AddressRunner, 'in')
+            self.assertEqual(runner.batch_size, 10)
+            self._enqueue('<ant>', '<bee>', '<cat>')
+            runner.run()
+            config.db.abort()
+            emails = sorted(address.email
+                            for address in getUtility(IUserManager).addresses)
+        self.assertEqual(emails, ['ant@example.com', 'cat@example.com'])
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<bee>')
+
+    @configuration('runner.in', batch_size=2, batch_time='1h')
+    def test_batched_commits(self):
+        # In batch mode, the database transaction is committed once every
+        # batch_size messages.
+        savepoints = FakeSavepoints()
+        with mock.patch.object(config.db, 'supports_savepoints', True):
+            runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self.assertEqual(runner.batch_size, 2)
+        self._enqueue('<ant>', '<cat>', '<dog>', '<elk>', '<fly>')
+        with mock.patch.object(config.db, 'savepoint', savepoints), \
+                mock.patch.object(config.db, 'commit') as commit:
+            runner.run()
+        self.assertEqual(len(savepoints.released), 5)
+        self.assertEqual(savepoints.rolled_back, [])
+        self.assertEqual(commit.call_count, 3)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_batch_failure(self):
+        # When one message in a batch fails, only its savepoint is rolled
+        # back and it is shunted.  The rest of the batch is committed.
+        savepoints = FakeSavepoints()
+        with mock.patch.object(config.db, 'supports_savepoints', True):
+            runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self._enqueue('<ant>', '<bee>', '<cat>')
+        with mock.patch.object(config.db, 'savepoint', savepoints), \
+                mock.patch.object(config.db, 'abort') as abort, \
+                mock.patch.object(config.db, 'commit') as commit:
+            runner.run()
+        self.assertEqual(savepoints.released, [0, 1])
+        self.assertEqual(savepoints.rolled_back, [1])
+        self.assertEqual(abort.call_count, 0)
+        self.assertEqual(commit.call_count, 1)
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<bee>')
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_batch_finished_after_commit(self):
+        # The queue files of a batch are only finished once the batch is
+        # committed.  If the commit fails, they're left to be recovered.
+        savepoints = FakeSavepoints()
+        with mock.patch.object(config.db, 'supports_savepoints', True):
+            runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self._enqueue('<ant>', '<cat>')
+        switchboard = config.switchboards['in']
+        backups = []
+        def commit():
+            backups.append(sorted(
+                os.path.splitext(filename)[1]
+                for filename in os.listdir(switchboard.queue_directory)))
+            if len(backups) > 1:
+                raise RuntimeError('commit failed')
+        with mock.patch.object(config.db, 'savepoint', savepoints), \
+                mock.patch.object(config.db, 'commit', commit):
+            runner.run()
+            self.assertEqual(backups, [['.bak', '.bak']])
+            self.assertEqual(os.listdir(switchboard.queue_directory), [])
+            self._enqueue('<dog>')
+            self.assertRaises(RuntimeError, runner.run)
+        self.assertEqual(
+            [os.path.splitext(filename)[1]
+             for filename in os.listdir(switchboard.queue_directory)],
+            ['.bak'])
+        switchboard.recover_backup_files()
+        messages = get_queue_messages('in')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msg['message-id'], '<dog>')
+
+    def test_metrics(self):
+        # The runner counts what became of each queue file, and times the
+        # stages of handling them.
+        runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self._enqueue('<ant>', '<bee>', '<cat>')
+        runner.run()
+        self.assertEqual(runner.metrics.outcomes, dict(
+            processed=2, shunted=1, preserved=0))
+        counts = dict((stage, histogram.count)
+                      for stage, histogram in runner.metrics.timings.items())
+        self.assertEqual(counts, dict(
+            dequeue=3, dispose=3, commit=3, finish=2))
+
+    def test_toggle_profile(self):
+        # Profiling is started and stopped by toggling it, e.g. with SIGUSR2.
+        # When it stops, the statistics are dumped to the log directory.
+        runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self.assertIsNone(runner.toggle_profile())
+        path = runner.toggle_profile()
+        self.assertEqual(path, os.path.join(
+            config.LOG_DIR, 'in-{0:d}.prof'.format(os.getpid())))
+        os.remove(path)
+
+    def test_profile_stopped_on_exit(self):
+        # A runner which exits while it is being profiled still dumps the
+        # statistics.
+        runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        runner.toggle_profile()
+        self._enqueue('<ant>')
+        runner.run()
+        path = os.path.join(
+            config.LOG_DIR, 'in-{0:d}.prof'.format(os.getpid()))
+        try:
+            stats = pstats.Stats(path)
+            functions = set(name for filename, line, name in stats.stats)
+            self.assertIn('_one_iteration', functions)
+        finally:
+            os.remove(path)
+
+    @configuration('runner.in', batch_size=10, batch_time='0s')
+    def test_batch_time(self):
+        # The batch is also committed when it has taken longer than
+        # batch_time.
+        with mock.patch.object(config.db, 'supports_savepoints', True):
+            runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        self._enqueue('<ant>', '<cat>', '<dog>')
+        with mock.patch.object(config.db, 'savepoint', FakeSavepoints()), \
+                mock.patch.object(config.db, 'commit') as commit:
+            runner.run()
+        self.assertEqual(commit.call_count, 3)
+
+    @configuration('runner.in', sleep_time='1m', idle_sleep_time='1m')
+    def test_inotify_wakeup(self):
+        # An idle runner wakes up as soon as a file arrives in its queue.
+        runner = make_testable_runner(SometimesCrashingRunner, 'in')
+        # Running the runner empties the queue, and stops the watcher.
+        self.addCleanup(runner.run)
+        # The first time through, the runner only starts watching.
+        runner._snooze(0)
+        if not runner._watcher.active:
+            self.skipTest('inotify is not available')
+        timer = threading.Timer(0.1, self._enqueue, ('<ant>',))
+        timer.start()
+        self.addCleanup(timer.join)
+        start = time.time()
+        runner._snooze(0)
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(len(config.switchboards['in'].files), 1)
+
+    @configuration('runner.in', threads=2)
+    def test_threads(self):
+        # Queue files can be processed by several threads at the same time.
+        # Each uses its own language and database session, and crashing
+        # messages are still shunted.
+        getUtility(ILanguageManager).add('xx', 'utf-8', 'Xlandia')
+        with transaction():
+            create_list('xtest@example.com').preferred_language = 'xx'
+        self._enqueue('<ant>', '<bee>')
+        msg = mfs("""\
+From: anne@example.com
+To: xtest@example.com
+Message-ID: <cat>
+
+""")
+        config.switchboards['in'].enqueue(msg, listname='xtest@example.com')
+        runner = make_testable_runner(ThreadedRunner, 'in')
+        runner.run()
+        self.assertEqual(runner._workers, [])
+        self.assertEqual(sorted(runner.started), ['<ant>', '<cat>'])
+        processed = sorted(runner.processed)
+        self.assertEqual([(message_id, code)
+                          for message_id, code, name in processed],
+                         [('<ant>', 'en'), ('<cat>', 'xx')])
+        self.assertNotEqual(processed[0][2], processed[1][2])
+        self.assertEqual(len(get_queue_messages('in')), 0)
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<bee>')
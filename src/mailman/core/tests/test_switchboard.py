@@ -0,0 +1,455 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test switchboards."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestClaimedQueue',
+    'TestCompactQueueFiles',
+    'TestGroupCommit',
+    'TestIndexedSwitchboard',
+    ]
+
+
+import os
+import fcntl
+import shutil
+import unittest
+import threading
+
+from datetime import datetime
+from mock import patch
+
+from mailman.config import config
+from mailman.core.runner import Runner
+from mailman.core.switchboard import (
+    IndexedSwitchboard, Switchboard, group_commit)
+from mailman.email.message import LazyMessage
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.switchboard import QueueFileClaimedError
+from mailman.utilities import queuefile
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestIndexedSwitchboard(unittest.TestCase):
+    """Test switchboards."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'test')
+        self._switchboard = IndexedSwitchboard(
+            'test', self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+
+A test message.
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _extensions(self):
+        return sorted(os.path.splitext(filename)[1]
+                      for filename in os.listdir(self._queue_directory)
+                      if not filename.startswith('.'))
+
+    def test_fifo(self):
+        # Files come out of the index in the order they were enqueued.
+        filebases = [self._switchboard.enqueue(self._msg, number=i)
+                     for i in range(5)]
+        self.assertEqual(self._switchboard.files, filebases)
+        # The index agrees with a scan of the queue directory.
+        plain = Switchboard('test', self._queue_directory)
+        self.assertEqual(plain.files, filebases)
+
+    def test_dequeue_and_finish(self):
+        filebase = self._switchboard.enqueue(self._msg, number=7)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['number'], 7)
+        self.assertEqual(self._switchboard.files, [])
+        self.assertEqual(self._switchboard.get_files('.bak'), [filebase])
+        self.assertEqual(self._extensions(), ['.bak'])
+        self._switchboard.finish(filebase)
+        self.assertEqual(self._switchboard.get_files('.bak'), [])
+        self.assertEqual(self._extensions(), [])
+
+    def test_slices(self):
+        # Each slice gets a disjoint part of the queue.
+        filebases = [self._switchboard.enqueue(self._msg, number=i)
+                     for i in range(20)]
+        slices = [IndexedSwitchboard('test', self._queue_directory, i, 4)
+                  for i in range(4)]
+        sliced = [switchboard.files for switchboard in slices]
+        self.assertEqual(sorted(sum(sliced, [])), sorted(filebases))
+        for files in sliced:
+            self.assertEqual(files, [filebase for filebase in filebases
+                                     if filebase in files])
+
+    def test_recover_backup_files(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+        self.assertEqual(self._switchboard.get_files('.bak'), [])
+        self.assertEqual(self._extensions(), ['.pck'])
+
+    def test_recovered_too_often(self):
+        # Backup files which have been recovered too many times are preserved
+        # in the bad queue and dropped from the index.
+        filebase = self._switchboard.enqueue(self._msg)
+        for i in range(3):
+            self._switchboard.dequeue(filebase)
+            self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [])
+        self.assertEqual(self._switchboard.get_files('.bak'), [])
+        bad = config.switchboards['bad']
+        self.assertEqual(bad.get_files('.psv'), [filebase])
+        os.remove(os.path.join(bad.queue_directory, filebase + '.psv'))
+
+    def test_unparseable_file(self):
+        # A queue file which can't be loaded is still moved to .bak, and the
+        # index follows it.
+        filebase = self._switchboard.enqueue(self._msg)
+        path = os.path.join(self._queue_directory, filebase + '.pck')
+        with open(path, 'w') as fp:
+            fp.write('garbage')
+        self.assertRaises(Exception, self._switchboard.dequeue, filebase)
+        self.assertEqual(self._switchboard.get_files('.bak'), [filebase])
+
+    def test_reindex(self):
+        # Files the index doesn't know about are picked up, and entries for
+        # files which no longer exist are dropped.
+        plain = Switchboard('test', self._queue_directory)
+        unindexed = plain.enqueue(self._msg)
+        missing = self._switchboard.enqueue(self._msg)
+        os.remove(os.path.join(self._queue_directory, missing + '.pck'))
+        self.assertEqual(self._switchboard.files, [missing])
+        self._switchboard.reindex()
+        self.assertEqual(self._switchboard.files, [unindexed])
+
+    @configuration('runner.in',
+                   switchboard='mailman.core.switchboard.IndexedSwitchboard')
+    def test_runner_switchboard(self):
+        # Runners use the switchboard class from their configuration.
+        runner = Runner('in')
+        self.assertIsInstance(runner.switchboard, IndexedSwitchboard)
+        self.assertNotIsInstance(Runner('out').switchboard,
+                                 IndexedSwitchboard)
+
+
+
+class TestClaimedQueue(unittest.TestCase):
+    """Test switchboards which claim their queue files."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'test')
+        self._switchboard = Switchboard(
+            'test', self._queue_directory, claim=True)
+        self._claims = os.path.join(self._queue_directory, '.claims')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+
+A test message.
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _dead_claim(self, *filebases):
+        # Move queue files into the claim directory of a runner which died.
+        directory = os.path.join(self._claims, '1000000')
+        os.makedirs(directory)
+        open(os.path.join(directory, '.lock'), 'w').close()
+        for filebase in filebases:
+            os.rename(
+                os.path.join(self._queue_directory, filebase + '.pck'),
+                os.path.join(directory, filebase + '.bak'))
+        return directory
+
+    def test_dequeue_and_finish(self):
+        # Dequeuing a file moves it into this process's claim directory.
+        filebase = self._switchboard.enqueue(self._msg, number=7)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['number'], 7)
+        self.assertEqual(self._switchboard.files, [])
+        claimed = os.path.join(
+            self._claims, str(os.getpid()), filebase + '.bak')
+        self.assertTrue(os.path.exists(claimed))
+        self._switchboard.finish(filebase)
+        self.assertFalse(os.path.exists(claimed))
+
+    def test_claimed_elsewhere(self):
+        # Only one process can claim a file.
+        filebase = self._switchboard.enqueue(self._msg)
+        other = Switchboard('test', self._queue_directory, claim=True)
+        other.dequeue(filebase)
+        with self.assertRaises(QueueFileClaimedError) as cm:
+            self._switchboard.dequeue(filebase)
+        self.assertEqual(cm.exception.filebase, filebase)
+
+    def test_no_slices(self):
+        # The whole queue is shared.
+        self.assertRaises(AssertionError, Switchboard,
+                          'test', self._queue_directory, 0, 2, claim=True)
+
+    def test_recover_dead_claims(self):
+        # The files claimed by a runner which died are put back into the
+        # queue, counting as a recovery.
+        filebase = self._switchboard.enqueue(self._msg)
+        directory = self._dead_claim(filebase)
+        self._switchboard.recover_claims()
+        self.assertEqual(self._switchboard.files, [filebase])
+        self.assertFalse(os.path.exists(directory))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+
+    def test_keep_live_claims(self):
+        # The files claimed by a runner which is still alive are left alone.
+        filebase = self._switchboard.enqueue(self._msg)
+        directory = self._dead_claim(filebase)
+        with open(os.path.join(directory, '.lock'), 'w') as fp:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+            self._switchboard.recover_claims()
+        self.assertEqual(self._switchboard.files, [])
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['.lock', filebase + '.bak'])
+
+    def test_concurrent_recovery(self):
+        # Another process recovers the dead claims after we open the lock
+        # file, but before we lock it.  We end up holding the lock of the
+        # removed lock file, and leave the directory alone.
+        filebase = self._switchboard.enqueue(self._msg)
+        directory = self._dead_claim(filebase)
+        other = Switchboard('test', self._queue_directory, claim=True)
+        real_flock = fcntl.flock
+        recovered = []
+        def flock(fd, operation):
+            if len(recovered) == 0:
+                recovered.append(True)
+                other.recover_claims()
+            return real_flock(fd, operation)
+        with patch('mailman.core.switchboard.fcntl.flock', flock):
+            self._switchboard.recover_claims()
+        self.assertEqual(recovered, [True])
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+
+    def test_indexed_recovery(self):
+        # Recovered files are added back to the index.
+        switchboard = IndexedSwitchboard(
+            'test', self._queue_directory, claim=True)
+        filebase = switchboard.enqueue(self._msg)
+        self._dead_claim(filebase)
+        switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, [filebase])
+
+    @configuration('runner.in', claim_files='yes', instances=3)
+    def test_runner_switchboard(self):
+        # Runners which claim their files share the whole queue, however many
+        # of them there are.
+        runner = Runner('in', 2)
+        self.assertTrue(runner.switchboard.claim)
+        self.assertFalse(Runner('out').switchboard.claim)
+
+
+
+class TestGroupCommit(unittest.TestCase):
+    """Test group commit of queue files."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'test')
+        self._switchboard = Switchboard('test', self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+
+A test message.
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _files(self):
+        return sorted(os.listdir(self._queue_directory))
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_enqueue_outside_batch(self):
+        # Outside of a batch, the file is committed before enqueue returns.
+        filebase = self._switchboard.enqueue(self._msg)
+        self.assertEqual(self._files(), [filebase + '.pck'])
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_batch(self):
+        # The files written in a batch are committed when the batch ends.
+        with patch('mailman.core.switchboard.os.fsync') as fsync:
+            with group_commit.batch():
+                filebases = [self._switchboard.enqueue(self._msg, number=i)
+                             for i in range(3)]
+                self.assertEqual(self._switchboard.files, [])
+                self.assertEqual(fsync.call_count, 0)
+            # Each file is synced, but the directory is only synced once.
+            self.assertEqual(fsync.call_count, 4)
+        self.assertEqual(self._switchboard.files, filebases)
+        self.assertEqual(self._files(),
+                         sorted(filebase + '.pck' for filebase in filebases))
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_indexed_batch(self):
+        # The index only learns about files once they have been committed.
+        switchboard = IndexedSwitchboard('test', self._queue_directory)
+        with group_commit.batch():
+            filebase = switchboard.enqueue(self._msg)
+            self.assertEqual(switchboard.files, [])
+        self.assertEqual(switchboard.files, [filebase])
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_failed_commit(self):
+        # Errors committing the files are raised at the end of the batch.
+        with patch('mailman.core.switchboard.os.fsync',
+                   side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                with group_commit.batch():
+                    self._switchboard.enqueue(self._msg)
+        self.assertEqual(self._switchboard.files, [])
+
+    @configuration('mailman', queue_group_commit='yes')
+    def test_concurrent_enqueues(self):
+        # Threads enqueuing at the same time all get their files committed.
+        filebases = []
+        def enqueue():
+            filebases.append(self._switchboard.enqueue(self._msg))
+        threads = [threading.Thread(target=enqueue) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(self._switchboard.files), sorted(filebases))
+        self.assertEqual(len(filebases), 10)
+
+
+
+class TestCompactQueueFiles(unittest.TestCase):
+    """Test queue files in the compact format."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'test')
+        self._switchboard = Switchboard('test', self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: A test
+
+From the beginning of the line.
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _read(self, filebase, extension='.pck'):
+        path = os.path.join(self._queue_directory, filebase + extension)
+        with open(path) as fp:
+            return fp.read()
+
+    @configuration('mailman', queue_file_format='compact')
+    def test_round_trip(self):
+        received = datetime(2014, 11, 1, 12, 30, 15, 123)
+        filebase = self._switchboard.enqueue(
+            self._msg, listname='test@example.com',
+            recipients=set(['bart@example.com', 'cris@example.com']),
+            received_time=received, mode=DeliveryMode.mime_digests)
+        self.assertTrue(self._read(filebase).startswith(queuefile.MAGIC))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['subject'], 'A test')
+        self.assertEqual(msg.get_payload(),
+                         'From the beginning of the line.\n')
+        self.assertEqual(msg.original_size, msgdata['original_size'])
+        self.assertEqual(msgdata['listname'], 'test@example.com')
+        self.assertEqual(msgdata['recipients'],
+                         set(['bart@example.com', 'cris@example.com']))
+        self.assertEqual(msgdata['received_time'], received)
+        self.assertEqual(msgdata['mode'], DeliveryMode.mime_digests)
+        self._switchboard.finish(filebase)
+
+    def test_mixed_formats(self):
+        # Pickled and compact queue files can live in the same queue.
+        pickled = self._switchboard.enqueue(self._msg, number=1)
+        with configuration('mailman', queue_file_format='compact'):
+            compact = self._switchboard.enqueue(self._msg, number=2)
+        self.assertEqual(self._switchboard.files, [pickled, compact])
+        for filebase, number in ((pickled, 1), (compact, 2)):
+            msg, msgdata = self._switchboard.dequeue(filebase)
+            self.assertEqual(msg['subject'], 'A test')
+            self.assertEqual(msgdata['number'], number)
+            self._switchboard.finish(filebase)
+
+    @configuration('mailman', queue_file_format='compact')
+    def test_unencodable_metadata(self):
+        # Metadata which can't be encoded falls back to a pickle.
+        filebase = self._switchboard.enqueue(self._msg, thing=object())
+        self.assertFalse(self._read(filebase).startswith(queuefile.MAGIC))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['subject'], 'A test')
+        self.assertIn('thing', msgdata)
+        self._switchboard.finish(filebase)
+
+    @configuration('mailman', queue_file_format='compact')
+    def test_recover_backup_files(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+        self.assertEqual(msg['subject'], 'A test')
+        self._switchboard.finish(filebase)
+
+    @configuration('mailman', queue_file_format='compact')
+    def test_lazy_message(self):
+        # Messages are dequeued from compact queue files with only their
+        # headers parsed.
+        filebase = self._switchboard.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg.get_unparsed_body(),
+                         'From the beginning of the line.\n')
+        # Re-enqueuing the message passes its body straight through.
+        msg['X-Test'] = 'yes'
+        with patch('mailman.email.message.FeedParser') as parser:
+            filebase = self._switchboard.enqueue(msg)
+            msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertFalse(parser.called)
+        self.assertEqual(msg['x-test'], 'yes')
+        self.assertEqual(msg.get_payload(),
+                         'From the beginning of the line.\n')
+        self._switchboard.finish(filebase)
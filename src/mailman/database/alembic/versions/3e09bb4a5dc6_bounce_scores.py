@@ -0,0 +1,75 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bounce scores.
+
+Members get a bounce score and the time of their last scored bounce, and the
+bounce events are indexed for finding the unprocessed events of a member.
+
+Revision ID: 3e09bb4a5dc6
+Revises: 51b7f92bd06c
+Create Date: 2014-11-17 14:21:08.310725
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'downgrade',
+    'upgrade',
+    ]
+
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic.
+revision = '3e09bb4a5dc6'
+down_revision = '51b7f92bd06c'
+
+
+def upgrade():
+    # Databases which have been around since Storm may already have been
+    # created with the current schema.
+    inspector = sa.inspect(op.get_bind())
+    columns = set(column['name']
+                  for column in inspector.get_columns('member'))
+    if 'bounce_score' not in columns:
+        op.add_column(
+            'member', sa.Column('bounce_score', sa.Integer(), nullable=True))
+        member = sa.sql.table('member', sa.sql.column('bounce_score'))
+        op.execute(member.update().values(bounce_score=0))
+    if 'last_bounce_received' not in columns:
+        op.add_column(
+            'member',
+            sa.Column('last_bounce_received', sa.DateTime(), nullable=True))
+    indexes = set(index['name']
+                  for index in inspector.get_indexes('bounceevent'))
+    if 'ix_bounceevent_list_id_email_processed' not in indexes:
+        op.create_index(
+            'ix_bounceevent_list_id_email_processed', 'bounceevent',
+            ['list_id', 'email', 'processed'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_bounceevent_list_id_email_processed',
+                  table_name='bounceevent')
+    if op.get_bind().dialect.name != 'sqlite':
+        # SQLite does not support dropping columns.
+        op.drop_column('member', 'last_bounce_received')
+        op.drop_column('member', 'bounce_score')
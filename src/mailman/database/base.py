@@ -25,8 +25,9 @@ __all__ = [
 
 import logging
 
+from contextlib import contextmanager
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from zope.interface import implementer
 
 from mailman.config import config
@@ -45,6 +46,8 @@ class SABaseDatabase:
 
     Use this as a base class for your DB-Specific derived classes.
     """
+    supports_savepoints = True
+
     def __init__(self):
         self.url = None
         self.store = None
@@ -62,6 +65,18 @@ class SABaseDatabase:
         """See `IDatabase`."""
         self.store.rollback()
 
+    @contextmanager
+    def savepoint(self):
+        """See `IDatabase`."""
+        transaction = self.store.begin_nested()
+        try:
+            yield
+        except:
+            transaction.rollback()
+            raise
+        else:
+            transaction.commit()
+
     def _pre_reset(self, store):
         """Clean up method for testing.
 
@@ -89,6 +104,17 @@ class SABaseDatabase:
         """
         pass
 
+    def _configure_engine(self, engine):
+        """Configure the newly created engine.
+
+        Some database backends need their connections set up before they are
+        used.  For example, the SQLite driver needs to be kept from managing
+        transactions on its own, so that savepoints work.
+
+        :param engine: The SQLAlchemy engine.
+        """
+        pass
+
     def initialize(self, debug=None):
         """See `IDatabase`."""
         # Calculate the engine url.
@@ -111,6 +137,8 @@ class SABaseDatabase:
         # half dozen and all...
         self.url = url
         self.engine = create_engine(url)
+        self._configure_engine(self.engine)
+        # Every thread gets its own session, and with it its own connection.
         session = sessionmaker(bind=self.engine)
-        self.store = session()
+        self.store = scoped_session(session)
         self.store.commit()
@@ -91,6 +91,8 @@ class SchemaManager:
     def setup_database(self):
         context = MigrationContext.configure(self._database.store.connection())
         current_rev = context.get_current_revision()
+        # Don't leave open transactions or they will block any schema change.
+        self._database.commit()
         head_rev = self._script.get_current_head()
         if current_rev == head_rev:
              # We're already at the latest revision so there's nothing to do.
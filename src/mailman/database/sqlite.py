@@ -27,7 +27,9 @@ __all__ = [
 
 import os
 
+from mailman.config import config
 from mailman.database.base import SABaseDatabase
+from sqlalchemy import event
 from urlparse import urlparse
 
 
@@ -46,3 +48,24 @@ class SQLiteDatabase(SABaseDatabase):
         # Ignore errors
         if fd > 0:
             os.close(fd)
+
+    def _configure_engine(self, engine):
+        """See `SABaseDatabase`."""
+        # The pysqlite driver only begins a transaction before a statement
+        # which changes the database, and commits the current transaction
+        # before it executes a SAVEPOINT statement, which breaks savepoints.
+        # Savepoints are only used by runners processing their queue files in
+        # batches.  Only then keep the driver from managing transactions, and
+        # begin them ourselves.  Since this also begins a transaction before
+        # reading, the reading processes hold SQLite's shared lock until they
+        # commit, and so they block the writing processes for longer.
+        self.supports_savepoints = any(
+            int(section.batch_size) > 1 for section in config.runner_configs)
+        if not self.supports_savepoints:
+            return
+        @event.listens_for(engine, 'connect')
+        def do_connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+        @event.listens_for(engine, 'begin')
+        def do_begin(connection):
+            connection.execute('BEGIN')
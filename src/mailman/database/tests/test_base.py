@@ -0,0 +1,125 @@
+# Copyright (C) 2013-2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the database base class."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestSQLiteTransactions',
+    'TestSavepoints',
+    ]
+
+
+import unittest
+
+from zope.component import getUtility
+
+from mailman.config import config
+from mailman.database.sqlite import SQLiteDatabase
+from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.helpers import batching_db, recorded_statements
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestSavepoints(unittest.TestCase):
+    """Test savepoints in the real database."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        # SQLite only supports savepoints when batching is configured.
+        if isinstance(config.db, SQLiteDatabase):
+            database = batching_db()
+            database.__enter__()
+            self.addCleanup(database.__exit__, None, None, None)
+        self._user_manager = getUtility(IUserManager)
+
+    def _emails(self):
+        return sorted(address.email
+                      for address in self._user_manager.addresses)
+
+    def test_supported(self):
+        self.assertTrue(config.db.supports_savepoints)
+
+    def test_rollback(self):
+        # Only the changes made in the savepoint are rolled back.
+        self._user_manager.create_address('anne@example.com')
+        with self.assertRaises(RuntimeError):
+            with config.db.savepoint():
+                self._user_manager.create_address('bart@example.com')
+                raise RuntimeError
+        self._user_manager.create_address('cris@example.com')
+        config.db.commit()
+        self.assertEqual(self._emails(),
+                         ['anne@example.com', 'cris@example.com'])
+
+    def test_release(self):
+        # The changes made in a released savepoint are still part of the
+        # enclosing transaction.
+        self._user_manager.create_address('anne@example.com')
+        with config.db.savepoint():
+            self._user_manager.create_address('bart@example.com')
+        config.db.abort()
+        self.assertEqual(self._emails(), [])
+        with config.db.savepoint():
+            self._user_manager.create_address('bart@example.com')
+        config.db.commit()
+        self.assertEqual(self._emails(), ['bart@example.com'])
+
+    def test_nested(self):
+        # Savepoints can be nested.
+        with config.db.savepoint():
+            self._user_manager.create_address('anne@example.com')
+            with self.assertRaises(RuntimeError):
+                with config.db.savepoint():
+                    self._user_manager.create_address('bart@example.com')
+                    raise RuntimeError
+        config.db.commit()
+        self.assertEqual(self._emails(), ['anne@example.com'])
+
+
+
+
+class TestSQLiteTransactions(unittest.TestCase):
+    """Test who begins the SQLite transactions."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        if not isinstance(config.db, SQLiteDatabase):
+            raise unittest.SkipTest('SQLite only')
+
+    def test_driver_transactions(self):
+        # Without batching runners, the pysqlite driver begins the
+        # transactions, and only before it changes the database, so reading
+        # doesn't lock the database.
+        self.assertFalse(config.db.supports_savepoints)
+        config.db.commit()
+        with recorded_statements() as statements:
+            list(getUtility(IUserManager).addresses)
+        self.assertNotIn('BEGIN', statements)
+
+    def test_batching_transactions(self):
+        # With batching runners, the transactions begin before reading too.
+        with batching_db() as database:
+            self.assertTrue(database.supports_savepoints)
+            with recorded_statements() as statements:
+                list(getUtility(IUserManager).addresses)
+        self.assertEqual(statements[0], 'BEGIN')
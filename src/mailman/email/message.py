@@ -27,23 +27,31 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'LazyMessage',
     'Message',
     'OwnerNotification',
     'UserNotification',
     ]
 
 
+import re
 import email
 import email.message
 import email.utils
 
+from email.feedparser import FeedParser
 from email.header import Header
+from email.parser import HeaderParser
 
 from mailman.config import config
 
 
 COMMASPACE = ', '
 VERSION = tuple(int(v) for v in email.__version__.split('.'))
+# The blank line separating a message's headers from its body.
+BLANK_LINE = re.compile(r'(?:\A|\n)(\r?\n)')
+# The attributes of the base class which hold the state of the body.
+BODY_ATTRIBUTES = ('_payload', 'preamble', 'epilogue')
 
 
 
@@ -158,6 +166,88 @@ class Message(email.message.Message):
             return failobj
 
 
+
+class LazyMessage(Message):
+    """A message whose body is only parsed when it is needed.
+
+    The headers are parsed eagerly, but the body is kept as the unparsed
+    text until something looks at it, e.g. through `get_payload()`, `walk()`
+    or `as_string()`.  A message whose body is never looked at, for example
+    because it is only checked by header-based rules or just moved to another
+    queue, never has its body parsed at all.
+
+    Use `from_string()` to create lazy messages.
+    """
+
+    def __getattr__(self, name):
+        # Only called for attributes which aren't found the normal way.  The
+        # body attributes are missing until the body has been parsed.
+        if name in BODY_ATTRIBUTES and '_lazy_body' in self.__dict__:
+            self._parse_body()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    @classmethod
+    def from_string(cls, text, body=None):
+        """Create a message from its text, parsing only its headers.
+
+        :param text: The text of the message, or just the text of its headers
+            if the body is given separately.
+        :type text: bytes
+        :param body: Optionally, the text of the body.  A large body given
+            separately isn't copied out of the text of the whole message.
+        :type body: bytes
+        :return: The message.
+        :rtype: `LazyMessage`
+        """
+        match = BLANK_LINE.search(text)
+        if match is None:
+            headers, rest = text, b''
+        else:
+            headers, rest = text[:match.start(1)], text[match.end(1):]
+        if body is None:
+            body = rest
+        elif rest:
+            body = rest + body
+        msg = HeaderParser(cls).parsestr(headers)
+        # If the headers end with a line which isn't a header, the rest of
+        # the header block is the start of the body, including the blank line.
+        leftover = msg.get_payload()
+        if leftover:
+            body = leftover + (b'' if match is None else match.group(1)) + body
+        for name in BODY_ATTRIBUTES:
+            delattr(msg, name)
+        msg._lazy_body = body
+        return msg
+
+    def get_unparsed_body(self):
+        """Return the text of the body if it hasn't been parsed yet.
+
+        :return: The text of the body exactly as it was given to
+            `from_string()`, or None if the body has been parsed.
+        :rtype: bytes
+        """
+        return self.__dict__.get('_lazy_body')
+
+    def _parse_body(self):
+        body = self.__dict__.pop('_lazy_body')
+        # How the body is parsed only depends on the message's content type,
+        # which may have been changed since the message was created.
+        parser = FeedParser(Message)
+        content_type = email.message.Message.get(self, 'content-type')
+        if content_type is not None:
+            parser.feed(b'Content-Type: {0}\n'.format(content_type))
+        parser.feed(b'\n')
+        parser.feed(body)
+        parsed = parser.close()
+        # Attributes which have been set since the message was created take
+        # precedence over the original body.
+        for name in BODY_ATTRIBUTES:
+            if name not in self.__dict__:
+                setattr(self, name, getattr(parsed, name))
+        self.defects.extend(parsed.defects)
+
+
 
 class UserNotification(Message):
     """Class for internally crafted messages."""
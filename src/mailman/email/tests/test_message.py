@@ -21,14 +21,17 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'TestLazyMessage',
     'TestMessage',
     ]
 
 
+import pickle
 import unittest
 
+from email import message_from_string
 from mailman.app.lifecycle import create_list
-from mailman.email.message import UserNotification
+from mailman.email.message import LazyMessage, Message, UserNotification
 from mailman.testing.helpers import get_queue_messages
 from mailman.testing.layers import ConfigLayer
 
@@ -58,3 +61,105 @@ class TestMessage(unittest.TestCase):
         self.assertEqual(len(messages), 1)
         self.assertEqual(messages[0].msg.get_all('precedence'), 
                          ['omg wtf bbq'])
+
+
+
+MULTIPART = b"""\
+From nobody Sat Nov  1 12:00:00 2014
+From: anne@example.com
+To: test@example.com
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+This is a preamble.
+--BOUNDARY
+Content-Type: text/plain
+
+From the first part.
+--BOUNDARY
+Content-Type: application/octet-stream
+
+xxxxxxxx
+--BOUNDARY--
+"""
+
+
+
+class TestLazyMessage(unittest.TestCase):
+    """Test messages which parse their bodies lazily."""
+
+    layer = ConfigLayer
+
+    def test_headers(self):
+        msg = LazyMessage.from_string(MULTIPART)
+        self.assertEqual(msg['from'], 'anne@example.com')
+        self.assertEqual(msg.get_unixfrom(),
+                         'From nobody Sat Nov  1 12:00:00 2014')
+        self.assertEqual(msg.get_content_type(), 'multipart/mixed')
+        # Looking at the headers doesn't parse the body.
+        self.assertEqual(msg.get_unparsed_body(),
+                         MULTIPART.split(b'\n\n', 1)[1])
+
+    def test_separate_body(self):
+        # The body can be given separately from the headers.
+        headers, body = MULTIPART.split(b'\n\n', 1)
+        msg = LazyMessage.from_string(headers + b'\n\n', body)
+        self.assertEqual(msg['from'], 'anne@example.com')
+        self.assertIs(msg.get_unparsed_body(), body)
+        self.assertEqual(msg.as_string(unixfrom=True),
+                         message_from_string(MULTIPART, Message).as_string(
+                             unixfrom=True))
+
+    def test_body_parsed_on_demand(self):
+        msg = LazyMessage.from_string(MULTIPART)
+        self.assertTrue(msg.is_multipart())
+        self.assertIsNone(msg.get_unparsed_body())
+        self.assertEqual(msg.preamble, 'This is a preamble.')
+        self.assertEqual(
+            [part.get_content_type() for part in msg.walk()],
+            ['multipart/mixed', 'text/plain', 'application/octet-stream'])
+        self.assertEqual(msg.as_string(unixfrom=True),
+                         message_from_string(MULTIPART, Message).as_string(
+                             unixfrom=True))
+
+    def test_changed_headers(self):
+        # The body is parsed according to the current headers.
+        msg = LazyMessage.from_string(MULTIPART)
+        del msg['content-type']
+        msg['Content-Type'] = 'text/plain'
+        self.assertFalse(msg.is_multipart())
+        self.assertTrue(msg.get_payload().startswith('This is a preamble.'))
+
+    def test_set_payload(self):
+        # A body which is replaced before it is parsed is never parsed.
+        msg = LazyMessage.from_string(MULTIPART)
+        del msg['content-type']
+        msg.set_payload('A new body.\n')
+        self.assertEqual(msg.get_payload(), 'A new body.\n')
+        self.assertIsNone(msg.preamble)
+        self.assertNotIn('BOUNDARY', msg.as_string())
+
+    def test_no_body(self):
+        msg = LazyMessage.from_string(b'From: anne@example.com\n')
+        self.assertEqual(msg['from'], 'anne@example.com')
+        self.assertEqual(msg.get_payload(), '')
+
+    def test_no_headers(self):
+        msg = LazyMessage.from_string(b'\nJust a body.\n')
+        self.assertEqual(msg.keys(), [])
+        self.assertEqual(msg.get_payload(), 'Just a body.\n')
+
+    def test_malformed_headers(self):
+        # As with the full parser, a line which isn't a header starts the
+        # body.
+        text = b'From: anne@example.com\nnot a header\n\nbody\n'
+        msg = LazyMessage.from_string(text)
+        self.assertEqual(msg.get_payload(),
+                         message_from_string(text, Message).get_payload())
+
+    def test_pickle(self):
+        # A pickled lazy message stays lazy.
+        msg = pickle.loads(pickle.dumps(
+            LazyMessage.from_string(MULTIPART), pickle.HIGHEST_PROTOCOL))
+        self.assertIsNotNone(msg.get_unparsed_body())
+        self.assertEqual(len(msg.get_payload()), 2)
@@ -37,7 +37,6 @@ from mailman.config import config
 from mailman.core import errors
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
-from mailman.interfaces.member import DeliveryStatus
 from mailman.utilities.string import wrap
 
 
@@ -87,10 +86,9 @@ Your urgent message to the $mlist.display_name mailing list was not authorized
 for delivery.  The original message as received by Mailman is attached.
 """)
                 raise errors.RejectMessage(wrap(text))
-        # Calculate the regular recipients of the message
-        recipients = set(member.address.email
-                         for member in mlist.regular_members.members
-                         if member.delivery_status == DeliveryStatus.enabled)
+        # Calculate the regular recipients of the message.  This is done in
+        # the database, without loading every member and its preferences.
+        recipients = mlist.regular_members.recipients()
         # Remove the sender if they don't want to receive their own posts
         if not include_sender and member.address.email in recipients:
             recipients.remove(member.address.email)
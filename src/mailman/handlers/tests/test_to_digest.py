@@ -28,10 +28,13 @@ __all__ = [
 import os
 import unittest
 
+from mailman.app.digests import digest_store
 from mailman.app.lifecycle import create_list
 from mailman.handlers.to_digest import ToDigest
-from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.testing.helpers import (
+    get_queue_messages, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.mailbox import Mailbox
 
 
 
@@ -57,6 +60,51 @@ Message-ID: <ant>
         self._msg.set_payload(b'non-ascii chars \xc3\xa9 \xc3\xa8 \xc3\xa7')
         self._msg['X-Test'] = 'dummy'
         self._handler.process(self._mlist, self._msg, {})
-        # Make sure the digest mbox is not empty.
+        # Make sure the digest store is not empty.
+        self.assertGreater(digest_store(self._mlist).size, 0)
+
+    def test_non_ascii_header(self):
+        # The decoded headers of the message are indexed for the table of
+        # contents, even when they are raw 8-bit text.
+        self._msg.replace_header('subject', b'caf\xc3\xa9')
+        self._msg['X-Test'] = 'dummy'
+        self._handler.process(self._mlist, self._msg, {})
+        entries = digest_store(self._mlist).entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].subject, 'caf\xe9')
+        self.assertEqual(entries[0].sender, 'anne@example.com')
+
+    def test_digest_cut_once(self):
+        # When the digest store reaches the size threshold, the digest is
+        # sent.  The size is checked again when the store is cut, so if
+        # another process has just sent the digest, there's nothing to do.
+        self._mlist.digest_size_threshold = 0
+        self._mlist.volume = 2
+        self._mlist.next_digest_number = 7
+        self._handler.process(self._mlist, self._msg, {})
+        messages = get_queue_messages('digest')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msgdata['volume'], 2)
+        self.assertEqual(messages[0].msgdata['digest_number'], 7)
+        self.assertEqual(self._mlist.next_digest_number, 8)
+        store = digest_store(self._mlist)
+        self.assertEqual(store.size, 0)
+        self.assertIsNone(store.cut(store.path + '.cut', threshold=1))
+        self.assertIsNone(store.cut(store.path + '.cut'))
+
+    def test_mailbox_carried_over(self):
+        # Messages collected in a digest mailbox by an older version of
+        # Mailman are moved into the digest store, ahead of the new message.
         mailbox_path = os.path.join(self._mlist.data_path, 'digest.mmdf')
-        self.assertGreater(os.path.getsize(mailbox_path), 0)
+        with Mailbox(mailbox_path, create=True) as mailbox:
+            mailbox.add(mfs("""\
+From: bart@example.com
+To: test@example.com
+Subject: Old news
+
+""").as_string())
+        self._handler.process(self._mlist, self._msg, {})
+        self.assertFalse(os.path.exists(mailbox_path))
+        subjects = [entry.subject
+                    for entry in digest_store(self._mlist).entries()]
+        self.assertEqual(subjects, ['Old news', 'A disposable message'])
@@ -25,17 +25,11 @@ __all__ = [
     ]
 
 
-import os
-
 from zope.interface import implementer
 
-from mailman.config import config
+from mailman.app.digests import digest_store, send_digest
 from mailman.core.i18n import _
-from mailman.email.message import Message
-from mailman.interfaces.digests import DigestFrequency
 from mailman.interfaces.handler import IHandler
-from mailman.utilities.datetime import now as right_now
-from mailman.utilities.mailbox import Mailbox
 
 
 
@@ -51,72 +45,17 @@ class ToDigest:
         # Short circuit for non-digestable messages.
         if not mlist.digestable or msgdata.get('isdigest'):
             return
-        # Open the mailbox that will be used to collect the current digest.
-        mailbox_path = os.path.join(mlist.data_path, 'digest.mmdf')
-        # Lock the mailbox and append the message.
-        with Mailbox(mailbox_path, create=True) as mbox:
-            mbox.add(msg.as_string())
-        # Calculate the current size of the mailbox file.  This will not tell
-        # us exactly how big the resulting MIME and rfc1153 digest will
-        # actually be, but it's the most easily available metric to decide
-        # whether the size threshold has been reached.
-        size = os.path.getsize(mailbox_path)
-        if size >= mlist.digest_size_threshold * 1024.0:
+        # Append the message to the store collecting the current digest.
+        # This returns the current size of the store.  This will not tell us
+        # exactly how big the resulting MIME and rfc1153 digest will actually
+        # be, but it's the most easily available metric to decide whether the
+        # size threshold has been reached.
+        size = digest_store(mlist).add(msg)
+        threshold = mlist.digest_size_threshold * 1024.0
+        if size >= threshold:
             # The digest is ready to send.  Because we don't want to hold up
-            # this process with crafting the digest, we're going to move the
-            # digest file to a safe place, then craft a fake message for the
-            # DigestRunner as a trigger for it to build and send the digest.
-            mailbox_dest = os.path.join(
-                mlist.data_path,
-                'digest.{0.volume}.{0.next_digest_number}.mmdf'.format(mlist))
-            volume = mlist.volume
-            digest_number = mlist.next_digest_number
-            bump_digest_number_and_volume(mlist)
-            os.rename(mailbox_path, mailbox_dest)
-            config.switchboards['digest'].enqueue(
-                Message(),
-                listname=mlist.fqdn_listname,
-                digest_path=mailbox_dest,
-                volume=volume,
-                digest_number=digest_number)
-
-
-
-def bump_digest_number_and_volume(mlist):
-    """Bump the digest number and volume."""
-    now = right_now()
-    if mlist.digest_last_sent_at is None:
-        # There has been no previous digest.
-        bump = False
-    elif mlist.digest_volume_frequency == DigestFrequency.yearly:
-        bump = (now.year > mlist.digest_last_sent_at.year)
-    elif mlist.digest_volume_frequency == DigestFrequency.monthly:
-        # Monthly.
-        this_month = now.year * 100 + now.month
-        digest_month = (mlist.digest_last_sent_at.year * 100 +
-                        mlist.digest_last_sent_at.month)
-        bump = (this_month > digest_month)
-    elif mlist.digest_volume_frequency == DigestFrequency.quarterly:
-        # Quarterly.
-        this_quarter = now.year * 100 + (now.month - 1) // 4
-        digest_quarter = (mlist.digest_last_sent_at.year * 100 +
-                          (mlist.digest_last_sent_at.month - 1) // 4)
-        bump = (this_quarter > digest_quarter)
-    elif mlist.digest_volume_frequency == DigestFrequency.weekly:
-        this_week = now.year * 100 + now.isocalendar()[1]
-        digest_week = (mlist.digest_last_sent_at.year * 100 +
-                       mlist.digest_last_sent_at.isocalendar()[1])
-        bump = (this_week > digest_week)
-    elif mlist.digest_volume_frequency == DigestFrequency.daily:
-        bump = (now.toordinal() > mlist.digest_last_sent_at.toordinal())
-    else:
-        raise AssertionError(
-            'Bad DigestFrequency: {0}'.format(
-                mlist.digest_volume_frequency))
-    if bump:
-        mlist.volume += 1
-        mlist.next_digest_number = 1
-    else:
-        # Just bump the digest number.
-        mlist.next_digest_number += 1
-    mlist.digest_last_sent_at = now
+            # this process with crafting the digest, the collected messages
+            # are moved to a safe place, and the DigestRunner gets a fake
+            # message as a trigger for it to build and send the digest.  If
+            # another process got there first, there's nothing to do.
+            send_digest(mlist, threshold)
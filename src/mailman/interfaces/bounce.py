@@ -100,6 +100,54 @@ class IBounceProcessor(Interface):
         :rtype: IBounceEvent
         """
 
+    def register_many(mlist, emails, msg, context=None):
+        """Register a bounce event for each of several email addresses.
+
+        All the events are inserted in one go, which is much cheaper than
+        registering them one by one.
+
+        :param mlist: The mailing list that the bounce occurred on.
+        :type mlist: IMailingList
+        :param emails: The email addresses that are bouncing.
+        :type emails: sequence of str
+        :param msg: The bounce message.
+        :type msg: email.message.Message
+        :param context: In what context was the bounce detected?  The default
+            is 'normal' context (i.e. we received a normal bounce for the
+            address).
+        :type context: BounceContext
+        :return: The number of registered bounce events.
+        :rtype: int
+        """
+
+    def process_events():
+        """Score the unprocessed bounce events.
+
+        The unprocessed events are aggregated per mailing list member.  Each
+        day on which a member's address bounced adds one point to the
+        member's bounce score, unless the member's last scored bounce has
+        gone stale, in which case the score starts over.  When the score
+        reaches the mailing list's threshold, or a probe to the member
+        bounced, the member's delivery is disabled.  Bounces from addresses
+        which aren't members, or from members whose delivery isn't enabled,
+        are not scored.  All the events are marked as processed.
+
+        :return: The members whose delivery was disabled.
+        :rtype: list of `IMember`
+        """
+
+    def remove_disabled_members():
+        """Remove the members whose delivery has long been disabled by bounces.
+
+        A member is removed once the mailing list's number of disabled
+        warnings, at the mailing list's interval, could have been sent since
+        its delivery was disabled.  The mailing list's owners are notified of
+        each removal.
+
+        :return: The List-IDs and email addresses of the removed members.
+        :rtype: list of 2-tuples of (str, str)
+        """
+
     events = Attribute(
         """An iterator over all events.""")
 
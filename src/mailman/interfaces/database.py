@@ -57,6 +57,17 @@ class IDatabase(Interface):
     def abort():
         """Abort the current transaction."""
 
+    supports_savepoints = Attribute(
+        """Whether `savepoint()` is supported by this database.""")
+
+    def savepoint():
+        """Start a savepoint in the current transaction.
+
+        :return: A context manager.  If the block it manages raises an
+            exception, only the changes made within the block are rolled
+            back, and the exception is re-raised.
+        """
+
     store = Attribute(
         """The underlying database object on which you can do queries.""")
 
@@ -141,8 +141,11 @@ class IListManager(Interface):
         """
 
     names = Attribute(
-        """An iterator over the fully qualified list names of all mailing
-        lists managed by this list manager.""")
+        """A frozenset of the fully qualified list names of all mailing lists
+        managed by this list manager.
+
+        The names are cached, and only reloaded after a mailing list has been
+        created or deleted, possibly by another process.""")
 
     list_ids = Attribute(
         """An iterator over the list ids of all mailing lists managed by this
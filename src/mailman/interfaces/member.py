@@ -188,6 +188,15 @@ class IMember(Interface):
     moderation_action = Attribute(
         """The moderation action for this member as an `Action`.""")
 
+    bounce_score = Attribute(
+        """The member's bounce score.
+
+        See `IBounceProcessor.process_events()` for how bounces are scored.
+        """)
+
+    last_bounce_received = Attribute(
+        """The time of the member's last scored bounce, or None.""")
+
     def unsubscribe():
         """Unsubscribe (and delete) this member from the mailing list."""
 
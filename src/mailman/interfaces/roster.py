@@ -64,3 +64,17 @@ class IRoster(Interface):
         :return: The member if found, otherwise None
         :rtype: `IMember` or None
         """
+
+    def get_members(addresses):
+        """Get the members for the given addresses, in bulk.
+
+        This is the batched version of `get_member()`.  The members are
+        looked up with a few set-based queries, and their addresses, users
+        and preferences are loaded along with them.
+
+        :param addresses: The email addresses to search for.
+        :type addresses: iterable of text
+        :return: A mapping from email address to member, containing only the
+            addresses which were found.
+        :rtype: dictionary
+        """
@@ -72,6 +72,7 @@ class IRunner(Interface):
         - SIGUSR1: Also causes the runner to exit, but the master watcher will
           retart it.
         - SIGHUP: Re-open the log files.
+        - SIGUSR2: Start or stop profiling the runner.
         """
 
     def _one_iteration():
@@ -22,11 +22,26 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'ISwitchboard',
+    'QueueFileClaimedError',
     ]
 
 
 from zope.interface import Interface, Attribute
 
+from mailman.interfaces.errors import MailmanError
+
+
+
+class QueueFileClaimedError(MailmanError):
+    """The queue file was claimed by another process."""
+
+    def __init__(self, filebase):
+        super(QueueFileClaimedError, self).__init__()
+        self.filebase = filebase
+
+    def __str__(self):
+        return self.filebase
+
 
 
 class ISwitchboard(Interface):
@@ -42,6 +57,15 @@ class ISwitchboard(Interface):
         directory.
         """)
 
+    claim = Attribute(
+        """Whether files are claimed from a queue shared by any number of
+        processes.
+
+        When True, the queue is not split into slices.  Instead, dequeuing a
+        file claims it for the calling process, and `QueueFileClaimedError`
+        is raised if another process claimed it first.
+        """)
+
     def enqueue(_msg, _metadata=None, **_kws):
         """Store the message and metadata in the switchboard's queue.
 
@@ -61,6 +85,9 @@ class ISwitchboard(Interface):
         be removed by calling the .finish() method.
 
         Returned is a 2-tuple of the form (message, metadata).
+
+        For a switchboard in claim mode, QueueFileClaimedError is raised if
+        another process has already dequeued the file.
         """
 
     def finish(filebase, preserve=False):
@@ -90,4 +117,14 @@ class ISwitchboard(Interface):
         It is impossible for both the .bak and .pck files to exist at the same
         time, so moving them is enough to ensure that a normal dequeing
         operation will handle them.
+
+        Files claimed by processes which have since died are also moved back
+        into the queue.
+        """
+
+    def recover_claims():
+        """Move the files claimed by dead processes back into the queue.
+
+        Files claimed by live processes are left alone.  Recovered files
+        count towards the number of times a backup file may be recovered.
         """
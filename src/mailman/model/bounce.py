@@ -26,24 +26,43 @@ __all__ = [
     ]
 
 
+import logging
 
-from sqlalchemy import Boolean, Column, DateTime, Integer, Unicode
+from collections import defaultdict
+from sqlalchemy import (
+    Boolean, Column, DateTime, Index, Integer, Unicode, func)
+from zope.component import getUtility
 from zope.interface import implementer
 
+from mailman.app.membership import delete_member
 from mailman.database.model import Model
 from mailman.database.transaction import dbconnection
 from mailman.database.types import Enum
 from mailman.interfaces.bounce import (
     BounceContext, IBounceEvent, IBounceProcessor)
+from mailman.interfaces.listmanager import IListManager
+from mailman.interfaces.member import DeliveryStatus
+from mailman.model.member import Member
+from mailman.model.preferences import Preferences
 from mailman.utilities.datetime import now
 
 
+log = logging.getLogger('mailman.bounce')
+
+# The number of events to read from the database at a time.
+BATCH_SIZE = 500
+
+
 
 @implementer(IBounceEvent)
 class BounceEvent(Model):
     """See `IBounceEvent`."""
 
     __tablename__ = 'bounceevent'
+    __table_args__ = (
+        Index('ix_bounceevent_list_id_email_processed',
+              'list_id', 'email', 'processed'),
+        )
 
     id = Column(Integer, primary_key=True)
     list_id = Column(Unicode)
@@ -62,6 +81,36 @@ class BounceEvent(Model):
         self.processed = False
 
 
+
+def _in_batches(query):
+    """Iterate over the events selected by the query, a batch at a time."""
+    last_id = None
+    while True:
+        batch_query = (query
+                       if last_id is None
+                       else query.filter(BounceEvent.id > last_id))
+        batch = batch_query.order_by(BounceEvent.id).limit(BATCH_SIZE).all()
+        for event in batch:
+            yield event
+        if len(batch) < BATCH_SIZE:
+            break
+        last_id = batch[-1].id
+
+
+def _score(mlist, member, timestamps):
+    """Add the bounces received at the given times to the member's score."""
+    for timestamp in sorted(timestamps):
+        last = member.last_bounce_received
+        if last is not None and timestamp.date() <= last.date():
+            # A member scores at most one point per day.
+            continue
+        if last is None or timestamp - last > mlist.bounce_info_stale_after:
+            member.bounce_score = 1
+        else:
+            member.bounce_score += 1
+        member.last_bounce_received = timestamp
+
+
 
 @implementer(IBounceProcessor)
 class BounceProcessor:
@@ -74,16 +123,108 @@ class BounceProcessor:
         store.add(event)
         return event
 
+    @dbconnection
+    def register_many(self, store, mlist, emails, msg, context=None):
+        """See `IBounceProcessor`."""
+        timestamp = now()
+        message_id = msg['message-id']
+        if context is None:
+            context = BounceContext.normal
+        rows = [dict(list_id=mlist.list_id, email=email, timestamp=timestamp,
+                     message_id=message_id, context=context, processed=False)
+                for email in emails]
+        if len(rows) > 0:
+            # The rows are inserted with a single executemany() call on the
+            # database cursor, and no event objects are created for the
+            # session to keep track of.
+            store.execute(BounceEvent.__table__.insert(), rows)
+        return len(rows)
+
+    @dbconnection
+    def process_events(self, store):
+        """See `IBounceProcessor`."""
+        # Only process the events which are here right now.  Any events
+        # registered in the meantime are left for the next time.
+        last_id = store.query(func.max(BounceEvent.id)).filter_by(
+            processed=False).scalar()
+        if last_id is None:
+            return []
+        # Gather the times at which each address bounced, per mailing list.
+        # Any probe bounce disables delivery right away.
+        bounces = defaultdict(lambda: defaultdict(list))
+        probed = set()
+        query = store.query(
+            BounceEvent.list_id, BounceEvent.email,
+            BounceEvent.timestamp, BounceEvent.context,
+            ).filter_by(processed=False).filter(BounceEvent.id <= last_id)
+        for list_id, email, timestamp, context in query.yield_per(BATCH_SIZE):
+            email = email.lower()
+            if context is BounceContext.probe:
+                probed.add((list_id, email))
+            bounces[list_id][email].append(timestamp)
+        disabled = []
+        list_manager = getUtility(IListManager)
+        for list_id, timestamps in bounces.items():
+            mlist = list_manager.get_by_list_id(list_id)
+            if mlist is None or not mlist.process_bounces:
+                continue
+            # Look up all the bouncing members of the mailing list at once.
+            members = mlist.members.get_members(timestamps)
+            for email, member in members.items():
+                if member.delivery_status is not DeliveryStatus.enabled:
+                    continue
+                _score(mlist, member, timestamps[email])
+                if ((list_id, email) in probed or
+                        member.bounce_score >= mlist.bounce_score_threshold):
+                    member.preferences.delivery_status = (
+                        DeliveryStatus.by_bounces)
+                    log.info('Disabling delivery of %s on %s, bounce score %s',
+                             email, mlist.fqdn_listname, member.bounce_score)
+                    disabled.append(member)
+        store.query(BounceEvent).filter_by(processed=False).filter(
+            BounceEvent.id <= last_id).update(
+                {BounceEvent.processed: True}, synchronize_session='fetch')
+        return disabled
+
+    @dbconnection
+    def remove_disabled_members(self, store):
+        """See `IBounceProcessor`."""
+        # Only members disabled by bounce processing have had their bounces
+        # scored.  Look them all up at once.
+        query = store.query(Member).join(
+            Preferences, Member.preferences_id == Preferences.id).filter(
+                Preferences.delivery_status == DeliveryStatus.by_bounces,
+                Member.last_bounce_received.isnot(None))
+        by_list = defaultdict(list)
+        for member in query:
+            by_list[member.list_id].append(member)
+        removed = []
+        right_now = now()
+        list_manager = getUtility(IListManager)
+        for list_id, members in by_list.items():
+            mlist = list_manager.get_by_list_id(list_id)
+            if mlist is None or not mlist.process_bounces:
+                continue
+            grace = (mlist.bounce_you_are_disabled_warnings_interval *
+                     mlist.bounce_you_are_disabled_warnings)
+            for member in members:
+                if member.last_bounce_received + grace > right_now:
+                    continue
+                email = member.address.email
+                log.info('Removing %s from %s, delivery disabled by bounces',
+                         email, mlist.fqdn_listname)
+                delete_member(mlist, email, admin_notif=True, userack=False)
+                removed.append((list_id, email))
+        return removed
+
     @property
     @dbconnection
     def events(self, store):
         """See `IBounceProcessor`."""
-        for event in store.query(BounceEvent).all():
-            yield event
+        return _in_batches(store.query(BounceEvent))
 
     @property
     @dbconnection
     def unprocessed(self, store):
         """See `IBounceProcessor`."""
-        for event in store.query(BounceEvent).filter_by(processed=False):
-            yield event
+        return _in_batches(store.query(BounceEvent).filter_by(processed=False))
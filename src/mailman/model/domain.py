@@ -149,12 +149,12 @@ class DomainManager:
     @dbconnection
     def get(self, store, mail_host, default=None):
         """See `IDomainManager`."""
-        domains = store.query(Domain).filter_by(mail_host=mail_host)
-        if domains.count() < 1:
+        domains = store.query(Domain).filter_by(mail_host=mail_host).all()
+        if len(domains) < 1:
             return default
-        assert domains.count() == 1, (
+        assert len(domains) == 1, (
             'Too many matching domains: %s' % mail_host)
-        return domains.one()
+        return domains[0]
 
     def __getitem__(self, mail_host):
         """See `IDomainManager`."""
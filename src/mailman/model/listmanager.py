@@ -22,12 +22,22 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'ListManager',
+    'handle_ListEvent',
+    'invalidate_names',
     ]
 
 
+import os
+import errno
+import logging
+import threading
+
+from sqlalchemy.event import listen
+from sqlalchemy.orm import Session
 from zope.event import notify
 from zope.interface import implementer
 
+from mailman.config import config
 from mailman.database.transaction import dbconnection
 from mailman.interfaces.address import InvalidEmailAddressError
 from mailman.interfaces.listmanager import (
@@ -38,6 +48,160 @@ from mailman.model.mime import ContentFilter
 from mailman.utilities.datetime import now
 
 
+log = logging.getLogger('mailman.error')
+
+# The file, in the data directory, which is replaced whenever a mailing list
+# is created or deleted.  Processes compare its inode and modification time
+# to the ones they saw when they last loaded the list names.
+STAMP_FILE = 'lists.stamp'
+
+
+
+def _read_stamp():
+    path = os.path.join(config.DATA_DIR, STAMP_FILE)
+    try:
+        info = os.stat(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return None
+    return info.st_ino, info.st_mtime
+
+
+def _write_stamp():
+    # Replace the stamp file atomically, so that its inode always changes.
+    path = os.path.join(config.DATA_DIR, STAMP_FILE)
+    temporary_path = '{0}.{1}'.format(path, os.getpid())
+    with open(temporary_path, 'w'):
+        pass
+    os.rename(temporary_path, path)
+
+
+
+class _ListIndex:
+    """The names and list ids of all mailing lists.
+
+    The names are loaded from the database the first time they are needed,
+    and again only after a mailing list has been created or deleted, either
+    in this process or, as recorded by the stamp file, in another one.
+
+    Mailing lists which have been looked up are kept, so that they stay in
+    the session's identity map.  Looking them up again costs no query; after
+    a commit, their attributes are reloaded the first time they're used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = None
+        self._list_ids = None
+        self._stamp = None
+        # Every thread has its own database session, so it keeps its own
+        # mailing list objects, and its own record of whether its current
+        # transaction creates or deletes a mailing list.
+        self._local = threading.local()
+        self._transaction = threading.local()
+
+    def _query(self, store):
+        result_set = store.query(MailingList).values(
+            MailingList.mail_host, MailingList.list_name)
+        name_components = list(result_set)
+        names = frozenset(
+            '{0}@{1}'.format(list_name, mail_host)
+            for mail_host, list_name in name_components)
+        list_ids = frozenset(
+            '{0}.{1}'.format(list_name, mail_host)
+            for mail_host, list_name in name_components)
+        return names, list_ids
+
+    def _load(self, store):
+        # Return the list names and list ids this thread can see.
+        if getattr(self._transaction, 'changed', False):
+            # Other threads can't see this thread's changes until they are
+            # committed, so its view isn't shared.
+            if self._transaction.view is None:
+                self._transaction.view = self._query(store)
+            return self._transaction.view
+        stamp = _read_stamp()
+        with self._lock:
+            if self._names is None or stamp != self._stamp:
+                self._names, self._list_ids = self._query(store)
+                self._stamp = stamp
+                self._local = threading.local()
+            return self._names, self._list_ids
+
+    def names(self, store):
+        names, list_ids = self._load(store)
+        return names
+
+    def get(self, store, list_id):
+        names, list_ids = self._load(store)
+        if list_id not in list_ids:
+            return None
+        mailing_lists = getattr(self._local, 'mailing_lists', None)
+        if mailing_lists is None:
+            mailing_lists = self._local.mailing_lists = {}
+        mlist = mailing_lists.get(list_id)
+        # The session forgets about the mailing list if, for example, it was
+        # created in a transaction which has been aborted.
+        if mlist is None or mlist not in store:
+            mlist = store.query(MailingList).filter_by(
+                _list_id=list_id).first()
+            if mlist is None:
+                return None
+            mailing_lists[list_id] = mlist
+        return mlist
+
+    def reset(self):
+        with self._lock:
+            self._names = None
+            self._list_ids = None
+            self._local = threading.local()
+
+    def changed(self):
+        self.reset()
+        self._transaction.changed = True
+        self._transaction.view = None
+
+    def after_commit(self, session):
+        if not getattr(self._transaction, 'changed', False):
+            return
+        self._transaction.changed = False
+        self._transaction.view = None
+        try:
+            _write_stamp()
+        except EnvironmentError:
+            log.exception('Cannot update the mailing list names stamp')
+
+    def after_rollback(self, session):
+        if getattr(self._transaction, 'changed', False):
+            self._transaction.changed = False
+            self._transaction.view = None
+            self.reset()
+
+
+_list_index = _ListIndex()
+listen(Session, 'after_commit', _list_index.after_commit)
+listen(Session, 'after_rollback', _list_index.after_rollback)
+
+
+
+def invalidate_names():
+    """Make every process reload the mailing list names and list ids.
+
+    This happens automatically when a mailing list is created or deleted
+    through the list manager.  Call this after changing the mailing list
+    table behind its back.
+    """
+    _list_index.reset()
+    _write_stamp()
+
+
+def handle_ListEvent(event):
+    """Invalidate the list index when a mailing list is created or deleted."""
+    if isinstance(event, (ListCreatedEvent, ListDeletedEvent)):
+        _list_index.changed()
+
+
 
 @implementer(IListManager)
 class ListManager:
@@ -64,14 +228,16 @@ class ListManager:
     @dbconnection
     def get(self, store, fqdn_listname):
         """See `IListManager`."""
+        if fqdn_listname not in _list_index.names(store):
+            return None
         listname, at, hostname = fqdn_listname.partition('@')
         list_id = '{0}.{1}'.format(listname, hostname)
-        return store.query(MailingList).filter_by(_list_id=list_id).first()
+        return _list_index.get(store, list_id)
 
     @dbconnection
     def get_by_list_id(self, store, list_id):
         """See `IListManager`."""
-        return store.query(MailingList).filter_by(_list_id=list_id).first()
+        return _list_index.get(store, list_id)
 
     @dbconnection
     def delete(self, store, mlist):
@@ -100,10 +266,7 @@ class ListManager:
     @dbconnection
     def names(self, store):
         """See `IListManager`."""
-        result_set = store.query(MailingList)
-        for mail_host, list_name in result_set.values(MailingList.mail_host,
-                                                      MailingList.list_name):
-            yield '{0}@{1}'.format(list_name, mail_host)
+        return _list_index.names(store)
 
     @property
     @dbconnection
@@ -24,8 +24,10 @@ __all__ = [
     'Member',
     ]
 
-from sqlalchemy import Column, ForeignKey, Integer, Unicode
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode
+from sqlalchemy.event import listen
 from sqlalchemy.orm import relationship
+from threading import Lock
 from zope.component import getUtility
 from zope.event import notify
 from zope.interface import implementer
@@ -46,6 +48,34 @@ from mailman.utilities.uid import UniqueIDFactory
 
 uid_factory = UniqueIDFactory(context='members')
 
+# The preferences which a member inherits from its address, then from that
+# address's user, and finally from the system defaults.
+INHERITED_PREFERENCES = (
+    'acknowledge_posts',
+    'delivery_mode',
+    'delivery_status',
+    'preferred_language',
+    'receive_list_copy',
+    'receive_own_postings',
+    )
+
+# Every member caches its effective preferences along with the generation
+# they were calculated in.  Any change to a preference, or to the links
+# between members, addresses and users, starts a new generation.
+_generation = 0
+_generation_lock = Lock()
+
+
+def _new_generation(*args, **kws):
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def _forget_preferences(state, *args):
+    # The instance itself may already have been garbage collected.
+    state.dict.pop('_effective_preferences', None)
+
 
 
 @implementer(IMember)
@@ -59,6 +89,8 @@ class Member(Model):
     role = Column(Enum(MemberRole))
     list_id = Column(Unicode)
     moderation_action = Column(Enum(Action))
+    bounce_score = Column(Integer, default=0)
+    last_bounce_received = Column(DateTime)
 
     address_id = Column(Integer, ForeignKey('address.id'))
     _address = relationship('Address')
@@ -71,6 +103,7 @@ class Member(Model):
         self._member_id = uid_factory.new_uid()
         self.role = role
         self.list_id = list_id
+        self.bounce_score = 0
         if IAddress.providedBy(subscriber):
             self._address = subscriber
             # Look this up dynamically.
@@ -136,19 +169,68 @@ class Member(Model):
         """See `IMember`."""
         return (self._user
                 if self._address is None
-                else getUtility(IUserManager).get_user(self._address.email))
+                else self._address.user)
+
+    @classmethod
+    def __declare_last__(cls):
+        # SQLAlchemy special directive hook called after mappings are assumed
+        # to be complete.  Use this to invalidate the cached effective
+        # preferences whenever anything they are calculated from changes.
+        # Avoid circular imports.
+        from mailman.model.address import Address
+        from mailman.model.preferences import Preferences
+        from mailman.model.user import User
+        for attribute in (Preferences.acknowledge_posts,
+                          Preferences.delivery_mode,
+                          Preferences.delivery_status,
+                          Preferences._preferred_language,
+                          Preferences.receive_list_copy,
+                          Preferences.receive_own_postings,
+                          Address.preferences,
+                          Address.user,
+                          User.preferences,
+                          User._preferred_address,
+                          cls.preferences,
+                          cls._address,
+                          cls._user):
+            listen(attribute, 'set', _new_generation)
+        listen(User.addresses, 'append', _new_generation)
+        listen(User.addresses, 'remove', _new_generation)
+        # Expired members are reloaded from the database, where another
+        # process may have changed their preferences.
+        listen(cls, 'expire', _forget_preferences, raw=True)
+        listen(cls, 'refresh', _forget_preferences, raw=True)
+
+    def _calculate_preferences(self):
+        """Resolve all the inherited preferences in a single pass.
+
+        :return: The preferences set on the member, its address or its user,
+            or None for those which fall through to the defaults.
+        :rtype: dictionary
+        """
+        address = self.address
+        chain = [self.preferences, address.preferences]
+        if address.user:
+            chain.append(address.user.preferences)
+        effective = {}
+        for preference in INHERITED_PREFERENCES:
+            for preferences in chain:
+                pref = getattr(preferences, preference)
+                if pref is not None:
+                    break
+            effective[preference] = pref
+        return effective
 
     def _lookup(self, preference, default=None):
-        pref = getattr(self.preferences, preference)
-        if pref is not None:
-            return pref
-        pref = getattr(self.address.preferences, preference)
+        generation, effective = self.__dict__.get(
+            '_effective_preferences', (None, None))
+        if generation != _generation:
+            generation = _generation
+            effective = self._calculate_preferences()
+            self.__dict__['_effective_preferences'] = (generation, effective)
+        pref = effective[preference]
         if pref is not None:
             return pref
-        if self.address.user:
-            pref = getattr(self.address.user.preferences, preference)
-            if pref is not None:
-                return pref
         if default is None:
             return getattr(system_preferences, preference)
         return default
@@ -200,5 +282,8 @@ class Member(Model):
         """See `IMember`."""
         # Yes, this must get triggered before self is deleted.
         notify(UnsubscriptionEvent(self.mailing_list, self))
+        # A newly subscribed member may not have been flushed yet, and only
+        # persistent objects can be deleted.
+        store.flush()
         store.delete(self.preferences)
         store.delete(self)
@@ -37,14 +37,64 @@ __all__ = [
     ]
 
 
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, func, literal, or_
+from sqlalchemy.orm import aliased, joinedload
 from zope.interface import implementer
 
+from mailman.core.constants import system_preferences
 from mailman.database.transaction import dbconnection
-from mailman.interfaces.member import DeliveryMode, MemberRole
+from mailman.database.types import Enum
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
 from mailman.interfaces.roster import IRoster
 from mailman.model.address import Address
 from mailman.model.member import Member
+from mailman.model.preferences import Preferences
+
+
+# The maximum number of addresses to look up in a single query.  This stays
+# safely below SQLite's limit on the number of parameters in a statement.
+BATCH_SIZE = 500
+
+
+
+def _with_preferences(query):
+    """Load the members along with everything their preferences need.
+
+    The members' addresses, users and preferences, which are needed to
+    calculate a member's effective preferences, are loaded eagerly.  Without
+    this, the first preference read from each member costs several queries.
+
+    :param query: The query selecting members.
+    :return: The query, with the eager loading options.
+    """
+    return query.options(
+        joinedload('preferences'),
+        joinedload('_address').joinedload('preferences'),
+        joinedload('_address').joinedload('user').joinedload('preferences'),
+        joinedload('_user').joinedload('preferences'),
+        joinedload('_user').joinedload('_preferred_address').joinedload(
+            'preferences'))
+
+
+def _lookup_members(query, addresses):
+    """Look up the members matching a set of addresses, in batches.
+
+    :param query: The base query selecting the roster's members.
+    :param addresses: The email addresses to search for.
+    :type addresses: iterable of text
+    :return: A mapping from email address to member.
+    :rtype: dictionary
+    """
+    addresses = list(set(addresses))
+    query = _with_preferences(query)
+    members = {}
+    for start in range(0, len(addresses), BATCH_SIZE):
+        batch = addresses[start:start+BATCH_SIZE]
+        results = query.filter(Member.address_id == Address.id,
+                               Address.email.in_(batch))
+        for member in results:
+            members[member._address.email] = member
+    return members
 
 
 
@@ -72,7 +122,7 @@ class AbstractRoster:
     @property
     def members(self):
         """See `IRoster`."""
-        for member in self._query():
+        for member in _with_preferences(self._query()):
             yield member
 
     @property
@@ -117,6 +167,10 @@ class AbstractRoster:
                 'Too many matching member results: {0}'.format(
                     results.count()))
 
+    def get_members(self, addresses):
+        """See `IRoster`."""
+        return _lookup_members(self._query(), addresses)
+
 
 
 class MemberRoster(AbstractRoster):
@@ -185,56 +239,147 @@ class AdministratorRoster(AbstractRoster):
 class DeliveryMemberRoster(AbstractRoster):
     """Return all the members having a particular kind of delivery."""
 
-    @property
-    def member_count(self):
-        """See `IRoster`."""
-        # XXX 2012-03-15 BAW: It would be nice to make this more efficient.
-        # The problem is that you'd have to change the loop in _get_members()
-        # checking the delivery mode to a query parameter.
-        return len(tuple(self.members))
+    role = MemberRole.member
+
+    def _resolve(self, store):
+        """Query the members of the mailing list, joined to their preferences.
+
+        A member's delivery mode and status are inherited through its
+        preferences, then its address's preferences, then that address's
+        user's preferences, and finally the system default.  This is the
+        same chain that `Member.delivery_mode` follows, but it is resolved
+        inside the database so that non-matching members are never loaded.
+
+        :return: The query, and the SQL expressions of the members' delivery
+            mode and delivery status.
+        :rtype: 3-tuple
+        """
+        # Avoid circular imports.
+        from mailman.model.user import User
+        member_preferences = aliased(Preferences)
+        address_preferences = aliased(Preferences)
+        user_preferences = aliased(Preferences)
+        # Members subscribed via their user get delivered to the user's
+        # preferred address.
+        subscribed_user = aliased(User)
+        address_user = aliased(User)
+        def resolved(name, type_):
+            default = getattr(system_preferences, name)
+            return func.coalesce(
+                getattr(member_preferences, name),
+                getattr(address_preferences, name),
+                getattr(user_preferences, name),
+                literal(default, Enum(type_)))
+        query = store.query(Member).outerjoin(
+            member_preferences,
+            Member.preferences_id == member_preferences.id).outerjoin(
+            subscribed_user,
+            Member.user_id == subscribed_user.id).outerjoin(
+            Address,
+            Address.id == func.coalesce(
+                Member.address_id,
+                subscribed_user._preferred_address_id)).outerjoin(
+            address_preferences,
+            Address.preferences_id == address_preferences.id).outerjoin(
+            address_user,
+            Address.user_id == address_user.id).outerjoin(
+            user_preferences,
+            address_user.preferences_id == user_preferences.id).filter(
+            Member.list_id == self._mlist.list_id,
+            Member.role == self.role)
+        return (query,
+                resolved('delivery_mode', DeliveryMode),
+                resolved('delivery_status', DeliveryStatus))
 
     @dbconnection
-    def _get_members(self, store, *delivery_modes):
-        """The set of members for a mailing list, filter by delivery mode.
+    def _query(self, store, *delivery_modes):
+        """The members of a mailing list, filtered by delivery mode.
 
         :param delivery_modes: The modes to filter on.
         :type delivery_modes: sequence of `DeliveryMode`.
-        :return: A generator of members.
-        :rtype: generator
+        :return: The query selecting the matching members.
         """
-        results = store.query(Member).filter_by(
-            list_id = self._mlist.list_id,
-            role = MemberRole.member)
-        for member in results:
-            if member.delivery_mode in delivery_modes:
-                yield member
+        query, delivery_mode, delivery_status = self._resolve(store)
+        return query.filter(delivery_mode.in_(delivery_modes))
 
+    @dbconnection
+    def recipients_by_mode(self, store):
+        """The addresses to deliver to, by the members' delivery modes.
 
-class RegularMemberRoster(DeliveryMemberRoster):
-    """Return all the regular delivery members of a list."""
+        Members whose delivery is not enabled are left out.  The addresses,
+        delivery modes and delivery statuses of all the members are resolved
+        in a single query, without loading the members themselves.
 
-    name = 'regular_members'
+        :return: A mapping from each of the roster's delivery modes to the
+            set of the case-preserved email addresses of the members having
+            that delivery mode.
+        :rtype: dictionary
+        """
+        query, delivery_mode, delivery_status = self._resolve(store)
+        query = query.with_entities(
+            Address.email, Address._original, delivery_mode).filter(
+            delivery_mode.in_(self.delivery_modes),
+            delivery_status == DeliveryStatus.enabled)
+        recipients = dict((mode, set()) for mode in self.delivery_modes)
+        for email, original, mode in query:
+            recipients[mode].add(email if original is None else original)
+        return recipients
+
+    @dbconnection
+    def recipients(self, store):
+        """The addresses to deliver to.
+
+        Members whose delivery is not enabled are left out.  As with
+        `recipients_by_mode()`, the addresses are resolved in a single query,
+        without loading the members themselves.
+
+        :return: The set of the lower-cased email addresses of the members.
+        :rtype: set
+        """
+        query, delivery_mode, delivery_status = self._resolve(store)
+        query = query.with_entities(Address.email).filter(
+            delivery_mode.in_(self.delivery_modes),
+            delivery_status == DeliveryStatus.enabled)
+        return set(email for (email,) in query)
 
     @property
     def members(self):
         """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.regular):
+        for member in _with_preferences(self._query(*self.delivery_modes)):
             yield member
 
+    @property
+    def member_count(self):
+        """See `IRoster`."""
+        return self._query(*self.delivery_modes).count()
+
+    def get_member(self, address):
+        """See `IRoster`."""
+        return _with_preferences(self._query(*self.delivery_modes)).filter(
+            Address.email == address).first()
+
+    def get_members(self, addresses):
+        """See `IRoster`."""
+        return _lookup_members(self._query(*self.delivery_modes), addresses)
+
+
+class RegularMemberRoster(DeliveryMemberRoster):
+    """Return all the regular delivery members of a list."""
+
+    name = 'regular_members'
+    delivery_modes = (DeliveryMode.regular,)
+
 
 
 class DigestMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'digest_members'
-
-    @property
-    def members(self):
-        """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.plaintext_digests,
-                                        DeliveryMode.mime_digests,
-                                        DeliveryMode.summary_digests):
-            yield member
+    delivery_modes = (
+        DeliveryMode.plaintext_digests,
+        DeliveryMode.mime_digests,
+        DeliveryMode.summary_digests,
+        )
 
 
 
@@ -274,7 +419,7 @@ class Memberships:
     @property
     def members(self):
         """See `IRoster`."""
-        for member in self._query():
+        for member in _with_preferences(self._query()):
             yield member
 
     @property
@@ -302,3 +447,7 @@ class Memberships:
             raise AssertionError(
                 'Too many matching member results: {0}'.format(
                     results.count()))
+
+    def get_members(self, addresses):
+        """See `IRoster`."""
+        return _lookup_members(self._query(), addresses)
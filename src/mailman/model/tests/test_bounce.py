@@ -21,20 +21,27 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'TestBounceEvents',
+    'TestBounceScoring',
     ]
 
 
 import unittest
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from zope.component import getUtility
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
 from mailman.database.transaction import transaction
 from mailman.interfaces.bounce import BounceContext, IBounceProcessor
+from mailman.interfaces.member import DeliveryStatus
+from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.helpers import (
+    get_queue_messages, recorded_statements,
     specialized_message_from_string as message_from_string)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import factory
 
 
 
@@ -98,3 +105,143 @@ Message-Id: <first>
         # Now there will be no unprocessed events.
         unprocessed = list(self._processor.unprocessed)
         self.assertEqual(len(unprocessed), 0)
+
+    def test_register_many(self):
+        # Several bouncing addresses are registered in a single statement.
+        config.db.store.flush()
+        with recorded_statements() as statements:
+            count = self._processor.register_many(
+                self._mlist, ['anne@example.com', 'bart@example.com'],
+                self._msg, BounceContext.probe)
+        self.assertEqual(count, 2)
+        self.assertEqual(len(statements), 1)
+        events = list(self._processor.unprocessed)
+        self.assertEqual(sorted(event.email for event in events),
+                         ['anne@example.com', 'bart@example.com'])
+        for bounce_event in events:
+            self.assertEqual(bounce_event.list_id, 'test.example.com')
+            self.assertEqual(bounce_event.timestamp,
+                             datetime(2005, 8, 1, 7, 49, 23))
+            self.assertEqual(bounce_event.message_id, '<first>')
+            self.assertEqual(bounce_event.context, BounceContext.probe)
+
+    def test_register_none(self):
+        self.assertEqual(
+            self._processor.register_many(self._mlist, [], self._msg), 0)
+        self.assertEqual(list(self._processor.events), [])
+
+
+
+class TestBounceScoring(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._processor = getUtility(IBounceProcessor)
+        self._mlist = create_list('test@example.com')
+        self._mlist.bounce_score_threshold = 3
+        self._mlist.bounce_info_stale_after = timedelta(days=7)
+        self._mlist.bounce_you_are_disabled_warnings = 2
+        self._mlist.bounce_you_are_disabled_warnings_interval = timedelta(
+            days=7)
+        user_manager = getUtility(IUserManager)
+        self._anne = self._mlist.subscribe(
+            user_manager.create_address('Anne@example.com'))
+        self._bart = self._mlist.subscribe(
+            user_manager.create_address('bart@example.com'))
+        self._msg = message_from_string("""\
+From: mail-daemon@example.com
+To: test-bounces@example.com
+Message-Id: <first>
+
+""")
+
+    def _bounce(self, *emails, **kws):
+        self._processor.register_many(
+            self._mlist, emails, self._msg, kws.get('context'))
+
+    def test_one_point_per_day(self):
+        # However many bounces there are in a day, they score one point.
+        self._bounce('anne@example.com', 'bart@example.com')
+        self._bounce('anne@example.com')
+        self.assertEqual(self._processor.process_events(), [])
+        self.assertEqual(self._anne.bounce_score, 1)
+        self.assertEqual(self._anne.last_bounce_received,
+                         datetime(2005, 8, 1, 7, 49, 23))
+        self.assertEqual(self._bart.bounce_score, 1)
+        self.assertEqual(list(self._processor.unprocessed), [])
+        # Scoring is incremental: the next pass only sees the new events.
+        self._bounce('anne@example.com')
+        self._processor.process_events()
+        self.assertEqual(self._anne.bounce_score, 1)
+        factory.fast_forward()
+        self._bounce('anne@example.com')
+        self._processor.process_events()
+        self.assertEqual(self._anne.bounce_score, 2)
+        self.assertEqual(self._bart.bounce_score, 1)
+
+    def test_disabled_at_threshold(self):
+        for day in range(3):
+            self._bounce('anne@example.com')
+            factory.fast_forward()
+        # The days are scored in one pass.
+        self.assertEqual(self._processor.process_events(), [self._anne])
+        self.assertEqual(self._anne.bounce_score, 3)
+        self.assertEqual(self._anne.delivery_status,
+                         DeliveryStatus.by_bounces)
+        self.assertEqual(self._bart.delivery_status, DeliveryStatus.enabled)
+        # Bounces from members whose delivery is disabled aren't scored.
+        self._bounce('anne@example.com')
+        self.assertEqual(self._processor.process_events(), [])
+        self.assertEqual(self._anne.bounce_score, 3)
+
+    def test_stale_score(self):
+        # The score starts over when the last scored bounce has gone stale.
+        self._bounce('anne@example.com')
+        factory.fast_forward()
+        self._bounce('anne@example.com')
+        self._processor.process_events()
+        self.assertEqual(self._anne.bounce_score, 2)
+        factory.fast_forward(days=8)
+        self._bounce('anne@example.com')
+        self._processor.process_events()
+        self.assertEqual(self._anne.bounce_score, 1)
+
+    def test_probe_bounce_disables(self):
+        self._bounce('bart@example.com', context=BounceContext.probe)
+        self.assertEqual(self._processor.process_events(), [self._bart])
+        self.assertEqual(self._bart.delivery_status,
+                         DeliveryStatus.by_bounces)
+
+    def test_not_scored(self):
+        # Bounces from nonmembers, and for lists which don't process
+        # bounces, are just marked as processed.
+        self._bounce('cris@example.com')
+        self._processor.process_events()
+        self.assertEqual(list(self._processor.unprocessed), [])
+        self._mlist.process_bounces = False
+        self._bounce('anne@example.com')
+        self._processor.process_events()
+        self.assertEqual(self._anne.bounce_score, 0)
+        self.assertEqual(list(self._processor.unprocessed), [])
+
+    def test_remove_disabled_members(self):
+        self._bounce('anne@example.com', context=BounceContext.probe)
+        self._processor.process_events()
+        # Disabled members are removed once all their warnings could have
+        # been sent.
+        factory.fast_forward(days=13)
+        self.assertEqual(self._processor.remove_disabled_members(), [])
+        # Clear out the welcome messages.
+        get_queue_messages('virgin')
+        factory.fast_forward()
+        self.assertEqual(self._processor.remove_disabled_members(),
+                         [('test.example.com', 'anne@example.com')])
+        self.assertIsNone(self._mlist.members.get_member('anne@example.com'))
+        self.assertIsNotNone(
+            self._mlist.members.get_member('bart@example.com'))
+        # The list owners are notified of the removal, but the bouncing
+        # member is not.
+        messages = get_queue_messages('virgin')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msg['to'], 'test-owner@example.com')
+        self.assertIn('anne@example.com', messages[0].msg.get_payload())
@@ -24,9 +24,11 @@ __all__ = [
     'TestListCreation',
     'TestListLifecycleEvents',
     'TestListManager',
+    'TestListNames',
     ]
 
 
+import os
 import unittest
 
 from zope.component import getUtility
@@ -41,9 +43,11 @@ from mailman.interfaces.messages import IMessageStore
 from mailman.interfaces.requests import IListRequests
 from mailman.interfaces.subscriptions import ISubscriptionService
 from mailman.interfaces.usermanager import IUserManager
+from mailman.model.listmanager import STAMP_FILE, invalidate_names
+from mailman.model.mailinglist import MailingList
 from mailman.model.mime import ContentFilter
 from mailman.testing.helpers import (
-    event_subscribers, specialized_message_from_string)
+    event_subscribers, recorded_statements, specialized_message_from_string)
 from mailman.testing.layers import ConfigLayer
 
 
@@ -165,3 +169,103 @@ class TestListCreation(unittest.TestCase):
         self.assertIsNone(manager.get('my-LIST@example.com'))
         mlist = manager.get('my-list@example.com')
         self.assertEqual(mlist.list_id, 'my-list.example.com')
+
+
+
+class TestListNames(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._manager = getUtility(IListManager)
+        create_list('ant@example.com')
+        config.db.commit()
+        self._stamp_path = os.path.join(config.DATA_DIR, STAMP_FILE)
+
+    def _statements(self, callable):
+        with recorded_statements() as statements:
+            callable()
+        return statements
+
+    def test_names_are_cached(self):
+        # Once the list names have been loaded, they are not loaded again
+        # until the set of mailing lists changes.
+        self.assertEqual(self._manager.names, set(['ant@example.com']))
+        self.assertEqual(
+            self._statements(lambda: list(self._manager.names)), [])
+
+    def test_get_missing_list(self):
+        # Looking up a list which doesn't exist does not go to the database.
+        list(self._manager.names)
+        statements = self._statements(
+            lambda: self._manager.get('bee@example.com'))
+        self.assertEqual(statements, [])
+
+    def test_get_is_cached(self):
+        # Looking up the same mailing list again, by name or by list id,
+        # returns the same object without going to the database.
+        mlist = self._manager.get('ant@example.com')
+        statements = self._statements(lambda: (
+            self.assertIs(self._manager.get('ant@example.com'), mlist),
+            self.assertIs(self._manager.get_by_list_id('ant.example.com'),
+                          mlist)))
+        self.assertEqual(statements, [])
+
+    def test_get_after_commit(self):
+        # The mailing list stays cached across transactions, but its
+        # attributes are reloaded.
+        mlist = self._manager.get('ant@example.com')
+        config.db.commit()
+        statements = self._statements(
+            lambda: self.assertIs(self._manager.get('ant@example.com'), mlist))
+        self.assertEqual(statements, [])
+        config.db.store.execute(
+            MailingList.__table__.update().values(display_name='Ants'))
+        config.db.commit()
+        self.assertEqual(self._manager.get('ant@example.com').display_name,
+                         'Ants')
+
+    def test_create_list(self):
+        # A newly created list can be found right away, even before the
+        # transaction is committed.
+        list(self._manager.names)
+        create_list('bee@example.com')
+        self.assertEqual(self._manager.names,
+                         set(['ant@example.com', 'bee@example.com']))
+        self.assertEqual(self._manager.get('bee@example.com').list_id,
+                         'bee.example.com')
+
+    def test_create_list_abort(self):
+        # A newly created list goes away again when the transaction is
+        # aborted.
+        create_list('bee@example.com')
+        self.assertIsNotNone(self._manager.get('bee@example.com'))
+        config.db.abort()
+        self.assertEqual(self._manager.names, set(['ant@example.com']))
+        self.assertIsNone(self._manager.get('bee@example.com'))
+
+    def test_delete_list(self):
+        # A deleted list is removed from the list names.
+        list(self._manager.names)
+        self._manager.delete(self._manager.get('ant@example.com'))
+        self.assertEqual(self._manager.names, set())
+        self.assertIsNone(self._manager.get('ant@example.com'))
+
+    def test_commit_updates_stamp(self):
+        # Committing the creation of a mailing list replaces the stamp file,
+        # which tells other processes to reload the list names.
+        before = os.stat(self._stamp_path)
+        create_list('bee@example.com')
+        self.assertEqual(os.stat(self._stamp_path).st_ino, before.st_ino)
+        config.db.commit()
+        self.assertNotEqual(os.stat(self._stamp_path).st_ino, before.st_ino)
+
+    def test_other_process(self):
+        # When another process changes the set of mailing lists, it replaces
+        # the stamp file and the list names are reloaded.
+        list(self._manager.names)
+        # Delete the mailing list behind the list manager's back.
+        config.db.store.query(MailingList).delete()
+        config.db.commit()
+        self.assertEqual(self._manager.names, set(['ant@example.com']))
+        invalidate_names()
+        self.assertEqual(self._manager.names, set())
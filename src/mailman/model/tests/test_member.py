@@ -22,16 +22,19 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestMember',
+    'TestMemberPreferences',
     ]
 
 
 import unittest
 
 from mailman.app.lifecycle import create_list
-from mailman.interfaces.member import MemberRole, MembershipError
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode, MemberRole, MembershipError
 from mailman.interfaces.user import UnverifiedAddressError
 from mailman.interfaces.usermanager import IUserManager
 from mailman.model.member import Member
+from mailman.testing.helpers import recorded_statements
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
 
@@ -102,3 +105,84 @@ class TestMember(unittest.TestCase):
         self.assertRaises(ValueError, Member, MemberRole.member,
                           self._mlist.list_id,
                           'aperson@example.com')
+
+
+
+class TestMemberPreferences(unittest.TestCase):
+    """Test the effective preferences of members."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._anne = getUtility(IUserManager).create_user('anne@example.com')
+        self._address = list(self._anne.addresses)[0]
+        self._member = self._mlist.subscribe(self._address)
+
+    def _statements(self, callable):
+        with recorded_statements() as statements:
+            callable()
+        return statements
+
+    def _read_preferences(self):
+        return (self._member.acknowledge_posts,
+                self._member.delivery_mode,
+                self._member.delivery_status,
+                self._member.preferred_language,
+                self._member.receive_list_copy,
+                self._member.receive_own_postings)
+
+    def test_preferences_are_cached(self):
+        # Once the effective preferences have been calculated, reading them
+        # again does not go back to the database.  Without a preferred
+        # language of its own, the member would fall back to the mailing
+        # list's, which is looked up separately.
+        self._anne.preferences.preferred_language = 'en'
+        self._read_preferences()
+        self.assertEqual(self._statements(self._read_preferences), [])
+
+    def test_mailing_list_is_cached(self):
+        # A member's mailing list is looked up through the list manager, which
+        # hands back the same object without going to the database.
+        mlist = self._member.mailing_list
+        statements = self._statements(
+            lambda: self.assertIs(self._member.mailing_list, mlist))
+        self.assertEqual(statements, [])
+
+    def test_member_preference_change(self):
+        self.assertEqual(self._member.delivery_mode, DeliveryMode.regular)
+        self._member.preferences.delivery_mode = DeliveryMode.mime_digests
+        self.assertEqual(self._member.delivery_mode, DeliveryMode.mime_digests)
+
+    def test_address_preference_change(self):
+        self.assertEqual(self._member.delivery_mode, DeliveryMode.regular)
+        self._address.preferences.delivery_mode = DeliveryMode.mime_digests
+        self.assertEqual(self._member.delivery_mode, DeliveryMode.mime_digests)
+
+    def test_user_preference_change(self):
+        self.assertTrue(self._member.receive_own_postings)
+        self._anne.preferences.receive_own_postings = False
+        self.assertFalse(self._member.receive_own_postings)
+
+    def test_relinked_address(self):
+        # Linking the address to a different user changes which user
+        # preferences are inherited.
+        self.assertTrue(self._member.receive_list_copy)
+        bart = getUtility(IUserManager).create_user()
+        bart.preferences.receive_list_copy = False
+        self._anne.unlink(self._address)
+        bart.link(self._address)
+        self.assertFalse(self._member.receive_list_copy)
+
+    def test_change_in_another_transaction(self):
+        # Preferences changed outside of this session are seen once the
+        # member has been expired by the end of the transaction.
+        self.assertEqual(self._member.delivery_mode, DeliveryMode.regular)
+        preferences_id = self._member.preferences_id
+        config.db.commit()
+        config.db.engine.execute(
+            'UPDATE preferences SET delivery_mode = {0} WHERE id = {1}'.format(
+                DeliveryMode.summary_digests.value, preferences_id))
+        config.db.commit()
+        self.assertEqual(self._member.delivery_mode,
+                         DeliveryMode.summary_digests)
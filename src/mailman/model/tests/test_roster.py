@@ -31,8 +31,10 @@ import unittest
 from zope.component import getUtility
 
 from mailman.app.lifecycle import create_list
-from mailman.interfaces.member import DeliveryMode, MemberRole
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
 from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.helpers import recorded_statements
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
 
@@ -129,6 +131,150 @@ class TestMailingListRoster(unittest.TestCase):
         self.assertEqual(self._mlist.digest_members.member_count, 1)
         self.assertEqual(self._mlist.subscribers.member_count, 4)
 
+    def test_get_members(self):
+        # Members can be looked up in bulk.
+        anne = self._mlist.subscribe(self._anne, role=MemberRole.member)
+        bart = self._mlist.subscribe(self._bart, role=MemberRole.member)
+        self._mlist.subscribe(self._cris, role=MemberRole.owner)
+        members = self._mlist.members.get_members([
+            'anne@example.com', 'bart@example.com', 'cris@example.com',
+            'dave@example.com'])
+        self.assertEqual(members, {
+            'anne@example.com': anne,
+            'bart@example.com': bart,
+            })
+        owners = self._mlist.owners.get_members(['cris@example.com'])
+        self.assertEqual(list(owners), ['cris@example.com'])
+
+    def test_get_members_batches(self):
+        # More addresses than fit in a single query can be looked up.
+        members = self._mlist.members.get_members(
+            'person{0}@example.com'.format(i) for i in range(1200))
+        self.assertEqual(members, {})
+
+    def test_delivery_mode_inherited(self):
+        # A member's delivery mode can come from its own preferences, its
+        # address's preferences, or its address's user's preferences.
+        user_manager = getUtility(IUserManager)
+        dave = user_manager.create_user('dave@example.com')
+        self._mlist.subscribe(self._anne, role=MemberRole.member)
+        bart = self._mlist.subscribe(self._bart, role=MemberRole.member)
+        self._mlist.subscribe(self._cris, role=MemberRole.member)
+        self._mlist.subscribe(list(dave.addresses)[0])
+        self._cris.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        dave.preferences.delivery_mode = DeliveryMode.summary_digests
+        # Bart's address says digests, but his member preference wins.
+        self._bart.preferences.delivery_mode = DeliveryMode.mime_digests
+        bart.preferences.delivery_mode = DeliveryMode.regular
+        self.assertEqual(self._mlist.regular_members.member_count, 2)
+        self.assertEqual(self._mlist.digest_members.member_count, 2)
+        self.assertEqual(
+            sorted(member.address.email
+                   for member in self._mlist.digest_members.members),
+            ['cris@example.com', 'dave@example.com'])
+        self.assertEqual(
+            sorted(member.address.email
+                   for member in self._mlist.regular_members.members),
+            ['anne@example.com', 'bart@example.com'])
+
+    def test_delivery_mode_of_user_subscription(self):
+        # A user subscribed via their preferred address inherits the
+        # delivery mode of that address.
+        user_manager = getUtility(IUserManager)
+        dave = user_manager.create_user('dave@example.com')
+        preferred = list(dave.addresses)[0]
+        preferred.verified_on = now()
+        dave.preferred_address = preferred
+        self._mlist.subscribe(dave)
+        self.assertEqual(self._mlist.regular_members.member_count, 1)
+        preferred.preferences.delivery_mode = DeliveryMode.mime_digests
+        self.assertEqual(self._mlist.regular_members.member_count, 0)
+        self.assertEqual(self._mlist.digest_members.member_count, 1)
+        self.assertEqual(
+            self._mlist.digest_members.get_member('dave@example.com').user,
+            dave)
+        self.assertIsNone(
+            self._mlist.regular_members.get_member('dave@example.com'))
+
+    def test_delivery_member_count_is_one_query(self):
+        # Counting the regular or digest members does not load any members.
+        for address in (self._anne, self._bart, self._cris):
+            self._mlist.subscribe(address, role=MemberRole.member)
+        with recorded_statements() as statements:
+            self.assertEqual(self._mlist.regular_members.member_count, 3)
+            self.assertEqual(self._mlist.digest_members.member_count, 0)
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertIn('count(', statement.lower())
+
+    def test_recipients_by_mode(self):
+        # The digest recipients are resolved by delivery mode in a single
+        # query.  Members with disabled delivery are left out, and the
+        # addresses keep their case.
+        user_manager = getUtility(IUserManager)
+        dave = user_manager.create_address('Dave@example.com')
+        for address in (self._anne, self._bart, self._cris, dave):
+            self._mlist.subscribe(address, role=MemberRole.member)
+        self._anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._bart.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._bart.preferences.delivery_status = DeliveryStatus.by_user
+        self._cris.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        dave.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        # Don't count the statements saving the preferences.
+        config.db.store.flush()
+        with recorded_statements() as statements:
+            recipients = self._mlist.digest_members.recipients_by_mode()
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(recipients, {
+            DeliveryMode.mime_digests: set(['anne@example.com']),
+            DeliveryMode.plaintext_digests: set(
+                ['cris@example.com', 'Dave@example.com']),
+            DeliveryMode.summary_digests: set(),
+            })
+        self.assertEqual(self._mlist.regular_members.recipients_by_mode(),
+                         {DeliveryMode.regular: set()})
+
+    def test_recipients(self):
+        # The regular recipients are resolved in a single query.  Members with
+        # disabled delivery are left out, and the addresses are lower-cased.
+        user_manager = getUtility(IUserManager)
+        dave = user_manager.create_address('Dave@example.com')
+        for address in (self._anne, self._bart, self._cris, dave):
+            self._mlist.subscribe(address, role=MemberRole.member)
+        self._bart.preferences.delivery_status = DeliveryStatus.by_user
+        self._cris.preferences.delivery_mode = DeliveryMode.mime_digests
+        # Don't count the statements saving the preferences.
+        config.db.store.flush()
+        with recorded_statements() as statements:
+            recipients = self._mlist.regular_members.recipients()
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(recipients,
+                         set(['anne@example.com', 'dave@example.com']))
+        self.assertEqual(self._mlist.digest_members.recipients(),
+                         set(['cris@example.com']))
+
+    def test_members_load_their_preferences(self):
+        # Iterating over the members loads everything needed to calculate
+        # their preferences in the same query, even after a commit has
+        # expired the members.
+        user_manager = getUtility(IUserManager)
+        dave = user_manager.create_user('dave@example.com')
+        preferred = list(dave.addresses)[0]
+        preferred.verified_on = now()
+        dave.preferred_address = preferred
+        self._mlist.subscribe(dave)
+        for address in (self._anne, self._bart, self._cris):
+            self._mlist.subscribe(address, role=MemberRole.member)
+        self._cris.preferences.delivery_mode = DeliveryMode.mime_digests
+        for roster in (self._mlist.members, self._mlist.regular_members):
+            config.db.commit()
+            # Don't count the statement reloading the mailing list.
+            self._mlist.list_id
+            with recorded_statements() as statements:
+                modes = [member.delivery_mode for member in roster.members]
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(modes.count(DeliveryMode.regular), 3)
+
 
 
 class TestMembershipsRoster(unittest.TestCase):
@@ -31,15 +31,22 @@ import socket
 import logging
 import smtplib
 
+from cStringIO import StringIO
+from email.generator import Generator
+from email.message import Message
+from lazr.config import as_boolean, as_timedelta
 from zope.interface import implementer
 
 from mailman.config import config
 from mailman.interfaces.mta import IMailTransportAgentDelivery
-from mailman.mta.connection import Connection
+from mailman.mta.connection import Connection, get_pool
 
 
 log = logging.getLogger('mailman.smtp')
 
+# Stands in for a recipient's shared text while it is being changed.
+PLACEHOLDER = b'\x00shared text\x00'
+
 
 
 @implementer(IMailTransportAgentDelivery)
@@ -48,9 +55,28 @@ class BaseDelivery:
 
     def __init__(self):
         """Create a basic deliverer."""
+        self._connection = self._make_connection()
+
+    def _make_connection(self):
+        """Return a connection to the outgoing MTA.
+
+        This is either a new `Connection`, or the process-wide
+        `ConnectionPool` if connection pooling is enabled.
+        """
         username = (config.mta.smtp_user if config.mta.smtp_user else None)
         password = (config.mta.smtp_pass if config.mta.smtp_pass else None)
-        self._connection = Connection(
+        pool_size = int(config.mta.connection_pool_size)
+        if pool_size > 0:
+            idle_timeout = as_timedelta(config.mta.connection_idle_timeout)
+            return get_pool(
+                config.mta.smtp_host, int(config.mta.smtp_port),
+                int(config.mta.max_sessions_per_connection),
+                username, password,
+                size=pool_size,
+                idle_timeout=(idle_timeout.total_seconds()
+                              if idle_timeout else None),
+                health_check=as_boolean(config.mta.connection_health_check))
+        return Connection(
             config.mta.smtp_host, int(config.mta.smtp_port),
             int(config.mta.max_sessions_per_connection),
             username, password)
@@ -74,7 +100,7 @@ class BaseDelivery:
         message_id = msg['message-id']
         try:
             refused = self._connection.sendmail(
-                sender, recipients, msg.as_string())
+                sender, recipients, self._flatten(msg))
         except smtplib.SMTPRecipientsRefused as error:
             log.error('%s recipients refused: %s', message_id, error)
             refused = error.recipients
@@ -97,6 +123,21 @@ class BaseDelivery:
                 for recipient in recipients)
         return refused
 
+    def _flatten(self, msg):
+        """Return the text of the message to deliver.
+
+        :param msg: The message being delivered.
+        :type msg: `Message`
+        :return: The flattened message.
+        :rtype: string
+        """
+        # The body of a message which has been rendered ahead of time, e.g. a
+        # digest, is sent exactly as it is, without parsing it.
+        body = _unparsed_body(msg)
+        if body is not None:
+            return _render_headers(msg) + body
+        return msg.as_string()
+
     def _get_sender(self, mlist, msg, msgdata):
         """Return the envelope sender to use.
 
@@ -134,12 +175,22 @@ class IndividualDelivery(BaseDelivery):
     The core concept here is that for each recipient, the deliver() method
     iterates over the list of registered callbacks, each of which have a
     chance to modify the message before final delivery.
+
+    The message each callback sees is a cheap copy of the original message.
+    It has its own headers and its own list of top-level subparts, but it
+    shares everything else, including the subparts themselves, with the
+    original.  Callbacks may change headers and replace the payload, but they
+    must not modify the payload or any subpart in place.  The original body
+    and its subparts are flattened just once for all recipients, and each
+    recipient's copy reuses their text wherever it still contains them.
     """
 
     def __init__(self):
         """See `BaseDelivery`."""
         super(IndividualDelivery, self).__init__()
         self.callbacks = []
+        # The original message's flattened body, while delivering.
+        self._shared = None
 
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`.
@@ -150,25 +201,242 @@ class IndividualDelivery(BaseDelivery):
         """
         refused = {}
         recipients = msgdata.get('recipients', set())
-        for recipient in recipients:
-            log.debug('IndividualDelivery to: %s', recipient)
-            # Make a copy of the original messages and operator on it, since
-            # we're going to munge it repeatedly for each recipient.
-            message_copy = copy.deepcopy(msg)
-            msgdata_copy = msgdata.copy()
-            # Squirrel the current recipient away in the message metadata.
-            # That way the subclass's _get_sender() override can encode the
-            # recipient address in the sender, e.g. for VERP.
-            msgdata_copy['recipient'] = recipient
-            # See if the recipient is a member of the mailing list, and if so,
-            # squirrel this information away for use by other modules, such as
-            # the header/footer decorator.  XXX 2012-03-05 this is probably
-            # highly inefficient on the database.
-            member = mlist.members.get_member(recipient)
-            msgdata_copy['member'] = member
-            for callback in self.callbacks:
-                callback(mlist, message_copy, msgdata_copy)
-            status = self._deliver_to_recipients(
-                mlist, message_copy, msgdata_copy, [recipient])
-            refused.update(status)
+        # A message rendered ahead of time, e.g. a digest, keeps its body
+        # unparsed, and each recipient's copy is sent with that body.
+        # Otherwise, flatten the original message once.  This also fixes any
+        # multipart boundaries, so the per-recipient copies all render the
+        # same body.
+        if _unparsed_body(msg) is None:
+            self._shared = _SharedBody(msg)
+        # Look up all the recipients who are members of the mailing list in
+        # one go, so that the callbacks, e.g. the header/footer decorator,
+        # don't have to hit the database for every recipient.
+        members = mlist.members.get_members(recipients)
+        try:
+            for recipient in recipients:
+                log.debug('IndividualDelivery to: %s', recipient)
+                # Make a copy of the original message and operate on it,
+                # since we're going to munge it repeatedly for each
+                # recipient.
+                message_copy = _copy_message(msg)
+                msgdata_copy = msgdata.copy()
+                # Squirrel the current recipient away in the message
+                # metadata.  That way the subclass's _get_sender() override
+                # can encode the recipient address in the sender, e.g. for
+                # VERP.
+                msgdata_copy['recipient'] = recipient
+                # If the recipient is a member of the mailing list, squirrel
+                # this information away for use by other modules, such as the
+                # header/footer decorator.
+                msgdata_copy['member'] = members.get(recipient)
+                for callback in self.callbacks:
+                    callback(mlist, message_copy, msgdata_copy)
+                status = self._deliver_to_recipients(
+                    mlist, message_copy, msgdata_copy, [recipient])
+                refused.update(status)
+        finally:
+            self._shared = None
         return refused
+
+    def _stand_in(self, msg):
+        """Return a copy of the message which stands in for its text.
+
+        When the message still has the original's unencoded plain ASCII text
+        payload, the copy's payload is a placeholder for that text.  A
+        callback can change the copy instead of the message, e.g. to add text
+        around the placeholder, without handling the whole text.
+
+        :param msg: The recipient's copy of the message.
+        :type msg: `Message`
+        :return: The stand-in, or None if the message has no shared text.
+        :rtype: `Message`
+        """
+        shared = self._shared
+        if (shared is None or shared.placeholder is None
+                or not _same_body(msg, shared.original)):
+            return None
+        stand_in = _copy_message(msg)
+        stand_in.set_payload(shared.placeholder)
+        return stand_in
+
+    def _use_stand_in(self, msg, stand_in):
+        """Make the message like its changed stand-in, if possible.
+
+        The message gets the stand-in's headers, and its payload with the
+        shared text in place of the placeholder.  That only works if the
+        placeholder is still in the stand-in's payload exactly once, and
+        isn't transfer encoded.  When the message is flattened, the shared
+        text is spliced into the flattened stand-in.
+
+        :param msg: The recipient's copy of the message.
+        :type msg: `Message`
+        :param stand_in: The changed stand-in returned by `_stand_in()`.
+        :type stand_in: `Message`
+        :return: Whether the message was made like its stand-in.
+        :rtype: bool
+        """
+        shared = self._shared
+        payload = stand_in.get_payload()
+        cte = stand_in.get('content-transfer-encoding', '7bit').lower()
+        if (not isinstance(payload, str) or cte not in ('7bit', '8bit')
+                or payload.count(shared.placeholder) != 1):
+            return False
+        before, placeholder, after = payload.partition(shared.placeholder)
+        msg.__dict__ = stand_in.__dict__
+        msg.set_payload(before + shared.original.get_payload() + after)
+        shared.stand_in = (msg, msg.get_payload(), payload)
+        return True
+
+    def _flatten(self, msg):
+        """See `BaseDelivery`.
+
+        Reuse the text of the original body and its subparts.
+        """
+        if self._shared is None:
+            return super(IndividualDelivery, self)._flatten(msg)
+        return self._shared.flatten(msg)
+
+
+
+class _SharedBody:
+    """The original message's body, flattened once for all recipients."""
+
+    def __init__(self, original):
+        self.original = original
+        # The text of each of the original's subparts, by their id().
+        self.parts = {}
+        self.body = None
+        fp = StringIO()
+        _SharingGenerator(fp, self, record=True).flatten(original)
+        self.body = fp.getvalue()[len(_render_headers(original)):]
+        # The message which last used a stand-in, its payload, and the
+        # stand-in's payload.
+        self.stand_in = (None, None, None)
+        # An unencoded plain ASCII text payload reads the same in any
+        # charset, so it can be spliced into a recipient's copy even if that
+        # changes the charset.  The placeholder keeps any final newline.
+        self.placeholder = None
+        payload = original.get_payload()
+        cte = original.get('content-transfer-encoding', '7bit').lower()
+        if isinstance(payload, str) and cte in ('7bit', '8bit'):
+            try:
+                payload.decode('ascii')
+            except UnicodeError:
+                pass
+            else:
+                self.placeholder = (
+                    PLACEHOLDER + (b'\n' if payload.endswith(b'\n') else b''))
+
+    def flatten(self, msg):
+        """Flatten a recipient's copy of the original message.
+
+        :param msg: The recipient's copy of the message.
+        :type msg: `Message`
+        :return: The flattened message.
+        :rtype: string
+        """
+        if _same_body(msg, self.original):
+            return _render_headers(msg) + self.body
+        stand_in, payload, stand_in_payload = self.stand_in
+        if stand_in is msg and msg.get_payload() is payload:
+            # Flatten the message with the stand-in's payload, and splice in
+            # the shared text, i.e. the original payload after any From_
+            # mangling.
+            stand_in = _copy_message(msg)
+            stand_in.set_payload(stand_in_payload)
+            before, placeholder, after = stand_in.as_string().partition(
+                self.placeholder)
+            return before + self.body + after
+        fp = StringIO()
+        _SharingGenerator(fp, self).flatten(msg)
+        return fp.getvalue()
+
+
+
+class _SharingGenerator(Generator):
+    """Reuse the shared text when flattening a recipient's copy.
+
+    Messages with the original's body, and the original's subparts, are
+    written from the text flattened for the original message.
+    """
+
+    def __init__(self, outfp, shared, record=False, depth=0):
+        Generator.__init__(self, outfp)
+        self._outfp = outfp
+        self._shared = shared
+        # Whether to remember the text of the top-level subparts.
+        self._record = record
+        self._depth = depth
+
+    def clone(self, fp):
+        """See `Generator`."""
+        return self.__class__(fp, self._shared, self._record, self._depth + 1)
+
+    def flatten(self, msg, unixfrom=False):
+        """See `Generator`."""
+        shared = self._shared
+        part, text = shared.parts.get(id(msg), (None, None))
+        if part is msg:
+            self._outfp.write(text)
+        elif (not unixfrom and shared.body is not None
+                and _same_body(msg, shared.original)):
+            self._outfp.write(_render_headers(msg))
+            self._outfp.write(shared.body)
+        else:
+            Generator.flatten(self, msg, unixfrom)
+            if self._record and self._depth == 1:
+                shared.parts[id(msg)] = (msg, self._outfp.getvalue())
+
+
+
+def _copy_message(msg):
+    """Return a copy of the message which shares the original's body.
+
+    The copy has its own headers and its own list of subparts, so that
+    headers can be changed and subparts added or removed without affecting
+    the original.
+    """
+    message_copy = copy.copy(msg)
+    # Message.__setstate__() adopts the state dictionary it's given, so a
+    # shallow copy would share the original's attributes.
+    message_copy.__dict__ = msg.__dict__.copy()
+    message_copy._headers = msg._headers[:]
+    # Don't parse an unparsed body just to copy it.
+    if _unparsed_body(msg) is None and isinstance(msg._payload, list):
+        message_copy._payload = msg._payload[:]
+    return message_copy
+
+
+
+def _unparsed_body(msg):
+    """Return the text of a lazy message's body, if it hasn't been parsed."""
+    return getattr(msg, 'get_unparsed_body', lambda: None)()
+
+
+
+def _same_body(msg, original):
+    """Would the message's body render exactly like the original's?"""
+    if (msg._charset is not original._charset
+            or msg.preamble is not original.preamble
+            or msg.epilogue is not original.epilogue
+            or msg.get('content-type') != original.get('content-type')):
+        return False
+    payload = msg._payload
+    original_payload = original._payload
+    if isinstance(payload, list) and isinstance(original_payload, list):
+        return (len(payload) == len(original_payload) and
+                all(part is original_part
+                    for part, original_part in zip(payload, original_payload)))
+    return payload is original_payload
+
+
+
+def _render_headers(msg):
+    """Return the flattened headers, including the separating blank line."""
+    # Flatten a message with the same headers, but without a body.
+    headers = Message()
+    headers._headers = msg._headers
+    headers.set_payload(b'')
+    fp = StringIO()
+    Generator(fp).flatten(headers)
+    return fp.getvalue()
@@ -25,9 +25,19 @@ __all__ = [
     ]
 
 
+import sys
+import copy
+import logging
+import threading
+
+from Queue import Empty, Queue
+
 from mailman.mta.base import BaseDelivery
 
 
+log = logging.getLogger('mailman.smtp')
+
+
 # A mapping of top-level domains to bucket numbers.  The zeroth bucket is
 # reserved for everything else.  At one time, these were the most common
 # domains.
@@ -45,18 +55,27 @@ CHUNKMAP = dict(
 class BulkDelivery(BaseDelivery):
     """Deliver messages to the MSA in as few sessions as possible."""
 
-    def __init__(self, max_recipients=None):
+    def __init__(self, max_recipients=None, max_threads=None):
         """See `BaseDelivery`.
 
         :param max_recipients: The maximum number of recipients per delivery
             chunk.  None, zero or less means to group all recipients into one
             big chunk.
         :type max_recipients: integer
+        :param max_threads: The maximum number of chunks to deliver
+            concurrently, each over its own SMTP session.  None, zero or one
+            means to deliver the chunks one after the other.
+        :type max_threads: integer
         """
         super(BulkDelivery, self).__init__()
         self._max_recipients = (max_recipients
                                 if max_recipients is not None
                                 else 0)
+        self._max_threads = (max_threads
+                             if max_threads is not None
+                             else 0)
+        # The flattened message, while delivering.
+        self._text = None
 
     def chunkify(self, recipients):
         """Split a set of recipients into chunks.
@@ -101,11 +120,88 @@ class BulkDelivery(BaseDelivery):
             yield chunk
 
     def deliver(self, mlist, msg, msgdata):
-        """See `IMailTransportAgentDelivery`."""
+        """See `IMailTransportAgentDelivery`.
+
+        Every chunk gets the same message, so it is flattened just once.
+        """
+        # Generating the text of a multipart message which has no boundary
+        # yet sets one on the message object, so this must also happen
+        # before any concurrent deliveries start.
+        self._text = super(BulkDelivery, self)._flatten(msg)
+        try:
+            chunks = self.chunkify(msgdata.get('recipients', set()))
+            if self._max_threads > 1:
+                chunks = list(chunks)
+                if len(chunks) > 1:
+                    return self._deliver_concurrently(
+                        mlist, msg, msgdata, chunks)
+            refused = {}
+            for recipients in chunks:
+                chunk_refused = self._deliver_to_recipients(
+                    mlist, msg, msgdata, recipients)
+                refused.update(chunk_refused)
+            return refused
+        finally:
+            self._text = None
+
+    def _flatten(self, msg):
+        """See `BaseDelivery`."""
+        if self._text is not None:
+            return self._text
+        return super(BulkDelivery, self)._flatten(msg)
+
+    def _deliver_concurrently(self, mlist, msg, msgdata, chunks):
+        """Deliver the chunks in parallel SMTP sessions.
+
+        Up to `max_threads` worker threads each take chunks off a shared
+        queue and deliver them over their own connection to the MTA.  The
+        results are merged in chunk order, so the returned dictionary is
+        exactly what the serial delivery would have returned.
+
+        :param chunks: The recipient chunks, as returned by `chunkify()`.
+        :type chunks: list of sets of strings
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
+        work = Queue()
+        for index, recipients in enumerate(chunks):
+            work.put((index, recipients))
+        results = [None] * len(chunks)
+        errors = []
+        def worker():
+            # Each thread gets its own connection, so deliver through a
+            # shallow copy of this object.  When connections are pooled,
+            # the copy shares the thread-safe pool.
+            delivery = copy.copy(self)
+            delivery._connection = self._make_connection()
+            try:
+                while not errors:
+                    try:
+                        index, recipients = work.get_nowait()
+                    except Empty:
+                        break
+                    results[index] = delivery._deliver_to_recipients(
+                        mlist, msg, msgdata, recipients)
+            except Exception:
+                log.exception('Concurrent delivery of %s failed',
+                              msg.get('message-id', 'n/a'))
+                errors.append(sys.exc_info())
+            finally:
+                if delivery._connection is not self._connection:
+                    delivery._connection.quit()
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(self._max_threads, len(chunks)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            # Re-raise the first failure in this thread, so that the
+            # outgoing runner handles it just like a serial delivery failure.
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
         refused = {}
-        for recipients in self.chunkify(msgdata.get('recipients', set())):
-            chunk_refused = self._deliver_to_recipients(
-                mlist, msg, msgdata, recipients)
+        for chunk_refused in results:
             refused.update(chunk_refused)
         return refused
 
@@ -37,7 +37,14 @@ class DecoratingMixin:
     def decorate(self, mlist, msg, msgdata):
         """Add recipient-specific headers and footers."""
         decorator = config.handlers['decorate']
-        decorator.process(mlist, msg, msgdata)
+        # Decorating a plain text message rewrites all of its text.  Where
+        # possible, decorate a stand-in for the text shared by all recipients
+        # instead, so that only the header and footer are rendered for each.
+        stand_in = self._stand_in(msg)
+        if stand_in is not None:
+            decorator.process(mlist, stand_in, msgdata)
+        if stand_in is None or not self._use_stand_in(msg, stand_in):
+            decorator.process(mlist, msg, msgdata)
         # Do not decorate a message more than once.
         msgdata['nodecorate'] = True
 
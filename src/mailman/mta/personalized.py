@@ -55,8 +55,13 @@ class PersonalizedMixin:
         if mlist.personalize != Personalization.full:
             return
         recipient = msgdata['recipient']
-        user_manager = getUtility(IUserManager)
-        user = user_manager.get_user(recipient)
+        # Use the member's user if the delivery agent has already looked it
+        # up, otherwise go to the database.
+        member = msgdata.get('member')
+        if member is None:
+            user = getUtility(IUserManager).get_user(recipient)
+        else:
+            user = member.user
         if user is None:
             msg.replace_header('To', recipient)
         else:
@@ -0,0 +1,177 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test concurrent bulk delivery."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestBulkRendering',
+    'TestConcurrentBulkDelivery',
+    ]
+
+
+import threading
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.email.message import LazyMessage
+from mailman.mta.bulk import BulkDelivery
+from mailman.testing.helpers import (
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+class BulkTester(BulkDelivery):
+    """Capture the chunks instead of delivering them to the MTA."""
+
+    def __init__(self, *args, **kws):
+        super(BulkTester, self).__init__(*args, **kws)
+        self.chunks = []
+        self.threads = set()
+
+    def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
+        self.chunks.append(recipients)
+        self.threads.add(threading.current_thread())
+        # Refuse every address starting with 'x'.
+        return dict((recipient, (550, 'Refused'))
+                    for recipient in recipients
+                    if recipient.startswith('x'))
+
+
+
+class RenderingTester(BulkDelivery):
+    """Capture the text delivered for each chunk."""
+
+    def __init__(self, *args, **kws):
+        super(RenderingTester, self).__init__(*args, **kws)
+        self.texts = []
+
+    def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
+        self.texts.append(self._flatten(msg))
+        return {}
+
+
+
+class Crasher(BulkDelivery):
+    def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
+        raise RuntimeError('oops')
+
+
+
+class TestConcurrentBulkDelivery(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+
+""")
+        self._recipients = set(
+            '{0}{1:02d}@example.com'.format(prefix, i)
+            for prefix in 'ax'
+            for i in range(20))
+
+    def test_refused_merged(self):
+        # Concurrent delivery refuses exactly what serial delivery does.
+        serial = BulkTester(4)
+        concurrent = BulkTester(4, 4)
+        msgdata = dict(recipients=self._recipients)
+        serial_refused = serial.deliver(self._mlist, self._msg, msgdata)
+        concurrent_refused = concurrent.deliver(
+            self._mlist, self._msg, msgdata)
+        self.assertEqual(len(serial_refused), 20)
+        self.assertEqual(serial_refused, concurrent_refused)
+        self.assertEqual(len(concurrent.chunks), 10)
+        delivered = set()
+        for chunk in concurrent.chunks:
+            delivered |= chunk
+        self.assertEqual(delivered, self._recipients)
+        # The chunks were delivered from the worker threads.
+        self.assertNotIn(threading.current_thread(), concurrent.threads)
+        self.assertLessEqual(len(concurrent.threads), 4)
+
+    def test_single_chunk_is_serial(self):
+        # With only one chunk, there's no point in starting any threads.
+        bulk = BulkTester(0, 4)
+        bulk.deliver(self._mlist, self._msg,
+                     dict(recipients=self._recipients))
+        self.assertEqual(bulk.threads, set([threading.current_thread()]))
+
+    def test_worker_exception_propagates(self):
+        bulk = Crasher(4, 4)
+        self.assertRaises(RuntimeError, bulk.deliver,
+                          self._mlist, self._msg,
+                          dict(recipients=self._recipients))
+
+
+
+class TestBulkRendering(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._recipients = set(
+            'anne{0:02d}@example.com'.format(i) for i in range(20))
+
+    def test_flattened_once(self):
+        # Every chunk gets the very same text.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: test
+Content-Type: multipart/mixed
+
+--BOUNDARY
+Content-Type: text/plain
+
+Hello
+--BOUNDARY--
+""")
+        bulk = RenderingTester(4)
+        bulk.deliver(self._mlist, msg, dict(recipients=self._recipients))
+        self.assertEqual(len(bulk.texts), 5)
+        for text in bulk.texts:
+            self.assertIs(text, bulk.texts[0])
+
+    def test_rendered_body_not_parsed(self):
+        # A message whose body has been rendered ahead of time, e.g. a
+        # digest, is delivered without parsing its body.
+        body = b'Hello\n\nThis is the digest.\n'
+        msg = LazyMessage.from_string(b"""\
+From: test-request@example.com
+Subject: Test Digest, Vol 1, Issue 1
+
+""" + body)
+        msg['X-Mailman-Version'] = '3.0'
+        bulk = RenderingTester(4)
+        bulk.deliver(self._mlist, msg, dict(recipients=self._recipients))
+        self.assertEqual(msg.get_unparsed_body(), body)
+        self.assertMultiLineEqual(bulk.texts[0], """\
+From: test-request@example.com
+Subject: Test Digest, Vol 1, Issue 1
+X-Mailman-Version: 3.0
+
+Hello
+
+This is the digest.
+""")
@@ -0,0 +1,191 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test MTA connections and connection pooling."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestConnectionPool',
+    'TestPipelining',
+    ]
+
+
+import time
+import smtplib
+import unittest
+
+from mailman.config import config
+from mailman.mta.base import BaseDelivery
+from mailman.mta.connection import Connection, ConnectionPool, get_pool
+from mailman.testing.helpers import configuration
+from mailman.testing.layers import SMTPLayer
+
+
+
+MESSAGE = b"""\
+From: anne@example.com
+To: bart@example.com
+Subject: aardvarks
+
+"""
+
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Test the SMTP connection pool."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._smtpd = SMTPLayer.smtpd
+        self._pool = ConnectionPool(
+            config.mta.smtp_host, int(config.mta.smtp_port), 0)
+
+    def tearDown(self):
+        self._pool.quit()
+
+    def test_connection_reused(self):
+        # Several deliveries through the pool share a single connection.
+        for i in range(3):
+            self._pool.sendmail(
+                'anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertEqual(self._smtpd.get_connection_count(), 1)
+        self.assertEqual(len(list(self._smtpd.messages)), 3)
+
+    def test_pool_size(self):
+        # Connections returned to a full pool get closed.
+        first = self._pool.acquire()
+        second = self._pool.acquire()
+        self.assertIsNot(first, second)
+        self._pool.release(first)
+        self._pool.release(second)
+        self.assertIs(self._pool.acquire(), first)
+        self.assertIsNot(self._pool.acquire(), second)
+
+    def test_idle_timeout(self):
+        # Idle connections which have timed out are not reused.
+        pool = ConnectionPool(
+            config.mta.smtp_host, int(config.mta.smtp_port), 0,
+            idle_timeout=0.1)
+        pool.sendmail('anne@example.com', ['bart@example.com'], MESSAGE)
+        time.sleep(0.2)
+        pool.sendmail('anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertEqual(self._smtpd.get_connection_count(), 2)
+        pool.quit()
+
+    def test_dead_connection_discarded(self):
+        # A pooled connection which the server has closed fails the health
+        # check and is replaced by a fresh connection.
+        connection = self._pool.acquire()
+        connection.sendmail('anne@example.com', ['bart@example.com'], MESSAGE)
+        connection._connection.sock.close()
+        self._pool.release(connection)
+        self.assertIsNot(self._pool.acquire(), connection)
+
+    def test_is_alive(self):
+        connection = Connection(
+            config.mta.smtp_host, int(config.mta.smtp_port), 0)
+        # An unopened connection is always usable.
+        self.assertTrue(connection.is_alive())
+        connection.sendmail('anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertTrue(connection.is_alive())
+        connection.quit()
+
+    def test_pools_are_shared(self):
+        # There is one process-wide pool per server and set of credentials.
+        pool_1 = get_pool('localhost', 9025, 0)
+        pool_2 = get_pool('localhost', 9025, 0)
+        pool_3 = get_pool('localhost', 9025, 0, 'anne', 'secret')
+        self.assertIs(pool_1, pool_2)
+        self.assertIsNot(pool_1, pool_3)
+
+    @configuration('mta', connection_pool_size=2)
+    def test_delivery_uses_pool(self):
+        # When pooling is enabled, separate deliveries share the connection.
+        for i in range(3):
+            BaseDelivery()._connection.sendmail(
+                'anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertEqual(self._smtpd.get_connection_count(), 1)
+
+    def test_delivery_without_pool(self):
+        # By default, each delivery opens its own connection.
+        for i in range(3):
+            delivery = BaseDelivery()
+            delivery._connection.sendmail(
+                'anne@example.com', ['bart@example.com'], MESSAGE)
+            delivery._connection.quit()
+        self.assertEqual(self._smtpd.get_connection_count(), 3)
+
+
+
+class TestPipelining(unittest.TestCase):
+    """Test ESMTP PIPELINING."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._smtpd = SMTPLayer.smtpd
+        self._smtpd.server.extensions.add(b'PIPELINING')
+        self._connection = Connection(
+            config.mta.smtp_host, int(config.mta.smtp_port), 0)
+
+    def tearDown(self):
+        self._connection.quit()
+
+    def test_pipelined_delivery(self):
+        refused = self._connection.sendmail(
+            'anne@example.com',
+            ['bart@example.com', 'cate@example.com'], MESSAGE)
+        self.assertTrue(self._connection._connection.has_extn('pipelining'))
+        self.assertEqual(refused, {})
+        messages = list(self._smtpd.messages)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['x-rcptto'],
+                         'bart@example.com, cate@example.com')
+        self.assertEqual(messages[0]['subject'], 'aardvarks')
+
+    def test_pipelined_some_recipients_refused(self):
+        self._smtpd.err_queue.put(('rcpt', 550))
+        refused = self._connection.sendmail(
+            'anne@example.com',
+            ['bart@example.com', 'cate@example.com'], MESSAGE)
+        self.assertEqual(refused, {
+            'bart@example.com': (550, 'Error: SMTPRecipientsRefused'),
+            })
+        messages = list(self._smtpd.messages)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['x-rcptto'], 'cate@example.com')
+
+    def test_pipelined_all_recipients_refused(self):
+        self._smtpd.err_queue.put(('rcpt', 550))
+        with self.assertRaises(smtplib.SMTPRecipientsRefused) as cm:
+            self._connection.sendmail(
+                'anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertEqual(cm.exception.recipients, {
+            'bart@example.com': (550, 'Error: SMTPRecipientsRefused'),
+            })
+        self.assertEqual(len(list(self._smtpd.messages)), 0)
+
+    def test_pipelined_sender_refused(self):
+        self._smtpd.err_queue.put(('mail', 553))
+        with self.assertRaises(smtplib.SMTPSenderRefused) as cm:
+            self._connection.sendmail(
+                'anne@example.com', ['bart@example.com'], MESSAGE)
+        self.assertEqual(cm.exception.smtp_code, 553)
+        self.assertEqual(len(list(self._smtpd.messages)), 0)
@@ -22,22 +22,28 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestIndividualDelivery',
+    'TestIndividualRendering',
     ]
 
 
 import os
+import re
 import shutil
 import tempfile
 import unittest
 
+from email import message_from_string
+from mock import patch
+
 from mailman.app.lifecycle import create_list
 from mailman.app.membership import add_member
 from mailman.config import config
+from mailman.email.message import LazyMessage, Message
 from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.member import DeliveryMode
-from mailman.mta.deliver import Deliver
+from mailman.mta.deliver import Deliver, deliver
 from mailman.testing.helpers import (
-    specialized_message_from_string as mfs)
+    recorded_statements, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 
 
@@ -56,6 +62,31 @@ class DeliverTester(Deliver):
         return []
 
 
+
+class CountingMessage(Message):
+    """Count how often the payload is looked at."""
+
+    payload_calls = 0
+
+    def get_payload(self, *args, **kws):
+        self.payload_calls += 1
+        return Message.get_payload(self, *args, **kws)
+
+
+
+class RecordingConnection:
+    """Record the flattened messages instead of sending them."""
+
+    def __init__(self):
+        self.senders = []
+        self.texts = []
+
+    def sendmail(self, envsender, recipients, msgtext):
+        self.senders.append(envsender)
+        self.texts.append(msgtext)
+        return {}
+
+
 
 class TestIndividualDelivery(unittest.TestCase):
     """Test personalized delivery details."""
@@ -116,6 +147,27 @@ options  : $user_optionsurl
         member = _msgdata.get('member')
         self.assertEqual(member, self._anne)
 
+    def test_member_lookups_are_batched(self):
+        # The recipients' members, and everything needed to personalize and
+        # decorate their copies, are looked up in a fixed number of queries.
+        recipients = ['anne@example.org']
+        for i in range(10):
+            address = 'person{0}@example.org'.format(i)
+            add_member(self._mlist, address, 'Person {0}'.format(i),
+                       'xyz', DeliveryMode.regular, 'en')
+            recipients.append(address)
+        self._mlist.personalize = Personalization.full
+        agent = DeliverTester()
+        with recorded_statements() as statements:
+            agent.deliver(self._mlist, self._msg,
+                          dict(recipients=recipients))
+        self.assertEqual(len(_deliveries), 11)
+        lookups = [statement for statement in statements
+                   if statement.startswith('SELECT')
+                   and re.search(r'FROM (member|address|user|preferences)\b',
+                                 statement)]
+        self.assertEqual(len(lookups), 1)
+
     def test_decoration(self):
         msgdata = dict(recipients=['anne@example.org'])
         agent = DeliverTester()
@@ -139,3 +191,257 @@ name     : Anne Person
 options  : http://example.com/anne@example.org
 
 """)
+
+
+
+class TestIndividualRendering(unittest.TestCase):
+    """Test the rendering of individualized messages."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.personalize = Personalization.full
+        add_member(self._mlist, 'anne@example.org', 'Anne Person',
+                   'xyz', DeliveryMode.regular, 'en')
+        add_member(self._mlist, 'bart@example.org', 'Bart Person',
+                   'xyz', DeliveryMode.regular, 'en')
+        self._agent = Deliver()
+        self._connection = self._agent._connection = RecordingConnection()
+        self._msgdata = dict(recipients=['anne@example.org',
+                                         'bart@example.org'])
+
+    def _record_rendering(self):
+        # Record the full rendering of each recipient's message, as it is
+        # about to be delivered.
+        rendered = []
+        def record(mlist, msg, msgdata):
+            rendered.append(msg.as_string())
+        self._agent.callbacks.append(record)
+        return rendered
+
+    def test_personalized_headers(self):
+        # Each recipient's headers are personalized, but the body is shared.
+        self._mlist.footer_uri = None
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+
+A message body.
+""")
+        original = msg.as_string()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(msg.as_string(), original)
+        self.assertEqual(len(self._connection.texts), 2)
+        for text in self._connection.texts:
+            self.assertTrue(text.endswith('\n\nA message body.\n'))
+        self.assertIn('To: Anne Person <anne@example.org>',
+                      self._connection.texts[0])
+        self.assertIn('To: Bart Person <bart@example.org>',
+                      self._connection.texts[1])
+
+    def test_spliced_text_matches_full_rendering(self):
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="AAA"
+
+--AAA
+Content-Type: text/plain
+
+One.
+--AAA
+Content-Type: text/plain
+
+Two.
+--AAA--
+""")
+        rendered = self._record_rendering()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(self._connection.texts, rendered)
+        for text in self._connection.texts:
+            self.assertIn('Test mailing list', text)
+
+    def test_wrapped_text_matches_full_rendering(self):
+        # A message which is wrapped to add the footer shares its body with
+        # the wrapped part.
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: multipart/alternative; boundary="AAA"
+
+--AAA
+Content-Type: text/plain
+
+One.
+--AAA
+Content-Type: text/html
+
+<p>One.</p>
+--AAA--
+""")
+        rendered = self._record_rendering()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(self._connection.texts, rendered)
+        for text in self._connection.texts:
+            self.assertIn('<p>One.</p>', text)
+            self.assertIn('Test mailing list', text)
+
+    def test_decorated_text_matches_full_rendering(self):
+        # The footer of a plain text message is spliced onto the shared text.
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+
+A message body.
+From here on, the body is mangled.
+""")
+        original = msg.as_string()
+        rendered = self._record_rendering()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(msg.as_string(), original)
+        self.assertEqual(self._connection.texts, rendered)
+        for text in self._connection.texts:
+            self.assertIn(
+                '\n\nA message body.\n>From here on, the body is mangled.\n'
+                '_______________________________________________\n'
+                'Test mailing list\n', text)
+
+    def test_decorated_text_matches_decorate_handler(self):
+        # The spliced text is just what the decorate handler makes of the
+        # message.
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+
+A message body.\
+""")
+        expected = []
+        for recipient in self._msgdata['recipients']:
+            msg_copy = mfs(msg.as_string())
+            msgdata = dict(recipient=recipient,
+                           member=self._mlist.members.get_member(recipient))
+            config.handlers['decorate'].process(
+                self._mlist, msg_copy, msgdata)
+            self.assertEqual(msg_copy['content-transfer-encoding'], '7bit')
+            expected.append(msg_copy.as_string())
+        self._agent.callbacks = [self._agent.decorate]
+        # Only stand-ins for the text are decorated.
+        decorator = config.handlers['decorate']
+        decorate = decorator.process
+        decorated = []
+        def process(mlist, msg, msgdata):
+            decorated.append(msg.get_payload())
+            decorate(mlist, msg, msgdata)
+        with patch.object(decorator, 'process', process):
+            self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(self._connection.texts, expected)
+        self.assertEqual(len(decorated), 2)
+        for payload in decorated:
+            self.assertNotIn('A message body.', payload)
+
+    def test_decorated_8bit_text(self):
+        # The text of a message in another charset is decorated in full.
+        msg = message_from_string(b"""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: text/plain; charset="utf-8"
+Content-Transfer-Encoding: 8bit
+
+Caf\xc3\xa9.
+""", Message)
+        rendered = self._record_rendering()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(self._connection.texts, rendered)
+        for text in self._connection.texts:
+            self.assertIn('Content-Transfer-Encoding: base64', text)
+
+    def test_subparts_are_flattened_once(self):
+        # The footer is added to each recipient's copy as another subpart,
+        # but the original subparts are only flattened once.
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="AAA"
+
+--AAA
+Content-Type: text/plain
+
+One.
+--AAA--
+""")
+        part = msg.get_payload(0)
+        part.__class__ = CountingMessage
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(part.payload_calls, 1)
+        self.assertEqual(len(self._connection.texts), 2)
+        for text in self._connection.texts:
+            self.assertIn('\n\nOne.\n--AAA\n', text)
+            self.assertIn('Test mailing list', text)
+
+    def test_decoration_leaves_original_alone(self):
+        # Adding a footer part to a multipart/mixed message doesn't change
+        # the original message's parts.
+        msg = mfs("""\
+From: cris@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="AAA"
+
+--AAA
+Content-Type: text/plain
+
+One.
+--AAA--
+""")
+        original = msg.as_string()
+        self._agent.deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(msg.as_string(), original)
+        self.assertEqual(len(msg.get_payload()), 1)
+        for text in self._connection.texts:
+            self.assertIn('One.', text)
+            self.assertIn('Content-Disposition: inline', text)
+
+    def test_verp_digest(self):
+        # A digest to a mailing list which VERPs its deliveries is sent to
+        # each recipient with its own envelope sender, and its body is sent
+        # exactly as it was rendered, without being parsed.
+        body = """\
+--AAA
+Content-Type: text/plain
+
+The digest.
+--AAA--
+"""
+        text = """\
+From: test-request@example.com
+To: test@example.com
+Subject: Test Digest, Vol 1, Issue 1
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="AAA"
+
+""" + body
+        msg = LazyMessage.from_string(text)
+        self._msgdata.update(verp=True, isdigest=True, original_size=len(text))
+        with patch('mailman.mta.base.BaseDelivery._make_connection',
+                   return_value=self._connection):
+            deliver(self._mlist, msg, self._msgdata)
+        self.assertEqual(self._connection.senders, [
+            'test-bounces+anne=example.org@example.com',
+            'test-bounces+bart=example.org@example.com',
+            ])
+        for text in self._connection.texts:
+            self.assertTrue(text.endswith('\n\n' + body))
+        self.assertEqual(msg.get_unparsed_body(), body)
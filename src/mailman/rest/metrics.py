@@ -0,0 +1,68 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Queue and runner metrics."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Metrics',
+    'ProcessingMetrics',
+    'PrometheusMetrics',
+    ]
+
+
+from mailman.core.metrics import (
+    collect, processing_metrics, prometheus_text)
+from mailman.rest.helpers import etag, okay, path_to
+
+
+# The content type of the Prometheus text exposition format.
+PROMETHEUS_CONTENT_TYPE = b'text/plain; version=0.0.4'
+
+
+
+class Metrics:
+    """The queue and runner metrics."""
+
+    def on_get(self, request, response):
+        """/<api>/system/metrics"""
+        resource = collect()
+        resource['self_link'] = path_to('system/metrics')
+        okay(response, etag(resource))
+
+
+class PrometheusMetrics:
+    """The queue and runner metrics, for Prometheus to scrape."""
+
+    def on_get(self, request, response):
+        """/<api>/system/metrics/prometheus"""
+        response.content_type = PROMETHEUS_CONTENT_TYPE
+        okay(response, prometheus_text(collect()).encode('utf-8'))
+
+
+class ProcessingMetrics:
+    """The timings of the handlers, rules and chain links, per list."""
+
+    def on_get(self, request, response):
+        """/<api>/system/metrics/processing"""
+        resource = dict(
+            lists=processing_metrics(),
+            self_link=path_to('system/metrics/processing'),
+            )
+        okay(response, etag(resource))
@@ -40,6 +40,8 @@ from mailman.rest.helpers import (
     BadRequest, NotFound, child, etag, okay, path_to)
 from mailman.rest.lists import AList, AllLists, Styles
 from mailman.rest.members import AMember, AllMembers, FindMembers
+from mailman.rest.metrics import (
+    Metrics, ProcessingMetrics, PrometheusMetrics)
 from mailman.rest.preferences import ReadOnlyPreferences
 from mailman.rest.templates import TemplateFinder
 from mailman.rest.users import AUser, AllUsers
@@ -96,9 +98,19 @@ class TopLevel:
 
     @child()
     def system(self, request, segments):
-        """/<api>/system"""
+        """/<api>/system
+           /<api>/system/metrics
+           /<api>/system/metrics/prometheus
+           /<api>/system/metrics/processing
+        """
         if len(segments) == 0:
             return System()
+        elif segments == ['metrics']:
+            return Metrics(), []
+        elif segments == ['metrics', 'prometheus']:
+            return PrometheusMetrics(), []
+        elif segments == ['metrics', 'processing']:
+            return ProcessingMetrics(), []
         elif len(segments) > 1:
             return BadRequest(), []
         elif segments[0] == 'preferences':
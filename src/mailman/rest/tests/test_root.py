@@ -94,6 +94,37 @@ class TestRoot(unittest.TestCase):
         queue_directory = os.path.join(config.QUEUE_DIR, 'rest')
         self.assertFalse(os.path.isdir(queue_directory))
 
+    def test_system_metrics(self):
+        # The queue and runner metrics are available.
+        url = 'http://localhost:9001/3.0/system/metrics'
+        json, response = call_api(url)
+        self.assertEqual(json['queues']['virgin'],
+                         dict(depth=0, oldest_age=0.0))
+        self.assertIn('runners', json)
+        self.assertEqual(json['self_link'], url)
+
+    def test_system_metrics_prometheus(self):
+        # The metrics are also available in the Prometheus text format.
+        url = 'http://localhost:9001/3.0/system/metrics/prometheus'
+        basic_auth = '{0}:{1}'.format(
+            config.webservice.admin_user, config.webservice.admin_pass)
+        headers = {
+            'Authorization': 'Basic ' + b64encode(basic_auth),
+            }
+        response, content = Http().request(url, 'GET', None, headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response['content-type'],
+                         'text/plain; version=0.0.4')
+        self.assertIn('mailman_queue_depth{queue="virgin"} 0',
+                      content.splitlines())
+
+    def test_system_metrics_processing(self):
+        # The processing timings are available, but none have been collected.
+        url = 'http://localhost:9001/3.0/system/metrics/processing'
+        json, response = call_api(url)
+        self.assertEqual(json['lists'], {})
+        self.assertEqual(json['self_link'], url)
+
     def test_no_basic_auth(self):
         # If Basic Auth credentials are missing, it is a 401 error.
         url = 'http://localhost:9001/3.0/system'
@@ -34,6 +34,24 @@ from mailman.interfaces.mailinglist import IAcceptableAliasSet
 from mailman.interfaces.rules import IRule
 
 
+# The most sets of acceptable aliases whose compiled patterns are kept.
+MAX_CACHED_ALIASES = 1000
+
+
+
+def _compile(pattern):
+    # Alias patterns are matched case-insensitively.  A malformed regular
+    # expression is matched literally instead, and if even that fails, the
+    # pattern never matches.
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        try:
+            return re.compile(re.escape(pattern), re.IGNORECASE)
+        except re.error:
+            return None
+
+
 
 @implementer(IRule)
 class ImplicitDestination:
@@ -43,6 +61,33 @@ class ImplicitDestination:
     description = _('Catch messages with implicit destination.')
     record = True
 
+    def __init__(self):
+        # Map each mailing list's acceptable aliases to the set of explicit
+        # addresses and the compiled alias patterns.
+        self._compiled = {}
+
+    def _get_aliases(self, mlist):
+        # Calculate the list of acceptable aliases.  If the alias starts with
+        # a caret (i.e. ^), then it's a regular expression to match against.
+        # Adapt the mailing list to the appropriate interface.
+        key = tuple(sorted(IAcceptableAliasSet(mlist).aliases))
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            aliases = set()
+            alias_patterns = []
+            for alias in key:
+                if alias.startswith('^'):
+                    regex = _compile(alias)
+                    if regex is not None:
+                        alias_patterns.append(regex)
+                else:
+                    aliases.add(alias)
+            if len(self._compiled) >= MAX_CACHED_ALIASES:
+                self._compiled.clear()
+            compiled = self._compiled[key] = (
+                frozenset(aliases), tuple(alias_patterns))
+        return compiled
+
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
         # Implicit destination checking must be enabled in the mailing list.
@@ -52,20 +97,10 @@ class ImplicitDestination:
         # are never checked.
         if msgdata.get('fromusenet'):
             return False
-        # Calculate the list of acceptable aliases.  If the alias starts with
-        # a caret (i.e. ^), then it's a regular expression to match against.
-        aliases = set()
-        alias_patterns = set()
-        # Adapt the mailing list to the appropriate interface.
-        alias_set = IAcceptableAliasSet(mlist)
-        for alias in alias_set.aliases:
-            if alias.startswith('^'):
-                alias_patterns.add(alias)
-            else:
-                aliases.add(alias)
-        # Add the list's posting address, i.e. the explicit address, to the
-        # set of acceptable aliases.
-        aliases.add(mlist.posting_address)
+        aliases, alias_patterns = self._get_aliases(mlist)
+        # The list's posting address, i.e. the explicit address, is also an
+        # acceptable alias.
+        posting_address = mlist.posting_address
         # Look at all the recipients.  If the recipient is any acceptable
         # alias (or the explicit posting address), then this rule does not
         # match.  If not, then add it to the set of recipients we'll check
@@ -74,24 +109,14 @@ class ImplicitDestination:
         for header in ('to', 'cc', 'resent-to', 'resent-cc'):
             for fullname, address in getaddresses(msg.get_all(header, [])):
                 address = address.lower()
-                if address in aliases:
+                if address in aliases or address == posting_address:
                     return False
                 recipients.add(address)
         # Now for all alias patterns, see if any of the recipients matches a
         # pattern.  If so, then this rule does not match.
-        for pattern in alias_patterns:
-            escaped = re.escape(pattern)
+        for regex in alias_patterns:
             for recipient in recipients:
-                try:
-                    if re.match(pattern, recipient, re.IGNORECASE):
-                        return False
-                except re.error:
-                    # The pattern is a malformed regular expression.  Try
-                    # matching again with the pattern escaped.
-                    try:
-                        if re.match(escaped, recipient, re.IGNORECASE):
-                            return False
-                    except re.error:
-                        pass
+                if regex.match(recipient):
+                    return False
         # Nothing matched.
         return True
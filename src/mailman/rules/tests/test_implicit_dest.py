@@ -0,0 +1,72 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the `implicit-dest` rule."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestImplicitDestination',
+    ]
+
+
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.interfaces.mailinglist import IAcceptableAliasSet
+from mailman.rules import implicit_dest
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestImplicitDestination(unittest.TestCase):
+    """Test the implicit destination rule."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._rule = implicit_dest.ImplicitDestination()
+        self._msg = mfs("""\
+From: anne@example.com
+To: myfriend@example.com
+Message-ID: <ant>
+
+""")
+
+    def test_aliases_change(self):
+        # The compiled aliases are reused, but changes to the acceptable
+        # aliases are still noticed.
+        alias_set = IAcceptableAliasSet(self._mlist)
+        self.assertTrue(self._rule.check(self._mlist, self._msg, {}))
+        alias_set.add('^my.*@example.com')
+        self.assertFalse(self._rule.check(self._mlist, self._msg, {}))
+        self.assertFalse(self._rule.check(self._mlist, self._msg, {}))
+        alias_set.clear()
+        self.assertTrue(self._rule.check(self._mlist, self._msg, {}))
+        alias_set.add('myfriend@example.com')
+        self.assertFalse(self._rule.check(self._mlist, self._msg, {}))
+
+    def test_malformed_pattern(self):
+        # A malformed regular expression is matched literally.
+        IAcceptableAliasSet(self._mlist).add('^myfriend**@example.com')
+        self.assertTrue(self._rule.check(self._mlist, self._msg, {}))
+        del self._msg['to']
+        self._msg['To'] = '^myfriend**@example.com'
+        self.assertFalse(self._rule.check(self._mlist, self._msg, {}))
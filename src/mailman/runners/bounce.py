@@ -17,12 +17,15 @@
 
 """Bounce runner."""
 
+import time
 import logging
 
-from flufl.bounce import all_failures, scan_message
+from lazr.config import as_boolean, as_timedelta
 from zope.component import getUtility
 
-from mailman.app.bounces import ProbeVERP, StandardVERP, maybe_forward
+from mailman.app.bounces import (
+    BounceScanner, ProbeVERP, StandardVERP, maybe_forward)
+from mailman.config import config
 from mailman.core.runner import Runner
 from mailman.interfaces.bounce import BounceContext, IBounceProcessor
 
@@ -33,33 +36,44 @@ log = logging.getLogger('mailman.bounce')
 elog = logging.getLogger('mailman.error')
 
 
-
+
 class BounceRunner(Runner):
     """The bounce runner."""
 
     def __init__(self, name, slice=None):
         super(BounceRunner, self).__init__(name, slice)
         self._processor = getUtility(IBounceProcessor)
+        # Compile the VERP patterns and find the bounce detectors just once.
+        self._standard_verp = StandardVERP()
+        self._probe_verp = ProbeVERP()
+        self._scanner = BounceScanner()
+        # The registered bounces are scored in periodic passes.
+        self._pass_interval = as_timedelta(
+            config.bounces.register_bounces_every).total_seconds()
+        self._next_pass = time.time()
 
     def _dispose(self, mlist, msg, msgdata):
         # List isn't doing bounce processing?
         if not mlist.process_bounces:
             return False
-        # Try VERP detection first, since it's quick and easy
+        # Try VERP detection first, since it's quick and easy.  The LMTP
+        # server records the envelope recipient, which is checked before any
+        # headers.
         context = BounceContext.normal
-        addresses = StandardVERP().get_verp(mlist, msg)
+        recipient = msgdata.get('envelope_recipient')
+        addresses = self._standard_verp.get_verp(mlist, msg, recipient)
         if len(addresses) > 0:
             # Scan the message to see if it contained permanent or temporary
             # failures.  We'll ignore temporary failures, but even if there
             # are no permanent failures, we'll assume VERP bounces are
             # permanent.
-            temporary, permanent = all_failures(msg)
+            temporary, permanent = self._scanner.scan(msg)
             if len(temporary) > 0:
                 # This was a temporary failure, so just ignore it.
                 return False
         else:
             # See if this was a probe message.
-            addresses = ProbeVERP().get_verp(mlist, msg)
+            addresses = self._probe_verp.get_verp(mlist, msg, recipient)
             if len(addresses) > 0:
                 context = BounceContext.probe
             else:
@@ -67,13 +81,14 @@ class BounceRunner(Runner):
                 # bounce matching modules.  This returns only the permanently
                 # failing addresses.  Since Mailman currently doesn't score
                 # temporary failures, if we get no permanent failures, we're
-                # done.s
-                addresses = scan_message(msg)
+                # done.
+                temporary, addresses = self._scanner.scan(msg)
         # If that still didn't return us any useful addresses, then send it on
         # or discard it.  The addresses will come back from flufl.bounce as
         # bytes/8-bit strings, but we must store them as unicodes in the
         # database.  Assume utf-8 encoding, but be cautious.
         if len(addresses) > 0:
+            emails = []
             for address in addresses:
                 if isinstance(address, bytes):
                     try:
@@ -82,10 +97,30 @@ class BounceRunner(Runner):
                         log.exception('Ignoring non-UTF-8 encoded '
                                       'address: {0}'.format(address))
                         continue
-                self._processor.register(mlist, address, msg, context)
+                emails.append(address)
+            # Register all the bouncing addresses at once.
+            self._processor.register_many(mlist, emails, msg, context)
         else:
             log.info('Bounce message w/no discernable addresses: %s',
                      msg.get('message-id', 'n/a'))
             maybe_forward(mlist, msg)
         # Dequeue this message.
         return False
+
+    def _do_periodic(self):
+        """Score the registered bounces, and act on the scores."""
+        if time.time() < self._next_pass:
+            return
+        self._next_pass = time.time() + self._pass_interval
+        # Commit the work for any queue files processed so far, so that a
+        # failure here can't roll it back.  In batch mode, this ends the
+        # current batch, so its queue files are finished too.
+        self._commit_batch()
+        try:
+            self._processor.process_events()
+            if as_boolean(config.bounces.remove_disabled_members):
+                self._processor.remove_disabled_members()
+            config.db.commit()
+        except Exception as error:
+            self._log(error)
+            config.db.abort()
@@ -25,25 +25,33 @@ __all__ = [
     ]
 
 
+import os
 import re
+import sys
+import random
+import shutil
 import logging
+import cStringIO
 
 # cStringIO doesn't support unicode.
 from StringIO import StringIO
-from copy import deepcopy
+from email.generator import Generator
 from email.header import Header
 from email.message import Message
 from email.mime.message import MIMEMessage
-from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate, getaddresses, make_msgid
+from tempfile import SpooledTemporaryFile
 from urllib2 import URLError
 
 from mailman.config import config
 from mailman.core.i18n import _
+from mailman.core.pipelines import process
 from mailman.core.runner import Runner
+from mailman.email.message import LazyMessage
 from mailman.handlers.decorate import decorate
-from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.interfaces.member import DeliveryMode
+from mailman.utilities.digeststore import DigestStore, index_headers
 from mailman.utilities.i18n import make
 from mailman.utilities.mailbox import Mailbox
 from mailman.utilities.string import oneline, wrap
@@ -52,6 +60,121 @@ from mailman.utilities.string import oneline, wrap
 log = logging.getLogger('mailman.error')
 
 
+
+def _make_boundary():
+    # Make a MIME boundary the way the email package does.  The email package
+    # also checks that the boundary doesn't occur in the text of the message,
+    # but the digest is never all in memory to check.  The boundary is random
+    # enough for that not to matter.
+    width = len(repr(sys.maxint - 1))
+    token = random.randrange(sys.maxint)
+    return '{0}{1:0{2}d}=='.format('=' * 15, token, width)
+
+
+def _flatten(msg, fp):
+    # Write the message text to the file.
+    Generator(fp, mangle_from_=False).flatten(msg)
+
+
+def _spool(mlist):
+    # Digests are spooled in the mailing list's data directory, next to the
+    # digest mailbox, rather than in a temporary directory which might itself
+    # be in memory.
+    return SpooledTemporaryFile(
+        max_size=int(config.digests.spool_size), dir=mlist.data_path)
+
+
+def _join(mlist, head, fp, tail):
+    # Return the head, the text spooled to the file and the tail, and close
+    # the file.  They are put together in another spool first, so that the
+    # whole text only needs to be read into memory once.
+    joined = _spool(mlist)
+    try:
+        joined.write(head)
+        fp.seek(0)
+        shutil.copyfileobj(fp, joined)
+        joined.write(tail)
+        joined.seek(0)
+        return joined.read()
+    finally:
+        joined.close()
+        fp.close()
+
+
+
+class TextSpool:
+    """Text spooled to a temporary file.
+
+    The text is encoded in the mailing list's character set for as long as
+    that is possible, and in UTF-8 as soon as some of it can't be encoded in
+    the mailing list's character set.
+    """
+
+    def __init__(self, mlist, charset):
+        self._mlist = mlist
+        self._file = _spool(mlist)
+        self.charset = charset
+
+    def ensure_encodable(self, text):
+        """Make sure that the spool's character set can encode some text.
+
+        If it can't, the spool switches to UTF-8.
+
+        :param text: The text.
+        :type text: unicode
+        """
+        if self.charset == 'utf-8':
+            return
+        try:
+            text.encode(self.charset)
+        except UnicodeError:
+            pass
+        else:
+            return
+        # Re-encode the text which has already been spooled.
+        self._file.seek(0)
+        transcoded = _spool(self._mlist)
+        for line in self._file:
+            transcoded.write(line.decode(self.charset).encode('utf-8'))
+        self._file.close()
+        self._file = transcoded
+        self.charset = 'utf-8'
+
+    def encode(self, text):
+        """Encode some text in the spool's character set.
+
+        :param text: The text.
+        :type text: unicode
+        :return: The encoded text.
+        :rtype: bytes
+        """
+        self.ensure_encodable(text)
+        return text.encode(self.charset)
+
+    def write(self, text):
+        """Spool some text."""
+        # Encoding the text can replace the file.
+        data = self.encode(text)
+        self._file.write(data)
+
+    def join(self, head, tail):
+        """Return all the spooled text between a head and a tail.
+
+        All of the text is encoded, and the spool is closed.
+
+        :param head: The text to put before the spooled text.
+        :type head: unicode
+        :param tail: The text to put after the spooled text.
+        :type tail: unicode
+        :return: The encoded text.
+        :rtype: bytes
+        """
+        self.ensure_encodable(head)
+        self.ensure_encodable(tail)
+        return _join(self._mlist, head.encode(self.charset), self._file,
+                     tail.encode(self.charset))
+
+
 
 class Digester:
     """Base digester class."""
@@ -97,10 +220,18 @@ class Digester:
         self._toc = StringIO()
         print(_("Today's Topics:\n"), file=self._toc)
 
-    def add_to_toc(self, msg, count):
-        """Add a message to the table of contents."""
-        subject = msg.get('subject', _('(no subject)'))
-        subject = oneline(subject, in_unicode=True)
+    def add_to_toc(self, subject, sender, count):
+        """Add a message to the table of contents.
+
+        :param subject: The decoded Subject: header of the message, or None.
+        :type subject: unicode
+        :param sender: The decoded From: header of the message, or None.
+        :type sender: unicode
+        :param count: The number of the message in the digest.
+        :type count: int
+        """
+        if subject is None:
+            subject = _('(no subject)')
         # Don't include the redundant subject prefix in the toc
         mo = re.match('(re:? *)?({0})'.format(
             re.escape(self._mlist.subject_prefix)),
@@ -109,8 +240,7 @@ class Digester:
             subject = subject[:mo.start(2)] + subject[mo.end(2):]
         # Take only the first author we find.
         username = ''
-        addresses = getaddresses(
-            [oneline(msg.get('from', ''), in_unicode=True)])
+        addresses = getaddresses([sender or ''])
         if addresses:
             username = addresses[0][0]
             if not username:
@@ -154,25 +284,45 @@ class Digester:
 
 
 class MIMEDigester(Digester):
-    """A MIME digester."""
+    """A MIME digest builder.
+
+    The parts of the MIME digest are written out as they are added.  Only
+    the parts before the table of contents are kept in memory; the messages
+    are spooled to a temporary file.
+    """
 
     def __init__(self, mlist, volume, digest_number):
         super(MIMEDigester, self).__init__(mlist, volume, digest_number)
+        self._boundary = _make_boundary()
+        self._message.set_boundary(self._boundary)
+        # The flattened parts are bytes, so use cStringIO here.
+        self._head = cStringIO.StringIO()
+        self._messages = _spool(mlist)
         masthead = MIMEText(self._masthead.encode(self._charset),
                             _charset=self._charset)
         masthead['Content-Description'] = self._subject
-        self._message.attach(masthead)
+        self._add_part(self._head, masthead)
         # Add the optional digest header.
         if mlist.digest_header_uri is not None:
             header = MIMEText(self._header.encode(self._charset),
                               _charset=self._charset)
             header['Content-Description'] = _('Digest Header')
-            self._message.attach(header)
+            self._add_part(self._head, header)
         # Calculate the set of headers we're to keep in the MIME digest.
         self._keepers = set(config.digests.mime_digest_keep_headers.split())
 
     def _make_message(self):
-        return MIMEMultipart('mixed')
+        # The parts are added to the text of the digest as they come, so the
+        # message itself only has the headers until the digest is finished.
+        message = Message()
+        message['Content-Type'] = 'multipart/mixed'
+        message['MIME-Version'] = '1.0'
+        return message
+
+    def _add_part(self, fp, part):
+        print('--' + self._boundary, file=fp)
+        _flatten(part, fp)
+        print(file=fp)
 
     def add_toc(self, count):
         """Add the table of contents."""
@@ -183,16 +333,17 @@ class MIMEDigester(Digester):
         except UnicodeError:
             toc_part = MIMEText(toc_text.encode('utf-8'), _charset='utf-8')
         toc_part['Content-Description']= _("Today's Topics ($count messages)")
-        self._message.attach(toc_part)
+        self._add_part(self._head, toc_part)
 
     def add_message(self, msg, count):
         """Add the message to the digest."""
-        # Make a copy of the message object, since the RFC 1153 processing
-        # scrubs out attachments.
-        self._message.attach(MIMEMessage(deepcopy(msg)))
+        # The message is written out right away, so it doesn't need to be
+        # copied even though the RFC 1153 processing looks at it afterward.
+        self._add_part(self._messages, MIMEMessage(msg))
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
+        tail = cStringIO.StringIO()
         if self._mlist.digest_footer_uri is not None:
             try:
                 footer_text = decorate(
@@ -206,25 +357,35 @@ class MIMEDigester(Digester):
             footer = MIMEText(footer_text.encode(self._charset),
                               _charset=self._charset)
             footer['Content-Description'] = _('Digest Footer')
-            self._message.attach(footer)
-        # This stuff is outside the normal MIME goo, and it's what the old
-        # MIME digester did.  No one seemed to complain, probably because you
-        # won't see it in an MUA that can't display the raw message.  We've
-        # never got complaints before, but if we do, just wax this.  It's
-        # primarily included for (marginally useful) backwards compatibility.
-        self._message.postamble = _('End of ') + self._digest_id
-        return self._message
+            self._add_part(tail, footer)
+        tail.write('--{0}--'.format(self._boundary))
+        # Flatten the headers, then put the body of the digest together.  Its
+        # body is only parsed again if something needs to look at it.
+        headers = cStringIO.StringIO()
+        self._message.set_payload('')
+        _flatten(self._message, headers)
+        body = _join(self._mlist, self._head.getvalue(), self._messages,
+                     tail.getvalue())
+        digest = LazyMessage.from_string(headers.getvalue(), body)
+        digest.original_size = len(headers.getvalue()) + len(body)
+        return digest
+
 
 
 
 class RFC1153Digester(Digester):
-    """A digester of the format specified by RFC 1153."""
+    """A digester of the format specified by RFC 1153.
+
+    Only the text before the table of contents is kept in memory; the
+    messages are spooled to a temporary file.
+    """
 
     def __init__(self, mlist, volume, digest_number):
         super(RFC1153Digester, self).__init__(mlist, volume, digest_number)
         self._separator70 = '-' * 70
         self._separator30 = '-' * 30
         self._text = StringIO()
+        self._messages = TextSpool(mlist, self._charset)
         print(self._masthead, file=self._text)
         print(file=self._text)
         # Add the optional digest header.
@@ -247,16 +408,16 @@ class RFC1153Digester(Digester):
     def add_message(self, msg, count):
         """Add the message to the digest."""
         if count > 1:
-            print(self._separator30, file=self._text)
-            print(file=self._text)
+            print(self._separator30, file=self._messages)
+            print(file=self._messages)
         # Each message section contains a few headers.
         for header in config.digests.plain_digest_keep_headers.split():
             if header in msg:
                 value = oneline(msg[header], in_unicode=True)
                 value = wrap('{0}: {1}'.format(header, value))
                 value = '\n\t'.join(value.split('\n'))
-                print(value, file=self._text)
-        print(file=self._text)
+                print(value, file=self._messages)
+        print(file=self._messages)
         # Add the payload.  If the decoded payload is empty, this may be a
         # multipart message.  In that case, just stringify it.
         payload = msg.get_payload(decode=True)
@@ -272,12 +433,13 @@ class RFC1153Digester(Digester):
         except (LookupError, TypeError):
             # Unknown or empty charset.
             payload = payload.decode('us-ascii', 'replace')
-        print(payload, file=self._text)
+        print(payload, file=self._messages)
         if not payload.endswith('\n'):
-            print(file=self._text)
+            print(file=self._messages)
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
+        tail = StringIO()
         if self._mlist.digest_footer_uri is not None:
             try:
                 footer_text = decorate(
@@ -291,27 +453,49 @@ class RFC1153Digester(Digester):
             # MAS: There is no real place for the digest_footer in an RFC 1153
             # compliant digest, so add it as an additional message with
             # Subject: Digest Footer
-            print(self._separator30, file=self._text)
-            print(file=self._text)
-            print('Subject: ' + _('Digest Footer'), file=self._text)
-            print(file=self._text)
-            print(footer_text, file=self._text)
-            print(file=self._text)
-            print(self._separator30, file=self._text)
-            print(file=self._text)
+            print(self._separator30, file=tail)
+            print(file=tail)
+            print('Subject: ' + _('Digest Footer'), file=tail)
+            print(file=tail)
+            print(footer_text, file=tail)
+            print(file=tail)
+            print(self._separator30, file=tail)
+            print(file=tail)
         # Add the sign-off.
         sign_off = _('End of ') + self._digest_id
-        print(sign_off, file=self._text)
-        print('*' * len(sign_off), file=self._text)
+        print(sign_off, file=tail)
+        print('*' * len(sign_off), file=tail)
         # If the digest message can't be encoded by the list character set,
-        # fall back to utf-8.
-        text = self._text.getvalue()
-        try:
-            self._message.set_payload(text.encode(self._charset),
-                                      charset=self._charset)
-        except UnicodeError:
-            self._message.set_payload(text.encode('utf-8'), charset='utf-8')
-        return self._message
+        # the spool falls back to utf-8, even while the text before and after
+        # the messages is joined to them.
+        text = self._messages.join(self._text.getvalue(), tail.getvalue())
+        self._message.set_payload(text, charset=self._messages.charset)
+        # Render the digest once, for all of its recipients: the encoded
+        # payload is the body as it is, so just flatten the headers.  The
+        # body is only parsed again if something needs to look at it.
+        body = self._message.get_payload()
+        self._message.set_payload('')
+        headers = cStringIO.StringIO()
+        _flatten(self._message, headers)
+        digest = LazyMessage.from_string(headers.getvalue(), body)
+        digest.original_size = len(headers.getvalue()) + len(body)
+        return digest
+
+
+
+
+def _read_digest(path):
+    # Yield the decoded Subject: and From: headers and the message, for each
+    # of the messages collected for a digest.
+    if path.endswith('.mmdf'):
+        # The messages were collected by an older version of Mailman.
+        with Mailbox(path) as mailbox:
+            for message in mailbox.itervalues():
+                subject, sender = index_headers(message)
+                yield subject, sender, message
+    else:
+        for entry, message in DigestStore(path).iteritems():
+            yield entry.subject, entry.sender, message
 
 
 
@@ -324,54 +508,44 @@ class DigestRunner(Runner):
         digest_number = msgdata['digest_number']
         # Backslashes make me cry.
         code = mlist.preferred_language.code
-        with Mailbox(msgdata['digest_path']) as mailbox, _.using(code):
+        digest_path = msgdata['digest_path']
+        with _.using(code):
             # Create the digesters.
             mime_digest = MIMEDigester(mlist, volume, digest_number)
             rfc1153_digest = RFC1153Digester(mlist, volume, digest_number)
-            # Cruise through all the messages in the mailbox, first building
-            # the table of contents and accumulating Subject: headers and
-            # authors.  The question really is whether it's better from a1
-            # performance and memory footprint to go through the mailbox once
-            # and cache the messages in a list, or to cruise through the
-            # mailbox twice.  We'll do the latter, but it's a complete guess.
+            # Cruise through all the messages in the digest once, building
+            # the table of contents from their indexed Subject: and From:
+            # headers while the digesters spool the messages themselves.  The
+            # table of contents is put in front of the messages when the
+            # digests are finished.
             count = None
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_to_toc(message, count)
-                rfc1153_digest.add_to_toc(message, count)
+            messages = enumerate(_read_digest(digest_path), 1)
+            for count, (subject, sender, message) in messages:
+                mime_digest.add_to_toc(subject, sender, count)
+                rfc1153_digest.add_to_toc(subject, sender, count)
+                mime_digest.add_message(message, count)
+                rfc1153_digest.add_message(message, count)
             assert count is not None, 'No digest messages?'
             # Add the table of contents.
             mime_digest.add_toc(count)
             rfc1153_digest.add_toc(count)
-            # Cruise through the set of messages a second time, adding them to
-            # the actual digest.
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_message(message, count)
-                rfc1153_digest.add_message(message, count)
             # Finish up the digests.
             mime = mime_digest.finish()
             rfc1153 = rfc1153_digest.finish()
-        # Calculate the recipients lists
-        mime_recipients = set()
-        rfc1153_recipients = set()
+        # Calculate the recipients lists.  The digest members are resolved by
+        # their delivery modes in a single query.
+        recipients = mlist.digest_members.recipients_by_mode()
+        mime_recipients = recipients[DeliveryMode.mime_digests]
+        rfc1153_recipients = recipients[DeliveryMode.plaintext_digests]
+        summary_recipients = recipients[DeliveryMode.summary_digests]
+        if len(summary_recipients) > 0:
+            raise AssertionError(
+                'Digest members {0} unexpected delivery mode: {1}'.format(
+                    sorted(summary_recipients),
+                    DeliveryMode.summary_digests))
         # When someone turns off digest delivery, they will get one last
         # digest to ensure that there will be no gaps in the messages they
-        # receive.
-        digest_members = set(mlist.digest_members.members)
-        for member in digest_members:
-            if member.delivery_status is not DeliveryStatus.enabled:
-                continue
-            # Send the digest to the case-preserved address of the digest
-            # members.
-            email_address = member.address.original_email
-            if member.delivery_mode == DeliveryMode.plaintext_digests:
-                rfc1153_recipients.add(email_address)
-            elif member.delivery_mode == DeliveryMode.mime_digests:
-                mime_recipients.add(email_address)
-            else:
-                raise AssertionError(
-                    'Digest member "{0}" unexpected delivery mode: {1}'.format(
-                        email_address, member.delivery_mode))
-        # Add also the folks who are receiving one last digest.
+        # receive.  Add also the folks who are receiving one last digest.
         for address, delivery_mode in mlist.last_digest_recipients:
             if delivery_mode == DeliveryMode.plaintext_digests:
                 rfc1153_recipients.add(address.original_email)
@@ -381,13 +555,21 @@ class DigestRunner(Runner):
                 raise AssertionError(
                     'OLD recipient "{0}" unexpected delivery mode: {1}'.format(
                         address, delivery_mode))
-        # Send the digests to the virgin queue for final delivery.
-        queue = config.switchboards['virgin']
-        queue.enqueue(mime,
-                      recipients=mime_recipients,
-                      listname=mlist.fqdn_listname,
-                      isdigest=True)
-        queue.enqueue(rfc1153,
-                      recipients=rfc1153_recipients,
-                      listname=mlist.fqdn_listname,
-                      isdigest=True)
+        # Send the digests through the virgin pipeline right here, instead of
+        # through the virgin queue, for final delivery.  Each digest has been
+        # rendered once for all its recipients, and nothing on its way to the
+        # outgoing mail server parses its body again.
+        for digest, digest_recipients in ((mime, mime_recipients),
+                                          (rfc1153, rfc1153_recipients)):
+            process(mlist, digest, dict(
+                recipients=digest_recipients,
+                listname=mlist.fqdn_listname,
+                isdigest=True,
+                original_size=digest.original_size,
+                _fasttrack=True,
+                ), 'virgin')
+        # The digests are on their way, so the collected messages can go.
+        if digest_path.endswith('.mmdf'):
+            os.remove(digest_path)
+        else:
+            DigestStore(digest_path).remove()
@@ -30,6 +30,12 @@ Mailman's incoming queue for normal processing.  If they don't look good, or
 are destined for a bogus sub-address, they are rejected right away, hopefully
 so that the peer mail server can provide better diagnostics.
 
+The connections are handled in a single event loop, but the messages are
+parsed and enqueued by a pool of worker threads, so that one slow message
+doesn't hold up the other connections.  A connection isn't read from while its
+message is being processed, and no new connections are accepted while
+messages are waiting for a worker.
+
 [1] RFC 2033 Local Mail Transport Protocol
     http://www.faqs.org/rfcs/rfc2033.html
 """
@@ -39,19 +45,30 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'LMTPRunner',
+    'WorkerPool',
     ]
 
 
+import os
 import email
+import errno
+import fcntl
 import smtpd
+import Queue
+import signal
+import socket
 import logging
 import asyncore
+import threading
 
+from collections import deque
 from email.utils import parseaddr
+from lazr.config import as_boolean
 from zope.component import getUtility
 
 from mailman.config import config
 from mailman.core.runner import Runner
+from mailman.core.switchboard import group_commit
 from mailman.database.transaction import transactional
 from mailman.email.message import Message
 from mailman.interfaces.listmanager import IListManager
@@ -92,6 +109,8 @@ SUBADDRESS_QUEUES = dict(
 
 DASH    = '-'
 CRLF    = b'\r\n'
+NL      = b'\n'
+EMPTYSTRING = b''
 ERR_451 = b'451 Requested action aborted: error in processing'
 ERR_501 = b'501 Message has defects'
 ERR_502 = b'502 Error: command HELO not implemented'
@@ -101,6 +120,9 @@ ERR_550_MID = b'550 No Message-ID header provided'
 # XXX Blech
 smtpd.__version__ = b'Python LMTP runner 1.0'
 
+# Python 2's socket module doesn't define this.  This is the Linux value.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
 
 
 def split_recipient(address):
@@ -135,10 +157,44 @@ class Channel(smtpd.SMTPChannel):
     """An LMTP channel."""
 
     def __init__(self, server, conn, addr):
+        # Set this before the base class adds the channel to the event loop.
+        self._processing = False
         smtpd.SMTPChannel.__init__(self, server, conn, addr)
         # Stash this here since the subclass uses private attributes. :(
         self._server = server
 
+    def readable(self):
+        """Don't read the next command while a message is being processed."""
+        return not self._processing and smtpd.SMTPChannel.readable(self)
+
+    def found_terminator(self):
+        """Hand the message data off to the server's worker pool."""
+        if (self._server.pool is None or
+                self._SMTPChannel__state != self.DATA):
+            smtpd.SMTPChannel.found_terminator(self)
+            return
+        line = EMPTYSTRING.join(self._SMTPChannel__line)
+        self._SMTPChannel__line = []
+        # Remove extraneous carriage returns and de-transparency according
+        # to RFC 821, Section 4.5.2.
+        data = NL.join((text[1:] if text.startswith(b'.') else text)
+                       for text in line.split(CRLF))
+        peer = self._SMTPChannel__peer
+        mailfrom = self._SMTPChannel__mailfrom
+        rcpttos = self._SMTPChannel__rcpttos
+        self._SMTPChannel__rcpttos = []
+        self._SMTPChannel__mailfrom = None
+        self._SMTPChannel__state = self.COMMAND
+        self.set_terminator(CRLF)
+        self._processing = True
+        self._server.pool.submit(self, (peer, mailfrom, rcpttos, data))
+
+    def reply(self, status):
+        """Send the status of a processed message to the peer."""
+        self._processing = False
+        if self.connected:
+            self.push(status if status else b'250 Ok')
+
     def smtp_LHLO(self, arg):
         """The LMTP greeting, used instead of HELO/EHLO."""
         smtpd.SMTPChannel.smtp_HELO(self, arg)
@@ -148,6 +204,112 @@ class Channel(smtpd.SMTPChannel):
         self.push(ERR_502)
 
 
+
+class _Wakeup(asyncore.file_dispatcher):
+    """Wake up the event loop when a worker has processed a message."""
+
+    def __init__(self, pool, fd):
+        asyncore.file_dispatcher.__init__(self, fd)
+        self._pool = pool
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(512)
+        self._pool.deliver_replies()
+
+
+
+class WorkerPool:
+    """A pool of threads processing the messages received over LMTP.
+
+    Messages are submitted from the event loop and processed by the
+    runner's `process_message()` in the worker threads.  The workers wake
+    up the event loop to send their replies.
+    """
+
+    def __init__(self, runner, size):
+        self.size = size
+        self._runner = runner
+        self._jobs = Queue.Queue()
+        self._replies = deque()
+        self._threads = []
+        # The number of messages submitted, but not yet replied to.
+        self.pending = 0
+        self._read_fd, self._write_fd = os.pipe()
+        flags = fcntl.fcntl(self._write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._wakeup = _Wakeup(self, self._read_fd)
+
+    @property
+    def saturated(self):
+        """True when messages are waiting for a free worker."""
+        return self.pending > self.size
+
+    def start(self):
+        """Start the worker threads."""
+        # Signals may be delivered to a worker thread, but their handlers only
+        # run in the main thread, which may be waiting in the event loop.
+        # This makes sure that it wakes up.
+        signal.set_wakeup_fd(self._write_fd)
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the worker threads once they are done with their messages."""
+        for thread in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        del self._threads[:]
+        signal.set_wakeup_fd(-1)
+        self._wakeup.close()
+        os.close(self._write_fd)
+
+    def submit(self, channel, args):
+        """Process a message in a worker thread.
+
+        :param channel: The channel which received the message, and which
+            will get the reply.
+        :param args: The arguments for `process_message()`.
+        """
+        self.pending += 1
+        if self.saturated:
+            slog.info('LMTP message from %s waiting for a worker, '
+                      '%s messages pending', args[0], self.pending)
+        self._jobs.put((channel, args))
+
+    def deliver_replies(self):
+        """Send the replies to the processed messages, in the event loop."""
+        while self._replies:
+            channel, status = self._replies.popleft()
+            self.pending -= 1
+            channel.reply(status)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            channel, args = job
+            try:
+                status = self._runner.process_message(*args)
+            except Exception:
+                elog.exception('LMTP message processing')
+                status = CRLF.join(ERR_451 for to in args[2])
+            self._replies.append((channel, status))
+            try:
+                os.write(self._write_fd, b'x')
+            except OSError as error:
+                # If the pipe is full, the event loop is woken up anyway.
+                if error.errno != errno.EAGAIN:
+                    raise
+
+
 
 class LMTPRunner(Runner, smtpd.SMTPServer):
     # Only __init__ is called on startup. Asyncore is responsible for later
@@ -163,6 +325,20 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                    localaddr[0], localaddr[1])
         smtpd.SMTPServer.__init__(self, localaddr, remoteaddr=None)
         super(LMTPRunner, self).__init__(name, slice)
+        workers = int(config.mta.lmtp_workers)
+        self.pool = (WorkerPool(self, workers) if workers > 0 else None)
+
+    def set_reuse_addr(self):
+        """See `asyncore.dispatcher`."""
+        # This is called before the listening socket is bound.  Setting
+        # SO_REUSEPORT lets several LMTP runners listen on the same port.
+        smtpd.SMTPServer.set_reuse_addr(self)
+        if as_boolean(config.mta.lmtp_reuse_port):
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+
+    def readable(self):
+        """Don't accept new connections while messages are backed up."""
+        return self.pool is None or not self.pool.saturated
 
     def handle_accept(self):
         conn, addr = self.accept()
@@ -170,17 +346,19 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
         slog.debug('LMTP accept from %s', addr)
 
     @transactional
+    def _get_listnames(self):
+        # The list manager only reloads the list names from the database when
+        # the set of mailing lists has changed, so this is cheap.
+        return getUtility(IListManager).names
+
     def process_message(self, peer, mailfrom, rcpttos, data):
         try:
-            # Refresh the list of list names every time we process a message
-            # since the set of mailing lists could have changed.
-            listnames = set(getUtility(IListManager).names)
+            listnames = self._get_listnames()
             # Parse the message data.  If there are any defects in the
             # message, reject it right away; it's probably spam.
             msg = email.message_from_string(data, Message)
         except Exception:
             elog.exception('LMTP message parsing')
-            config.db.abort()
             return CRLF.join(ERR_451 for to in rcpttos)
         # Do basic post-processing of the message, checking it for defects or
         # other missing information.
@@ -192,6 +370,21 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
         msg.original_size = len(data)
         add_message_hash(msg)
         msg['X-MailFrom'] = mailfrom
+        # The message is only accepted once all of its queue files are safely
+        # on disk.
+        try:
+            with group_commit.batch():
+                status = self._enqueue(msg, rcpttos, listnames)
+        except EnvironmentError:
+            elog.exception('Queue file commit: %s', message_id)
+            return CRLF.join(ERR_451 for to in rcpttos)
+        # All done; returning this big status string should give the expected
+        # response to the LMTP client.
+        return CRLF.join(status)
+
+    def _enqueue(self, msg, rcpttos, listnames):
+        """Enqueue the message for each recipient and return their statuses."""
+        message_id = msg.get('message-id')
         # RFC 2033 requires us to return a status code for every recipient.
         status = []
         # Now for each address in the recipients, parse the address to first
@@ -201,7 +394,8 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
         received_time = now()
         for to in rcpttos:
             try:
-                to = parseaddr(to)[1].lower()
+                recipient = parseaddr(to)[1]
+                to = recipient.lower()
                 listname, subaddress, domain = split_recipient(to)
                 slog.debug('%s to: %s, list: %s, sub: %s, dom: %s',
                            message_id, to, listname, subaddress, domain)
@@ -237,6 +431,10 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                             envsender=config.mailman.site_owner,
                             ))
                         queue = 'in'
+                    elif canonical_subaddress == 'bounces':
+                        # Remember the envelope recipient, since it's a VERP
+                        # address if the bounce is to a VERP'd message.
+                        msgdata['envelope_recipient'] = recipient
                 # If we found a valid destination, enqueue the message and add
                 # a success status for this recipient.
                 if queue is not None:
@@ -246,15 +444,21 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                     status.append(b'250 Ok')
             except Exception:
                 slog.exception('Queue detection: %s', msg['message-id'])
-                config.db.abort()
                 status.append(ERR_550)
-        # All done; returning this big status string should give the expected
-        # response to the LMTP client.
-        return CRLF.join(status)
+        return status
 
     def run(self):
         """See `IRunner`."""
-        asyncore.loop()
+        if self.pool is None:
+            asyncore.loop()
+            return
+        self.pool.start()
+        try:
+            asyncore.loop()
+        finally:
+            # This is not done in stop(), which is called from a signal
+            # handler, where waiting for the workers could deadlock.
+            self.pool.stop()
 
     def stop(self):
         """See `IRunner`."""
@@ -37,16 +37,18 @@ from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.interfaces.bounce import (
     BounceContext, IBounceProcessor, UnrecognizedBounceDisposition)
-from mailman.interfaces.member import MemberRole
+from mailman.interfaces.member import DeliveryStatus, MemberRole
 from mailman.interfaces.styles import IStyle, IStyleManager
 from mailman.interfaces.usermanager import IUserManager
 from mailman.runners.bounce import BounceRunner
 from mailman.testing.helpers import (
     LogFileMark,
+    configuration,
     get_queue_messages,
     make_testable_runner,
     specialized_message_from_string as message_from_string)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import factory
 
 
 
@@ -233,6 +235,49 @@ Message-Id: <third>
         self.assertEqual(len(forwards), 1)
         self.assertEqual(forwards[0].msg['to'], 'postmaster@example.com')
 
+    def test_periodic_scoring(self):
+        # The registered bounces are scored in periodic passes.
+        self._mlist.bounce_score_threshold = 1
+        self._bounceq.enqueue(self._msg, self._msgdata)
+        self._runner.run()
+        # The testable runner doesn't do the bounce runner's periodic work.
+        BounceRunner._do_periodic(self._runner)
+        self.assertEqual(len(list(self._processor.unprocessed)), 0)
+        self.assertEqual(self._member.bounce_score, 1)
+        self.assertEqual(self._member.delivery_status,
+                         DeliveryStatus.by_bounces)
+        # The next pass is not due yet.
+        self._processor.register(self._mlist, 'anne@example.com', self._msg)
+        BounceRunner._do_periodic(self._runner)
+        self.assertEqual(len(list(self._processor.unprocessed)), 1)
+
+    def test_periodic_removal(self):
+        # Members whose delivery was disabled by bounces are only removed when
+        # the site enables it.
+        self._mlist.bounce_score_threshold = 1
+        self._bounceq.enqueue(self._msg, self._msgdata)
+        self._runner.run()
+        BounceRunner._do_periodic(self._runner)
+        factory.fast_forward(days=365)
+        self._runner._next_pass = 0
+        BounceRunner._do_periodic(self._runner)
+        self.assertIsNotNone(
+            self._mlist.members.get_member('anne@example.com'))
+        with configuration('bounces', remove_disabled_members='yes'):
+            self._runner._next_pass = 0
+            BounceRunner._do_periodic(self._runner)
+        self.assertIsNone(self._mlist.members.get_member('anne@example.com'))
+
+    def test_periodic_ends_batch(self):
+        # In batch mode, the queue files processed so far are only finished
+        # once the pass has committed their work.
+        filebase = self._bounceq.enqueue(self._msg, self._msgdata)
+        self._bounceq.dequeue(filebase)
+        self._runner._unfinished.append(filebase)
+        BounceRunner._do_periodic(self._runner)
+        self.assertEqual(self._runner._unfinished, [])
+        self.assertEqual(self._bounceq.get_files('.bak'), [])
+
 
 
 # Create a style for the mailing list which sets the absolute minimum
@@ -22,6 +22,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestDigest',
+    'TestTextSpool',
     ]
 
 
@@ -29,14 +30,17 @@ import os
 import unittest
 
 from email.mime.text import MIMEText
+from mailman.app.digests import digest_store
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.email.message import Message
-from mailman.runners.digest import DigestRunner
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.runners.digest import DigestRunner, TextSpool
 from mailman.testing.helpers import (
-    LogFileMark, digest_mbox, get_queue_messages, make_testable_runner,
-    specialized_message_from_string as mfs)
+    LogFileMark, configuration, get_queue_messages, make_testable_runner,
+    specialized_message_from_string as mfs, subscribe)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.mailbox import Mailbox
 
 
 
@@ -61,17 +65,16 @@ To: test@example.com
 
 message triggering a digest
 """)
-        mbox_path = os.path.join(self._mlist.data_path, 'digest.mmdf')
         self._process(self._mlist, msg, {})
         self._digestq.enqueue(
             msg,
             listname=self._mlist.fqdn_listname,
-            digest_path=mbox_path,
+            digest_path=digest_store(self._mlist).path,
             volume=1, digest_number=1)
         self._runner.run()
-        # There are two messages in the virgin queue: the digest as plain-text
-        # and as multipart.
-        messages = get_queue_messages('virgin')
+        # There are two messages in the outgoing queue: the digest as
+        # plain-text and as multipart.
+        messages = get_queue_messages('out')
         self.assertEqual(len(messages), 2)
         self.assertEqual(
             sorted(item.msg.get_content_type() for item in messages),
@@ -80,6 +83,52 @@ message triggering a digest
             self.assertEqual(item.msg['subject'],
                              'Test Digest, Vol 1, Issue 1')
 
+    def test_rendered_once(self):
+        # The digests go straight to the outgoing queue, each rendered once
+        # for all of its recipients, which are resolved by delivery mode.
+        for name, mode, status in (
+                ('Anne', DeliveryMode.mime_digests, DeliveryStatus.enabled),
+                ('Bart', DeliveryMode.plaintext_digests,
+                 DeliveryStatus.enabled),
+                ('Cris', DeliveryMode.mime_digests,
+                 DeliveryStatus.by_user),
+                ('Dave', DeliveryMode.regular, DeliveryStatus.enabled)):
+            subscribe(self._mlist, name)
+            member = self._mlist.members.get_member(
+                '{0}person@example.com'.format(name[0].lower()))
+            member.preferences.delivery_mode = mode
+            member.preferences.delivery_status = status
+        # Throw away the welcome messages.
+        get_queue_messages('virgin')
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+
+message triggering a digest
+""")
+        self._process(self._mlist, msg, {})
+        self._digestq.enqueue(
+            msg,
+            listname=self._mlist.fqdn_listname,
+            digest_path=digest_store(self._mlist).path,
+            volume=1, digest_number=1)
+        self._runner.run()
+        self.assertEqual(len(get_queue_messages('virgin')), 0)
+        messages = get_queue_messages('out', sort_on='content-type')
+        self.assertEqual(len(messages), 2)
+        mime, rfc1153 = messages
+        self.assertEqual(mime.msgdata['recipients'],
+                         set(['aperson@example.com']))
+        self.assertEqual(rfc1153.msgdata['recipients'],
+                         set(['bperson@example.com']))
+        for item in messages:
+            self.assertTrue(item.msgdata['isdigest'])
+            # The rendered body is carried through as it is.
+            body = item.msg.get_unparsed_body()
+            self.assertIsNotNone(body)
+            self.assertGreater(item.msgdata['original_size'], len(body))
+            self.assertEqual(item.msg['precedence'], 'list')
+
     def test_non_ascii_message(self):
         msg = Message()
         msg['From'] = 'anne@example.org'
@@ -87,22 +136,21 @@ message triggering a digest
         msg['Content-Type'] = 'multipart/mixed'
         msg.attach(MIMEText('message with non-ascii chars: \xc3\xa9',
                             'plain', 'utf-8'))
-        mbox = digest_mbox(self._mlist)
-        mbox_path = os.path.join(self._mlist.data_path, 'digest.mmdf')
-        mbox.add(msg.as_string())
+        store = digest_store(self._mlist)
+        store.add(msg)
         self._digestq.enqueue(
             msg,
             listname=self._mlist.fqdn_listname,
-            digest_path=mbox_path,
+            digest_path=store.path,
             volume=1, digest_number=1)
         # Use any error logs as the error message if the test fails.
         error_log = LogFileMark('mailman.error')
         self._runner.run()
         # The runner will send the file to the shunt queue on exception.
         self.assertEqual(len(self._shuntq.files), 0, error_log.read())
-        # There are two messages in the virgin queue: the digest as plain-text
-        # and as multipart.
-        messages = get_queue_messages('virgin')
+        # There are two messages in the outgoing queue: the digest as
+        # plain-text and as multipart.
+        messages = get_queue_messages('out')
         self.assertEqual(len(messages), 2)
         self.assertEqual(
             sorted(item.msg.get_content_type() for item in messages),
@@ -110,3 +158,112 @@ message triggering a digest
         for item in messages:
             self.assertEqual(item.msg['subject'],
                              'Test Digest, Vol 1, Issue 1')
+
+    @configuration('digests', spool_size='100')
+    def test_spooled_to_disk(self):
+        # Digests which don't fit in memory are spooled to disk.  When some
+        # of the text can't be encoded in the list's character set, even
+        # after some of it has already been spooled, the whole plain text
+        # digest falls back to utf-8.
+        self._mlist.preferred_language = 'fr'
+        store = digest_store(self._mlist)
+        store.add(mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: =?utf-8?q?caf=C3=A9?=
+MIME-Version: 1.0
+Content-Type: text/plain; charset=utf-8
+Content-Transfer-Encoding: quoted-printable
+
+Un caf=C3=A9, s'il vous pla=C3=AEt.
+"""))
+        store.add(mfs("""\
+From: bart@example.org
+To: test@example.com
+Subject: =?iso-2022-jp?b?GyRCMGxIVhsoQg==?=
+MIME-Version: 1.0
+Content-Type: text/plain; charset=iso-2022-jp
+Content-Transfer-Encoding: 7bit
+
+\x1b$B0lHV\x1b(B
+"""))
+        self._digestq.enqueue(
+            Message(),
+            listname=self._mlist.fqdn_listname,
+            digest_path=store.path,
+            volume=1, digest_number=1)
+        error_log = LogFileMark('mailman.error')
+        self._runner.run()
+        self.assertEqual(len(self._shuntq.files), 0, error_log.read())
+        messages = get_queue_messages('out', sort_on='content-type')
+        self.assertEqual(len(messages), 2)
+        mime, rfc1153 = messages[0].msg, messages[1].msg
+        self.assertEqual(mime.get_content_type(), 'multipart/mixed')
+        # The masthead, the table of contents, the two messages and the
+        # footer.
+        parts = mime.get_payload()
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(parts[2].get_payload(0)['from'], 'anne@example.org')
+        self.assertEqual(parts[3].get_payload(0).get_payload(),
+                         '\x1b$B0lHV\x1b(B\n')
+        self.assertEqual(rfc1153.get_content_charset(), 'utf-8')
+        text = rfc1153.get_payload(decode=True).decode('utf-8')
+        self.assertIn("Un caf\xe9, s'il vous pla\xeet.", text)
+        self.assertIn('\u4e00\u756a', text)
+        # The spooled files and the digest store are gone.
+        self.assertEqual(os.listdir(self._mlist.data_path), [])
+
+    def test_mailbox_digest(self):
+        # Digests collected in a mailbox by older versions of Mailman are
+        # still sent.
+        mbox_path = os.path.join(self._mlist.data_path, 'digest.1.1.mmdf')
+        with Mailbox(mbox_path, create=True) as mbox:
+            mbox.add(mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: Old news
+
+message collected in a mailbox
+""").as_string())
+        self._digestq.enqueue(
+            Message(),
+            listname=self._mlist.fqdn_listname,
+            digest_path=mbox_path,
+            volume=1, digest_number=1)
+        self._runner.run()
+        messages = get_queue_messages('out', sort_on='content-type')
+        self.assertEqual(len(messages), 2)
+        self.assertIn('Old news (anne@example.org)',
+                      messages[1].msg.get_payload())
+        self.assertFalse(os.path.exists(mbox_path))
+
+
+
+
+class TestTextSpool(unittest.TestCase):
+    """Test the spooling of plain text digests."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._spool = TextSpool(self._mlist, 'iso-8859-1')
+
+    def test_ensure_encodable(self):
+        # Text which can be encoded leaves the spool alone.
+        self._spool.write('Caf\xe9\n')
+        self._spool.ensure_encodable('Cr\xe8me')
+        self.assertEqual(self._spool.charset, 'iso-8859-1')
+        # Otherwise, the spool switches to utf-8, and re-encodes its text.
+        self._spool.ensure_encodable('\u4e00')
+        self.assertEqual(self._spool.charset, 'utf-8')
+        self.assertEqual(self._spool.join('', ''), b'Caf\xc3\xa9\n')
+
+    def test_join(self):
+        # The head and the tail are encoded like the spooled text.
+        self._spool.write('Caf\xe9\n')
+        self.assertEqual(self._spool.join('\u4e00\n', 'Cr\xe8me\n'),
+                         b'\xe4\xb8\x80\nCaf\xc3\xa9\nCr\xc3\xa8me\n')
+        self.assertEqual(self._spool.charset, 'utf-8')
+        # The spooled files are gone.
+        self.assertEqual(os.listdir(self._mlist.data_path), [])
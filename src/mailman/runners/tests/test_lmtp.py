@@ -21,21 +21,28 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'TestBugs',
     'TestLMTP',
+    'TestWorkerPool',
     ]
 
 
 import os
+import socket
 import smtplib
+import asyncore
 import unittest
+import threading
 
 from datetime import datetime
 
 from mailman.config import config
 from mailman.app.lifecycle import create_list
 from mailman.database.transaction import transaction
-from mailman.testing.helpers import get_lmtp_client, get_queue_messages
-from mailman.testing.layers import LMTPLayer
+from mailman.runners.lmtp import LMTPRunner
+from mailman.testing.helpers import (
+    configuration, get_lmtp_client, get_queue_messages)
+from mailman.testing.layers import ConfigLayer, LMTPLayer
 
 
 
@@ -112,6 +119,22 @@ Message-ID: <ant>
         self.assertEqual(messages[0].msgdata['received_time'],
                          datetime(2005, 8, 1, 7, 49, 23))
 
+    def test_bounce_envelope_recipient(self):
+        # The envelope recipient of a bounce is recorded in the metadata, with
+        # its case intact.
+        self._lmtp.sendmail(
+            'mail-daemon@example.com',
+            ['test-bounces+Anne=example.com@example.com'], """\
+From: mail-daemon@example.com
+To: test-bounces@example.com
+Message-ID: <ant>
+
+""")
+        messages = get_queue_messages('bounces')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msgdata['envelope_recipient'],
+                         'test-bounces+Anne=example.com@example.com')
+
     def test_queue_directory(self):
         # The LMTP runner is not queue runner, so it should not have a
         # directory in var/queue.
@@ -144,3 +167,116 @@ Message-ID: <alpha>
         self.assertEqual(len(messages), 1)
         self.assertEqual(messages[0].msgdata['listname'],
                          'my-list@example.com')
+
+
+
+class TestWorkerPool(unittest.TestCase):
+    """Test the LMTP server's worker threads."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        with transaction():
+            create_list('test@example.com')
+        self._runner = None
+
+    def tearDown(self):
+        if self._runner is not None:
+            self._runner.stop()
+
+    def _start(self):
+        self._runner = LMTPRunner('lmtp')
+        self._runner.pool.start()
+        self.addCleanup(self._runner.pool.stop)
+
+    def _send(self, message_id):
+        # Send a message from another thread, and return the thread and the
+        # list which will get the result.
+        results = []
+        def send():
+            lmtp = get_lmtp_client(quiet=True)
+            lmtp.lhlo('remote.example.org')
+            try:
+                results.append(lmtp.sendmail(
+                    'anne@example.com', ['test@example.com'], """\
+From: anne@example.com
+To: test@example.com
+Message-ID: <{0}>
+
+""".format(message_id)))
+            except smtplib.SMTPException as error:
+                results.append(error)
+            lmtp.quit()
+        thread = threading.Thread(target=send)
+        thread.start()
+        return thread, results
+
+    def _loop_until(self, predicate):
+        for i in range(100):
+            if predicate():
+                return
+            asyncore.loop(timeout=0.1, count=1)
+        raise AssertionError('Timed out')
+
+    @configuration('mta', lmtp_port=9124, lmtp_workers=2)
+    def test_message_processed_by_worker(self):
+        self._start()
+        thread, results = self._send('ant')
+        self._loop_until(lambda: not thread.is_alive())
+        self.assertEqual(results, [{}])
+        messages = get_queue_messages('in')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msg['message-id'], '<ant>')
+
+    @configuration('mta', lmtp_port=9124, lmtp_workers=1)
+    def test_backpressure(self):
+        self._start()
+        pool = self._runner.pool
+        # Hold up the single worker.
+        release = threading.Event()
+        processing = []
+        def process_message(peer, mailfrom, rcpttos, data):
+            processing.append(data)
+            release.wait()
+        self._runner.process_message = process_message
+        # Make sure the worker is released even if the test fails.
+        self.addCleanup(release.set)
+        first, first_results = self._send('ant')
+        second, second_results = self._send('bee')
+        self._loop_until(lambda: pool.pending == 2 and len(processing) == 1)
+        # The second message is waiting for the worker, so no new
+        # connections are accepted.
+        self.assertTrue(pool.saturated)
+        self.assertFalse(self._runner.readable())
+        release.set()
+        self._loop_until(
+            lambda: not first.is_alive() and not second.is_alive())
+        self.assertEqual(first_results, [{}])
+        self.assertEqual(second_results, [{}])
+        self.assertEqual(pool.pending, 0)
+        self.assertTrue(self._runner.readable())
+
+    @configuration('mta', lmtp_port=9124, lmtp_workers=1)
+    def test_worker_error(self):
+        # A message which the worker fails to process is temporarily
+        # rejected.
+        self._start()
+        def process_message(peer, mailfrom, rcpttos, data):
+            raise RuntimeError
+        self._runner.process_message = process_message
+        thread, results = self._send('ant')
+        self._loop_until(lambda: not thread.is_alive())
+        self.assertEqual(results[0].smtp_code, 451)
+
+    @configuration('mta', lmtp_port=9124, lmtp_reuse_port='yes')
+    def test_reuse_port(self):
+        # Several LMTP runners can listen on the same port.
+        self._runner = LMTPRunner('lmtp')
+        other = LMTPRunner('lmtp')
+        other.close()
+
+    @configuration('mta', lmtp_port=9124)
+    def test_no_reuse_port(self):
+        self._runner = LMTPRunner('lmtp')
+        with self.assertRaises(socket.error):
+            LMTPRunner('lmtp')
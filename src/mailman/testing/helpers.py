@@ -23,15 +23,16 @@ __metaclass__ = type
 __all__ = [
     'LogFileMark',
     'TestableMaster',
+    'batching_db',
     'call_api',
     'chdir',
     'configuration',
-    'digest_mbox',
     'event_subscribers',
     'get_lmtp_client',
     'get_nntp_server',
     'get_queue_messages',
     'make_testable_runner',
+    'recorded_statements',
     'reset_the_world',
     'specialized_message_from_string',
     'subscribe',
@@ -52,6 +53,7 @@ import socket
 import logging
 import smtplib
 import datetime
+import tempfile
 import threading
 
 from base64 import b64encode
@@ -59,6 +61,7 @@ from contextlib import contextmanager
 from email import message_from_string
 from httplib2 import Http
 from lazr.config import as_timedelta
+from sqlalchemy.event import listen, remove
 from urllib import urlencode
 from urllib2 import HTTPError
 from zope import event
@@ -66,13 +69,15 @@ from zope.component import getUtility
 
 from mailman.bin.master import Loop as Master
 from mailman.config import config
+from mailman.database.model import Model
+from mailman.database.sqlite import SQLiteDatabase
 from mailman.database.transaction import transaction
 from mailman.email.message import Message
 from mailman.interfaces.member import MemberRole
 from mailman.interfaces.messages import IMessageStore
 from mailman.interfaces.styles import IStyleManager
 from mailman.interfaces.usermanager import IUserManager
-from mailman.utilities.mailbox import Mailbox
+from mailman.mta.connection import close_pools
 
 
 NL = '\n'
@@ -143,17 +148,6 @@ def get_queue_messages(queue_name, sort_on=None):
     return messages
 
 
-
-def digest_mbox(mlist):
-    """The mailing list's pending digest as a mailbox.
-
-    :param mlist: The mailing list.
-    :return: The mailing list's pending digest as a mailbox.
-    """
-    path = os.path.join(mlist.data_path, 'digest.mmdf')
-    return Mailbox(path)
-
-
 
 # Remember, Master is mailman.bin.master.Loop.
 class TestableMaster(Master):
@@ -405,6 +399,26 @@ class configuration:
         return wrapper
 
 
+
+@contextmanager
+def recorded_statements():
+    """Record the SQL statements which the database executes.
+
+    The statements are recorded while the context manager is active.
+
+    :return: The list to which the statements are appended, in the order in
+        which they are executed.
+    """
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    listen(config.db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        remove(config.db.engine, 'before_cursor_execute', record)
+
+
 
 @contextmanager
 def temporary_db(db):
@@ -416,6 +430,35 @@ def temporary_db(db):
         config.db = real_db
 
 
+@contextmanager
+def batching_db():
+    """Use a temporary SQLite database configured for batching runners.
+
+    SQLite only supports savepoints when a runner processes its queue files
+    in batches, which the testing configuration doesn't do.  While the
+    context manager is active, an empty database which supports savepoints
+    is used instead of the testing database.
+
+    :return: The temporary database.
+    """
+    tempdir = tempfile.mkdtemp()
+    url = 'sqlite:///' + os.path.join(tempdir, 'mailman.db')
+    try:
+        database = SQLiteDatabase()
+        with configuration('database', url=url):
+            with configuration('runner.in', batch_size=2):
+                database.initialize()
+        Model.metadata.create_all(database.engine)
+        try:
+            with temporary_db(database):
+                yield database
+        finally:
+            database.store.remove()
+            database.engine.dispose()
+    finally:
+        shutil.rmtree(tempdir)
+
+
 
 class chdir:
     """A context manager for temporary directory changing."""
@@ -466,12 +509,16 @@ def reset_the_world():
     This should be as thorough a reset of the system as necessary to keep
     tests isolated.
     """
-    # Reset the database between tests.
+    # Avoid circular imports.
+    from mailman.model.listmanager import invalidate_names
+    # Reset the database between tests.  This bypasses the list manager, so
+    # make sure no process keeps using the old mailing list names.
     config.db._reset()
+    invalidate_names()
     # Remove any digest files.
     for dirpath, dirnames, filenames in os.walk(config.LIST_DATA_DIR):
         for filename in filenames:
-            if filename.endswith('.mmdf'):
+            if filename.endswith(('.mmdf', '.seg', '.idx', '.lck')):
                 os.remove(os.path.join(dirpath, filename))
     # Remove all residual queue files.
     for dirpath, dirnames, filenames in os.walk(config.QUEUE_DIR):
@@ -491,6 +538,8 @@ def reset_the_world():
     getUtility(IStyleManager).populate()
     # Remove all dynamic header-match rules.
     config.chains['header-match'].flush()
+    # Close any pooled SMTP connections.
+    close_pools()
 
 
 
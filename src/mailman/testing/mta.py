@@ -67,6 +67,8 @@ class StatisticsChannel(Channel):
         else:
             self._SMTPChannel__greeting = arg
             self.push(b'250-%s' % self._SMTPChannel__fqdn)
+            for extension in sorted(self._server.extensions):
+                self.push(b'250-%s' % extension)
             self.push(b'250 AUTH PLAIN')
 
     def smtp_STAT(self, arg):
@@ -128,6 +130,8 @@ class ConnectionCountingServer(QueueServer):
         self._oob_queue = oob_queue
         self._err_queue = err_queue
         self._last_error = None
+        # Additional ESMTP extensions to advertise in the EHLO response.
+        self.extensions = set()
 
     def next_error(self, command):
         """Return the next error for the SMTP command, if there is one.
@@ -170,6 +174,7 @@ class ConnectionCountingServer(QueueServer):
         """See `lazr.smtp.server.Server`."""
         QueueServer.reset(self)
         self._connection_count = 0
+        self.extensions.clear()
 
     def send_statistics(self):
         """Send the current connection statistics to the controller."""
@@ -0,0 +1,291 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The append-only store of the messages collected for a digest.
+
+A digest store is two files.  The segment file holds the text of the
+messages, one after the other.  The index file has a line for each message,
+recording where its text is in the segment file, along with its decoded
+Subject: and From: headers for the digest's table of contents.
+
+Both files are only ever appended to, with ``O_APPEND`` writes, so any number
+of processes can add messages at the same time while holding just a shared
+lock.  Cutting the digest, i.e. moving the collected messages aside to be sent
+and starting a new collection, takes the lock exclusively and renames the two
+files.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'DigestEntry',
+    'DigestStore',
+    'index_headers',
+    ]
+
+
+import os
+import json
+import email
+import errno
+import fcntl
+import logging
+import email.message
+
+from collections import namedtuple
+from contextlib import contextmanager
+from email.header import Header
+
+from mailman.utilities.mailbox import Mailbox
+from mailman.utilities.string import oneline
+
+
+log = logging.getLogger('mailman.error')
+
+
+# The index record of a message in the digest store.
+DigestEntry = namedtuple('DigestEntry', 'offset size subject sender')
+
+
+
+def _header(msg, name):
+    # Mailman's messages insist on header values being ascii, but the raw
+    # value is all we need.
+    value = email.message.Message.get(msg, name)
+    if value is None:
+        return None
+    if isinstance(value, Header):
+        value = value.encode()
+    elif isinstance(value, bytes):
+        try:
+            value.decode('ascii')
+        except UnicodeError:
+            # Raw 8-bit headers aren't allowed, but they're mostly UTF-8.
+            value = value.decode('utf-8', 'replace')
+            return ''.join(value.splitlines())
+    return oneline(value, in_unicode=True)
+
+
+def index_headers(msg):
+    """The decoded headers of a message, as recorded in the index.
+
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :return: The message's decoded Subject: and From: headers, each of which
+        is None if the message doesn't have it.
+    :rtype: 2-tuple of (unicode, unicode)
+    """
+    return _header(msg, 'subject'), _header(msg, 'from')
+
+
+def _append(path, data):
+    # Append the data to the file with a single write.  With O_APPEND, the
+    # write is positioned at the end of the file atomically, so concurrent
+    # appends never overwrite each other.  Return the size of the file right
+    # after the write.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+    try:
+        written = os.write(fd, data)
+        if written != len(data):
+            # The rest could end up after some other process's data, so
+            # don't try to write it.
+            raise IOError(errno.ENOSPC, 'Short write', path)
+        return os.lseek(fd, 0, os.SEEK_CUR)
+    finally:
+        os.close(fd)
+
+
+
+class DigestStore:
+    """The messages collected for a digest."""
+
+    def __init__(self, path):
+        """Create the digest store.
+
+        :param path: The path of the store, without the file extensions.
+        :type path: str
+        """
+        self.path = path
+        self.segment_path = path + '.seg'
+        self.index_path = path + '.idx'
+        self._lock_path = path + '.lck'
+
+    @contextmanager
+    def _locked(self, operation):
+        fd = os.open(self._lock_path, os.O_WRONLY | os.O_CREAT, 0666)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def add(self, msg):
+        """Add a message to the store.
+
+        :param msg: The message.
+        :type msg: `email.message.Message`
+        :return: The size of the segment file after adding the message.
+        :rtype: int
+        """
+        with self._locked(fcntl.LOCK_SH):
+            return self._add(msg)
+
+    def _add(self, msg):
+        # Append the message.  The caller must hold the lock.
+        text = msg.as_string()
+        subject, sender = index_headers(msg)
+        end = _append(self.segment_path, text)
+        # The segment file may have grown by now, but not between the append
+        # and our reading of the file position.
+        record = json.dumps([end - len(text), len(text), subject, sender],
+                            separators=(',', ':'))
+        # The index only ever records complete messages.
+        _append(self.index_path, record.encode('utf-8') + b'\n')
+        return end
+
+    def add_mailbox(self, path):
+        """Move the messages of a mailbox into the store.
+
+        Older versions of Mailman collected the messages for a digest in an
+        MMDF mailbox.  Its messages are added to the store, in order, and the
+        mailbox is removed.  This is atomic with respect to `cut()`.
+
+        :param path: The path of the mailbox.
+        :type path: str
+        :return: The number of messages moved, or None if there was no
+            mailbox, e.g. because another process already moved them.
+        :rtype: int
+        """
+        with self._locked(fcntl.LOCK_EX):
+            if not os.path.exists(path):
+                return None
+            count = 0
+            with Mailbox(path) as mailbox:
+                for message in mailbox.itervalues():
+                    self._add(message)
+                    count += 1
+            os.remove(path)
+            return count
+
+    @property
+    def size(self):
+        """The size of the segment file."""
+        try:
+            return os.path.getsize(self.segment_path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return 0
+
+    def entries(self):
+        """The index records of the messages in the store.
+
+        :return: The records, in the order the messages were added.
+        :rtype: list of `DigestEntry`
+        """
+        try:
+            with open(self.index_path, 'rb') as fp:
+                lines = fp.readlines()
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(DigestEntry(*json.loads(line)))
+            except (ValueError, TypeError):
+                # A record left incomplete by a crash.  Its message is lost.
+                log.error('Bad digest index record in {0}: {1!r}'.format(
+                    self.index_path, line))
+        return entries
+
+    def __len__(self):
+        return len(self.entries())
+
+    def iteritems(self):
+        """Iterate over the messages in the store.
+
+        :return: The index record and the parsed message of each message in
+            the store, in the order the messages were added.
+        :rtype: iterator of 2-tuples of (`DigestEntry`,
+            `email.message.Message`)
+        """
+        entries = self.entries()
+        if len(entries) == 0:
+            return
+        with open(self.segment_path, 'rb') as fp:
+            for entry in entries:
+                fp.seek(entry.offset)
+                text = fp.read(entry.size)
+                # Like the messages of a mailbox, these are plain email
+                # package messages, which keep their raw header values.
+                yield entry, email.message_from_string(text)
+
+    def __iter__(self):
+        for entry, msg in self.iteritems():
+            yield msg
+
+    def cut(self, path, threshold=None):
+        """Move the collected messages to a new store.
+
+        This is atomic with respect to `add()`: every message is either in
+        the new store, or in the next collection of this store.
+
+        :param path: The path of the new store.
+        :type path: str
+        :param threshold: If given, only cut the store if its segment file
+            is at least this big.  This keeps processes which reach the size
+            threshold at the same time from all cutting the store.
+        :type threshold: int
+        :return: The new store, or None if there was nothing to cut.
+        :rtype: `DigestStore`
+        """
+        with self._locked(fcntl.LOCK_EX):
+            if threshold is not None and self.size < threshold:
+                return None
+            if not os.path.exists(self.index_path):
+                # Only text which never made it into the index, if anything.
+                self._remove(self.segment_path)
+                return None
+            store = DigestStore(path)
+            # Move the segment file first, and the index last.  The index
+            # showing up in the new store is what completes the cut, since a
+            # store without an index has no messages.  Should the index fail
+            # to move, move the segment file back, so the index doesn't
+            # refer to a missing segment file.
+            os.rename(self.segment_path, store.segment_path)
+            try:
+                os.rename(self.index_path, store.index_path)
+            except OSError:
+                os.rename(store.segment_path, self.segment_path)
+                raise
+            return store
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+
+    def remove(self):
+        """Remove the store's files."""
+        for path in (self.index_path, self.segment_path, self._lock_path):
+            self._remove(path)
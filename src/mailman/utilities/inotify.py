@@ -0,0 +1,161 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Waiting for files to arrive in a directory.
+
+On Linux, the inotify system calls are used through ctypes.  Elsewhere, or
+when inotify is not available, waiting just sleeps.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'DirectoryWatcher',
+    ]
+
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import logging
+
+
+log = logging.getLogger('mailman.runner')
+
+# From <sys/inotify.h>.
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# The fixed part of struct inotify_event, which is followed by the file name.
+EVENT_FORMAT = b'iIII'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+# Large enough for many events.
+READ_SIZE = 65536
+
+
+
+def _inotify_watch(directory):
+    # Return an inotify file descriptor watching for files being renamed
+    # into the directory, which is how queue files are written.
+    libc = ctypes.CDLL(None, use_errno=True)
+    # This raises AttributeError when the C library has no inotify support.
+    inotify_init1 = libc.inotify_init1
+    inotify_add_watch = libc.inotify_add_watch
+    fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    if isinstance(directory, unicode):
+        directory = directory.encode(sys.getfilesystemencoding())
+    if inotify_add_watch(fd, ctypes.c_char_p(directory),
+                         ctypes.c_uint32(IN_MOVED_TO)) < 0:
+        error = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(error, os.strerror(error), directory)
+    return fd
+
+
+
+class DirectoryWatcher:
+    """Wait for files to be moved into a directory."""
+
+    def __init__(self, directory, extension=''):
+        """Start watching the directory.
+
+        :param directory: The directory to watch.
+        :type directory: string
+        :param extension: Only files whose names end with this extension
+            are waited for.
+        :type extension: string
+        """
+        self.directory = directory
+        self.extension = extension.encode('ascii')
+        try:
+            self._fd = _inotify_watch(directory)
+        except (AttributeError, EnvironmentError) as error:
+            log.info('Cannot watch %s, falling back to polling: %s',
+                     directory, error)
+            self._fd = None
+
+    @property
+    def active(self):
+        """Whether files arriving in the directory end a wait early."""
+        return self._fd is not None
+
+    def _arrived(self):
+        # Read all the pending events, and return whether any of them is for
+        # a file with the right extension.  When the kernel's event queue
+        # has overflowed, assume that one was.
+        arrived = False
+        while True:
+            try:
+                data = os.read(self._fd, READ_SIZE)
+            except OSError as error:
+                if error.errno != errno.EAGAIN:
+                    raise
+                return arrived
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = struct.unpack_from(
+                    EVENT_FORMAT, data, offset)
+                offset += EVENT_SIZE
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW or name.endswith(self.extension):
+                    arrived = True
+
+    def wait(self, timeout):
+        """Wait until a file arrives, or the timeout expires.
+
+        A file which arrived since the last wait ends this one immediately.
+        Without inotify, this sleeps for the whole timeout.  Either way, a
+        signal also ends the wait.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        :return: True if a file arrived.
+        :rtype: bool
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+        deadline = time.time() + timeout
+        while True:
+            try:
+                readable, writable, exceptional = select.select(
+                    [self._fd], [], [], max(0, deadline - time.time()))
+            except select.error as error:
+                if error.args[0] != errno.EINTR:
+                    raise
+                return False
+            if len(readable) == 0:
+                return False
+            if self._arrived():
+                return True
+
+    def close(self):
+        """Stop watching the directory."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
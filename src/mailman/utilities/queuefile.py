@@ -0,0 +1,185 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The compact queue file format.
+
+A compact queue file starts with a line identifying the format and its
+version.  The second line contains the message metadata, encoded as JSON.
+The rest of the file is the raw RFC 5322 text of the message.
+
+JSON has no representation for some of the types commonly found in message
+metadata, such as datetimes and sets.  These, and byte strings, are encoded as
+JSON objects with a `__type__` key naming the type and a `value` key giving
+its value.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'MAGIC',
+    'decode_metadata',
+    'dump',
+    'encode_metadata',
+    'load',
+    ]
+
+
+import json
+import uuid
+import base64
+
+from datetime import datetime, timedelta
+from enum import Enum
+
+from mailman.utilities.modules import find_name
+
+
+# The first line of every compact queue file, including the format version.
+MAGIC = b'Mailman queue file 1\n'
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+
+def _encode(obj):
+    # Return a JSON-compatible representation of the object.
+    if obj is None or isinstance(obj, (bool, int, long, float, unicode)):
+        return obj
+    if isinstance(obj, bytes):
+        return dict(__type__='bytes', value=base64.b64encode(obj))
+    if isinstance(obj, list):
+        return [_encode(item) for item in obj]
+    if isinstance(obj, tuple):
+        return dict(__type__='tuple', value=[_encode(item) for item in obj])
+    if isinstance(obj, (set, frozenset)):
+        return dict(__type__=type(obj).__name__,
+                    value=[_encode(item) for item in obj])
+    if isinstance(obj, dict):
+        # Keyword argument names are byte strings, which are fine as keys.
+        if all(isinstance(key, basestring) for key in obj):
+            encoded = dict((key, _encode(value))
+                           for key, value in obj.items())
+            if '__type__' not in obj:
+                return encoded
+        return dict(__type__='dict',
+                    value=[[_encode(key), _encode(value)]
+                           for key, value in obj.items()])
+    if isinstance(obj, datetime):
+        if obj.tzinfo is not None:
+            raise TypeError('Timezone aware datetimes are not supported')
+        return dict(__type__='datetime',
+                    value=obj.strftime(DATETIME_FORMAT))
+    if isinstance(obj, timedelta):
+        return dict(__type__='timedelta',
+                    value=[obj.days, obj.seconds, obj.microseconds])
+    if isinstance(obj, uuid.UUID):
+        return dict(__type__='uuid', value=obj.hex)
+    if isinstance(obj, Enum):
+        enum_class = type(obj)
+        return dict(__type__='enum', value=[
+            '{0}.{1}'.format(enum_class.__module__, enum_class.__name__),
+            obj.value])
+    raise TypeError('Cannot encode {0!r} in a queue file'.format(obj))
+
+
+def _decode(obj):
+    # Reverse _encode().
+    if isinstance(obj, list):
+        return [_decode(item) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    kind = obj.get('__type__')
+    if kind is None:
+        return dict((key, _decode(value)) for key, value in obj.items())
+    value = obj['value']
+    if kind == 'bytes':
+        return base64.b64decode(value)
+    elif kind == 'tuple':
+        return tuple(_decode(item) for item in value)
+    elif kind == 'set':
+        return set(_decode(item) for item in value)
+    elif kind == 'frozenset':
+        return frozenset(_decode(item) for item in value)
+    elif kind == 'dict':
+        return dict((_decode(key), _decode(item)) for key, item in value)
+    elif kind == 'datetime':
+        return datetime.strptime(value, DATETIME_FORMAT)
+    elif kind == 'timedelta':
+        return timedelta(*value)
+    elif kind == 'uuid':
+        return uuid.UUID(hex=value)
+    elif kind == 'enum':
+        enum_path, enum_value = value
+        return find_name(enum_path)(enum_value)
+    raise ValueError('Unknown queue file type: {0}'.format(kind))
+
+
+
+def encode_metadata(data):
+    """Encode message metadata for a compact queue file.
+
+    :param data: The message metadata.
+    :type data: dict
+    :return: The encoded metadata, which contains no newlines.
+    :rtype: bytes
+    :raises TypeError: if the metadata contains a value which can't be
+        encoded.
+    """
+    return json.dumps(_encode(data), separators=(',', ':'))
+
+
+def decode_metadata(encoded):
+    """Decode message metadata from a compact queue file.
+
+    :param encoded: The encoded metadata.
+    :type encoded: bytes
+    :return: The message metadata.
+    :rtype: dict
+    """
+    return _decode(json.loads(encoded))
+
+
+
+def dump(fp, text, data):
+    """Write a compact queue file.
+
+    :param fp: The file to write to.
+    :param text: The raw message text.
+    :type text: bytes
+    :param data: The message metadata.
+    :type data: dict
+    :raises TypeError: if the metadata contains a value which can't be
+        encoded.  Nothing is written in that case.
+    """
+    encoded = encode_metadata(data)
+    fp.write(MAGIC)
+    fp.write(encoded)
+    fp.write(b'\n')
+    fp.write(text)
+
+
+def load(fp):
+    """Read a compact queue file.
+
+    :param fp: The file to read from, positioned just after the `MAGIC`
+        line.
+    :return: The raw message text and the message metadata.
+    :rtype: 2-tuple of (bytes, dict)
+    """
+    data = decode_metadata(fp.readline())
+    return fp.read(), data
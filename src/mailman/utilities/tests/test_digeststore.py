@@ -0,0 +1,180 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the digest store."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestDigestStore',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mailman.testing.helpers import (
+    LogFileMark, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.digeststore import DigestStore
+from mailman.utilities.mailbox import Mailbox
+
+
+
+def _message(i):
+    return mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: =?utf-8?q?Caf=C3=A9_{0}?=
+
+Message {0}
+""".format(i))
+
+
+
+class TestDigestStore(unittest.TestCase):
+    """Test the digest store."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._store = DigestStore(os.path.join(self._tempdir, 'digest'))
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_empty(self):
+        self.assertEqual(self._store.size, 0)
+        self.assertEqual(self._store.entries(), [])
+        self.assertEqual(list(self._store), [])
+
+    def test_add(self):
+        # The index records where each message is, and its decoded headers.
+        size_1 = self._store.add(_message(1))
+        size_2 = self._store.add(_message(2))
+        self.assertEqual(self._store.size, size_2)
+        entries = self._store.entries()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].offset, 0)
+        self.assertEqual(entries[0].size, size_1)
+        self.assertEqual(entries[1].offset, size_1)
+        self.assertEqual(entries[1].size, size_2 - size_1)
+        self.assertEqual(entries[1].subject, 'Caf\xe9 2')
+        self.assertEqual(entries[1].sender, 'anne@example.com')
+        messages = list(self._store)
+        self.assertEqual(messages[1]['subject'], '=?utf-8?q?Caf=C3=A9_2?=')
+        self.assertEqual(messages[1].get_payload(), 'Message 2\n')
+
+    def test_missing_headers(self):
+        self._store.add(mfs('\nNo headers\n'))
+        entry = self._store.entries()[0]
+        self.assertIsNone(entry.subject)
+        self.assertIsNone(entry.sender)
+
+    def test_concurrent_adds(self):
+        # Messages added at the same time don't overwrite each other.
+        def add(first):
+            for i in range(first, first + 50):
+                self._store.add(_message(i))
+        threads = [threading.Thread(target=add, args=(first,))
+                   for first in range(0, 200, 50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        subjects = set()
+        for entry, msg in self._store.iteritems():
+            self.assertEqual(msg.get_payload(),
+                             'Message {0}\n'.format(entry.subject[5:]))
+            subjects.add(entry.subject)
+        self.assertEqual(len(subjects), 200)
+
+    def test_cut(self):
+        # Cutting the store moves the collected messages to a new store, and
+        # starts a new collection.
+        self._store.add(_message(1))
+        cut = self._store.cut(os.path.join(self._tempdir, 'digest.1.1'))
+        self.assertEqual(len(cut), 1)
+        self.assertEqual(self._store.size, 0)
+        self._store.add(_message(2))
+        self.assertEqual([entry.subject for entry in cut.entries()],
+                         ['Caf\xe9 1'])
+        self.assertEqual([entry.subject for entry in self._store.entries()],
+                         ['Caf\xe9 2'])
+        cut.remove()
+        self.assertEqual(sorted(os.listdir(self._tempdir)),
+                         ['digest.idx', 'digest.lck', 'digest.seg'])
+
+    def test_cut_failure(self):
+        # When the index can't be moved, the cut is undone.
+        self._store.add(_message(1))
+        cut = DigestStore(os.path.join(self._tempdir, 'digest.1.1'))
+        # A file can't replace a directory.
+        os.mkdir(cut.index_path)
+        with self.assertRaises(OSError):
+            self._store.cut(cut.path)
+        self.assertFalse(os.path.exists(cut.segment_path))
+        self.assertEqual([entry.subject for entry in self._store.entries()],
+                         ['Caf\xe9 1'])
+        self.assertEqual(len(list(self._store)), 1)
+
+    def test_cut_threshold(self):
+        # The store isn't cut if it is smaller than the threshold.
+        size = self._store.add(_message(1))
+        path = os.path.join(self._tempdir, 'digest.1.1')
+        self.assertIsNone(self._store.cut(path, threshold=size + 1))
+        self.assertIsNotNone(self._store.cut(path, threshold=size))
+
+    def test_cut_empty(self):
+        # There's nothing to cut, except text which never got indexed.
+        self.assertIsNone(self._store.cut(self._store.path + '.cut'))
+        with open(self._store.segment_path, 'wb') as fp:
+            fp.write(b'Unindexed text')
+        self.assertIsNone(self._store.cut(self._store.path + '.cut'))
+        self.assertFalse(os.path.exists(self._store.segment_path))
+
+    def test_bad_index_record(self):
+        # A record left incomplete by a crash is skipped.
+        self._store.add(_message(1))
+        with open(self._store.index_path, 'ab') as fp:
+            fp.write(b'[1234,')
+        self._store.add(_message(2))
+        self._store.add(_message(3))
+        mark = LogFileMark('mailman.error')
+        subjects = [entry.subject for entry in self._store.entries()]
+        self.assertEqual(subjects, ['Caf\xe9 1', 'Caf\xe9 3'])
+        self.assertIn('Bad digest index record', mark.readline())
+
+    def test_add_mailbox(self):
+        # The messages of a mailbox are moved into the store, after any
+        # messages already there.
+        self._store.add(_message(1))
+        path = os.path.join(self._tempdir, 'digest.mmdf')
+        with Mailbox(path, create=True) as mailbox:
+            mailbox.add(_message(2).as_string())
+            mailbox.add(_message(3).as_string())
+        self.assertEqual(self._store.add_mailbox(path), 2)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([entry.subject for entry in self._store.entries()],
+                         ['Caf\xe9 1', 'Caf\xe9 2', 'Caf\xe9 3'])
+        # There's nothing left to move.
+        self.assertIsNone(self._store.add_mailbox(path))
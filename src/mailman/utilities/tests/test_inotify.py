@@ -0,0 +1,88 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test waiting for files to arrive in a directory."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestDirectoryWatcher',
+    ]
+
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mailman.utilities.inotify import DirectoryWatcher
+
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'Linux only')
+class TestDirectoryWatcher(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._watcher = DirectoryWatcher(self._directory, '.pck')
+        self.addCleanup(self._watcher.close)
+
+    def _arrive(self, filename):
+        # Write the file and move it into place, like the switchboard does.
+        tmpfile = os.path.join(self._directory, filename + '.tmp')
+        with open(tmpfile, 'w') as fp:
+            fp.write('data')
+        os.rename(tmpfile, os.path.join(self._directory, filename))
+
+    def test_active(self):
+        self.assertTrue(self._watcher.active)
+
+    def test_timeout(self):
+        self.assertFalse(self._watcher.wait(0.01))
+
+    def test_file_arrived_before_wait(self):
+        self._arrive('one.pck')
+        self.assertTrue(self._watcher.wait(0))
+        # The event has been used up.
+        self.assertFalse(self._watcher.wait(0))
+
+    def test_file_arrives_during_wait(self):
+        timer = threading.Timer(0.1, self._arrive, ('one.pck',))
+        timer.start()
+        self.addCleanup(timer.join)
+        start = time.time()
+        self.assertTrue(self._watcher.wait(10))
+        self.assertLess(time.time() - start, 5)
+
+    def test_other_extension(self):
+        # Files with other extensions, such as the .bak files which the
+        # runners create while processing the queue, are ignored.
+        self._arrive('one.bak')
+        self.assertFalse(self._watcher.wait(0.01))
+
+    def test_missing_directory(self):
+        # When the directory can't be watched, waiting just sleeps.
+        watcher = DirectoryWatcher(os.path.join(self._directory, 'missing'))
+        self.assertFalse(watcher.active)
+        start = time.time()
+        self.assertFalse(watcher.wait(0.05))
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        watcher.close()
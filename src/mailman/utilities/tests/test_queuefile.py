@@ -0,0 +1,82 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the compact queue file format."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestQueueFile',
+    ]
+
+
+import uuid
+import unittest
+
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from mailman.interfaces.member import DeliveryMode
+from mailman.utilities.queuefile import (
+    MAGIC, decode_metadata, dump, encode_metadata, load)
+
+
+
+class TestQueueFile(unittest.TestCase):
+    def _round_trip(self, data):
+        encoded = encode_metadata(data)
+        self.assertNotIn(b'\n', encoded)
+        return decode_metadata(encoded)
+
+    def test_simple_types(self):
+        data = dict(listname='test@example.com', count=3, ratio=0.5,
+                    flag=True, nothing=None, names=['anne', 'bart'])
+        self.assertEqual(self._round_trip(data), data)
+
+    def test_typed_values(self):
+        data = dict(
+            received_time=datetime(2014, 11, 1, 12, 30, 15, 123),
+            lifetime=timedelta(days=1, seconds=2, microseconds=3),
+            recipients=set(['anne@example.com']),
+            frozen=frozenset([1, 2]),
+            pair=('a', 1),
+            raw=b'\xff\x00',
+            token=uuid.UUID(int=12345),
+            mode=DeliveryMode.summary_digests,
+            )
+        decoded = self._round_trip(data)
+        self.assertEqual(decoded, data)
+        for key in data:
+            self.assertIs(type(decoded[key]), type(data[key]))
+
+    def test_unusual_dictionaries(self):
+        # Dictionaries with non-string keys, or which could be confused with
+        # encoded values, survive too.
+        data = dict(numbers={1: 'one'}, tricky={'__type__': 'set'})
+        self.assertEqual(self._round_trip(data), data)
+
+    def test_unencodable(self):
+        self.assertRaises(TypeError, encode_metadata, dict(thing=object()))
+
+    def test_dump_and_load(self):
+        fp = StringIO()
+        text = b'From: anne@example.com\n\nA message.\n'
+        dump(fp, text, dict(listname='test@example.com'))
+        fp.seek(0)
+        self.assertEqual(fp.readline(), MAGIC)
+        self.assertEqual(load(fp), (text, dict(listname='test@example.com')))